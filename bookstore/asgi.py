@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookstore.settings')
+# Serve the hot catalog reads from the async views (store.async_views)
+os.environ.setdefault('ASYNC_CATALOG_VIEWS', 'true')
 
 application = get_asgi_application()
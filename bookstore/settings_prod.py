@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -53,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'store.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'bookstore.urls'
@@ -76,20 +78,100 @@ TEMPLATES = [
 WSGI_APPLICATION = 'bookstore.wsgi.application'
 
 # Production Database settings for AWS RDS
+DB_POOL = get_env_var('DB_POOL', 'true').lower() in ['true', '1', 'yes']
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # django.db.backends.postgresql plus connection metrics
+        'ENGINE': 'store.postgresql',
         'NAME': get_env_var('POSTGRES_DB'),
         'USER': get_env_var('POSTGRES_USER'),
         'PASSWORD': get_env_var('POSTGRES_PASSWORD'),
         'HOST': get_env_var('POSTGRES_HOST'),
         'PORT': get_env_var('POSTGRES_PORT'),
+        'CONN_MAX_AGE': 0 if DB_POOL else int(get_env_var('DB_CONN_MAX_AGE', '600')),
+        # Check connections before reuse (and before handing them out of the pool)
+        'CONN_HEALTH_CHECKS': True,
         'OPTIONS': {
             'sslmode': os.getenv("POSTGRES_SSLMODE", "require")
         },
     }
 }
 
+# Connection pooling (psycopg_pool), one pool per worker process. A sync
+# gunicorn worker uses one connection at a time, an ASGI worker one per
+# thread running sync code; keep workers * DB_POOL_MAX_SIZE under the
+# server's max_connections. Connections are replaced after
+# DB_POOL_MAX_LIFETIME seconds, or DB_POOL_MAX_IDLE idle; requests give up
+# after waiting DB_POOL_TIMEOUT. With DB_POOL=false each thread keeps its
+# own connection for DB_CONN_MAX_AGE seconds instead.
+if DB_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(get_env_var('DB_POOL_MIN_SIZE', '1')),
+        'max_size': int(get_env_var('DB_POOL_MAX_SIZE', '4')),
+        'timeout': float(get_env_var('DB_POOL_TIMEOUT', '10')),
+        'max_lifetime': float(get_env_var('DB_POOL_MAX_LIFETIME', '1800')),
+        'max_idle': float(get_env_var('DB_POOL_MAX_IDLE', '300')),
+    }
+
+# Read replicas (store.routers): POSTGRES_REPLICA_HOSTS is a comma-separated
+# list of hosts replicating the primary, reached with its credentials. Safe
+# catalog and review reads go to a replica; a user who writes reads from the
+# primary for the next REPLICA_PIN_SECONDS.
+REPLICA_HOSTS = [host.strip() for host in get_env_var('POSTGRES_REPLICA_HOSTS', '').split(',') if host.strip()]
+for number, host in enumerate(REPLICA_HOSTS, 1):
+    DATABASES[f'replica{number}'] = dict(
+        DATABASES['default'], HOST=host, OPTIONS=dict(DATABASES['default']['OPTIONS']),
+        TEST={'MIRROR': 'default'},
+    )
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['store.routers.ReplicaRouter']
+REPLICA_PIN_CACHE_ALIAS = 'default'
+REPLICA_PIN_SECONDS = int(get_env_var('REPLICA_PIN_SECONDS', '10'))
+
+# Cache shared by all workers, e.g. django.core.cache.backends.redis.RedisCache
+# with CACHE_LOCATION=redis://host:6379/0. Falls back to per-process memory.
+CACHES = {
+    'default': {
+        'BACKEND': get_env_var('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': get_env_var('CACHE_LOCATION', ''),
+    }
+}
+
+# Read-through cache for public catalog responses (store.cache)
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = int(get_env_var('CATALOG_CACHE_TIMEOUT', '300'))
+
+# Per-user token checks cached by store.authentication; saving or deleting a
+# user drops its entry, other processes see the change within the timeout
+AUTH_USER_CACHE_ALIAS = 'default'
+AUTH_USER_CACHE_TIMEOUT = int(get_env_var('AUTH_USER_CACHE_TIMEOUT', '60'))
+
+# Checkout stock holds (store.reservations), in seconds. `run_jobs` workers
+# return expired ones every STOCK_RESERVATION_RELEASE_INTERVAL seconds
+# (0 disables; `manage.py release_reservations` does it once). A user holds
+# at most STOCK_RESERVATION_MAX_QUANTITY units of each book (0: no limit).
+STOCK_RESERVATION_TTL = int(get_env_var('STOCK_RESERVATION_TTL', '600'))
+STOCK_RESERVATION_MAX_TTL = 1800
+STOCK_RESERVATION_MAX_QUANTITY = int(get_env_var('STOCK_RESERVATION_MAX_QUANTITY', '10'))
+STOCK_RESERVATION_RELEASE_INTERVAL = int(get_env_var('STOCK_RESERVATION_RELEASE_INTERVAL', '60'))
+
+# Background jobs (store.jobs), run by `manage.py run_jobs` workers. Failed
+# jobs are retried after JOB_RETRY_DELAY seconds, doubling up to
+# JOB_MAX_RETRY_DELAY, and kept as failed after JOB_MAX_ATTEMPTS tries.
+JOB_MAX_ATTEMPTS = int(get_env_var('JOB_MAX_ATTEMPTS', '5'))
+JOB_RETRY_DELAY = 10
+JOB_MAX_RETRY_DELAY = 3600
+
+# Request metrics served at /metrics (store.metrics). With METRICS_DIR set,
+# each worker writes its totals there so the endpoint can sum all workers.
+METRICS_DIR = get_env_var('METRICS_DIR', '') or None
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = get_env_var('METRICS_TOKEN', '')
+
+# Route book/category/review reads to the async views in store.async_views.
+# Set by bookstore/asgi.py; sync WSGI workers keep the sync views.
+ASYNC_CATALOG_VIEWS = get_env_var('ASYNC_CATALOG_VIEWS', '').lower() in ['true', '1', 'yes']
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -115,7 +197,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # DRF settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'store.authentication.ClaimsJWTAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
@@ -130,6 +212,9 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    # Tokens carry username/is_staff and a password fingerprint (store.authentication)
+    'TOKEN_OBTAIN_SERIALIZER': 'store.authentication.ClaimsTokenObtainPairSerializer',
+    'CHECK_REVOKE_TOKEN': True,
 }
 
 # Production-specific security settings
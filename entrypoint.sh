@@ -1,9 +1,42 @@
 #!/bin/sh
 set -e
 
+# Per-process metrics, summed by /metrics. Every process writing here (web
+# workers and the job worker) must share this directory with the web server.
+export METRICS_DIR="${METRICS_DIR:-/tmp/bookstore-metrics}"
+mkdir -p "$METRICS_DIR"
+
+# An explicit command (e.g. docker-compose `command:`) replaces the server
+if [ "$#" -gt 0 ]; then
+    exec "$@"
+fi
+
+# SERVER_MODE=worker runs only the background job worker (store.jobs), for a
+# separate container or instance sharing the database
+if [ "$SERVER_MODE" = "worker" ]; then
+    exec python manage.py run_jobs
+fi
+
 # Run Django maintenance commands
 python manage.py collectstatic --noinput
 python manage.py migrate --noinput
 
-# Start Gunicorn
-exec gunicorn bookstore.wsgi:application --bind 0.0.0.0:${PORT:-8000} --workers 3 --timeout 120
+# Start each server boot from zero
+rm -rf "$METRICS_DIR"/*
+
+# Checkout leaves the sales rollups to the job worker. Unless a separate
+# worker runs (RUN_JOBS_WORKER=false), keep one alongside the web server,
+# restarted if it exits, so single-container deployments (Elastic
+# Beanstalk) process jobs too.
+if [ "${RUN_JOBS_WORKER:-true}" != "false" ]; then
+    (while true; do python manage.py run_jobs || true; sleep 5; done) &
+fi
+
+# Start Gunicorn; SERVER_MODE=asgi serves the async catalog views through uvicorn workers.
+# Each worker keeps its own database pool of up to DB_POOL_MAX_SIZE connections.
+WORKERS="${GUNICORN_WORKERS:-3}"
+if [ "$SERVER_MODE" = "asgi" ]; then
+    exec gunicorn bookstore.asgi:application --bind 0.0.0.0:${PORT:-8000} --workers "$WORKERS" --timeout 120 \
+        --worker-class uvicorn.workers.UvicornWorker
+fi
+exec gunicorn bookstore.wsgi:application --bind 0.0.0.0:${PORT:-8000} --workers "$WORKERS" --timeout 120
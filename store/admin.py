@@ -1,4 +1,4 @@
 from django.contrib import admin
-from .models import Category, Book, Review, Order, OrderItem, Profile
+from .models import Category, Book, Review, Order, OrderItem, Profile, Job
 
-admin.site.register([Category, Book, Review, Order, OrderItem, Profile])
+admin.site.register([Category, Book, Review, Order, OrderItem, Profile, Job])
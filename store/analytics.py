@@ -0,0 +1,278 @@
+"""
+Daily sales rollups and the queries behind the staff analytics endpoints.
+
+DailySales holds orders, units and revenue per (day, status) and
+DailyBookSales the same per (day, book). Changes to orders and order items
+(wired up in store.signals) become signed deltas written with one
+INSERT ... ON CONFLICT DO UPDATE per table, adding to the stored totals,
+so concurrent orders never overwrite each other's counts. Placed orders
+are recorded off the checkout path, by the `sales.record_placed` job
+(store.jobs), several orders per upsert; deleting an order or item before
+its job ran amends the job instead (`placement_job()`). `backfill()`
+rebuilds a date range from order history.
+"""
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from django.db import connections, router, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+from .jobs import task
+from .models import Book, DailyBookSales, DailySales, Job, Order, OrderItem
+
+INTERVALS = {'day': None, 'week': TruncWeek, 'month': TruncMonth}
+UPSERT_BATCH_SIZE = 500
+
+
+def sales_day(moment):
+    # Days follow the current time zone, as TruncDate does in backfill()
+    return timezone.localdate(moment) if timezone.is_aware(moment) else moment.date()
+
+
+def upsert(model, keys, inserted, increments, rows, using):
+    """
+    Insert `rows` (tuples of keys + inserted + increments column values)
+    or add their increments to the existing row with the same keys.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = keys + inserted + increments
+    fields = [model._meta.get_field(column) for column in columns]
+    assignments = ', '.join(f'{quote(column)} = {table}.{quote(column)} + EXCLUDED.{quote(column)}' for column in increments)
+    target = ', '.join(quote(column) for column in keys)
+    row_sql = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            params = [
+                field.get_db_prep_value(value, connection, prepared=False)
+                for row in batch for field, value in zip(fields, row)
+            ]
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(quote(column) for column in columns)}) '
+                f'VALUES {", ".join([row_sql] * len(batch))} '
+                f'ON CONFLICT ({target}) DO UPDATE SET {assignments}',
+                params,
+            )
+
+
+class Deltas:
+    """
+    Signed changes to the rollup rows, combined per row and written by
+    `apply()`. Rows are written in key order so concurrent writers lock
+    them in the same order.
+    """
+    def __init__(self):
+        self.daily = defaultdict(lambda: [0, 0, Decimal(0)])
+        self.books = {}
+
+    def add_order(self, day, status, sign=1):
+        self.daily[day, status][0] += sign
+
+    def add_item(self, day, status, book_id, category_id, quantity, price, sign=1):
+        units = quantity * sign
+        revenue = Decimal(price) * units
+        totals = self.daily[day, status]
+        totals[1] += units
+        totals[2] += revenue
+        totals = self.books.setdefault((day, book_id), [category_id, 0, 0, Decimal(0)])
+        totals[1] += sign
+        totals[2] += units
+        totals[3] += revenue
+
+    def apply(self, using=None):
+        using = using or router.db_for_write(DailySales)
+        daily = [key + tuple(totals) for key, totals in sorted(self.daily.items()) if any(totals)]
+        books = [key + tuple(totals) for key, totals in sorted(self.books.items()) if any(totals[1:])]
+        if daily:
+            upsert(DailySales, ['day', 'status'], [], ['orders', 'units', 'revenue'], daily, using)
+        # Removals only update existing rows: when a book is deleted its
+        # items and rollup rows go together, and an upsert would recreate one
+        additions = [row for row in books if row[4] > 0 or row[3] > 0]
+        if additions:
+            upsert(DailyBookSales, ['day', 'book_id'], ['category_id'], ['orders', 'units', 'revenue'], additions, using)
+        for day, book_id, _, orders, units, revenue in books:
+            if orders <= 0 and units <= 0:
+                DailyBookSales.objects.using(using).filter(day=day, book_id=book_id).update(
+                    orders=F('orders') + orders, units=F('units') + units, revenue=F('revenue') + revenue,
+                )
+
+
+def record_order(order, sign=1):
+    deltas = Deltas()
+    deltas.add_order(sales_day(order.order_date), order.status, sign)
+    deltas.apply()
+
+
+def record_items(order, items, sign=1, count_order=False):
+    """
+    Add (or with sign=-1, remove) order items, and the order itself with
+    `count_order`. Items need `book` loaded or its category costs a query
+    each.
+    """
+    deltas = Deltas()
+    day = sales_day(order.order_date)
+    if count_order:
+        deltas.add_order(day, order.status, sign)
+    for item in items:
+        deltas.add_item(day, order.status, item.book_id, item.book.category_id, item.quantity, item.price_at_purchase, sign)
+    deltas.apply()
+
+
+def placed_order_payload(order, items):
+    """
+    Job payload recording a placed order: its id, day and status at
+    placement and each item's book, category, quantity and price. Deltas
+    add up in any order, so a status change processed before the job still
+    nets out.
+    """
+    return {
+        'order': order.pk,
+        'day': sales_day(order.order_date).isoformat(),
+        'status': order.status,
+        'items': [[item.book_id, item.book.category_id, item.quantity, str(item.price_at_purchase)] for item in items],
+    }
+
+
+@task('sales.record_placed', batch_size=200)
+def record_placed(payloads):
+    # Orders deleted without signals (e.g. raw SQL) were never subtracted
+    order_ids = {payload['order'] for payload in payloads if 'order' in payload}
+    existing = set(Order.objects.filter(pk__in=order_ids).values_list('pk', flat=True))
+    payloads = [payload for payload in payloads if 'order' not in payload or payload['order'] in existing]
+    deltas = Deltas()
+    for payload in payloads:
+        day = date.fromisoformat(payload['day'])
+        deltas.add_order(day, payload['status'])
+        for book_id, category_id, quantity, price in payload['items']:
+            deltas.add_item(day, payload['status'], book_id, category_id, quantity, Decimal(price))
+    # Books deleted since the order took their rollup rows with them
+    existing = set(Book.objects.filter(pk__in={book_id for _, book_id in deltas.books}).values_list('pk', flat=True))
+    deltas.books = {key: totals for key, totals in deltas.books.items() if key[1] in existing}
+    deltas.apply()
+
+
+def placement_job(order_id):
+    """
+    The order's `sales.record_placed` job, locked, if it hasn't been
+    applied yet. Blocks while a worker runs it, until it is done (and gone).
+    Call in a transaction.
+    """
+    return Job.objects.select_for_update().filter(task='sales.record_placed', payload__order=order_id).first()
+
+
+def move_status(order_ids, from_status, to_status):
+    """
+    Move the orders, units and revenue of `order_ids` from one status to
+    another, with one aggregate query each for orders and items.
+    """
+    if from_status == to_status:
+        return
+    deltas = Deltas()
+    orders = (
+        Order.objects.filter(pk__in=order_ids).order_by()
+        .values(day=TruncDate('order_date')).annotate(count=Count('pk'))
+    )
+    for row in orders:
+        deltas.daily[row['day'], from_status][0] -= row['count']
+        deltas.daily[row['day'], to_status][0] += row['count']
+    items = (
+        OrderItem.objects.filter(order_id__in=order_ids).order_by()
+        .values(day=TruncDate('order__order_date'))
+        .annotate(units=Sum('quantity'), revenue=Sum(F('quantity') * F('price_at_purchase')))
+    )
+    for row in items:
+        for status, sign in ((from_status, -1), (to_status, 1)):
+            totals = deltas.daily[row['day'], status]
+            totals[1] += row['units'] * sign
+            totals[2] += row['revenue'] * sign
+    deltas.apply()
+
+
+def backfill(start=None, end=None, batch_size=5000):
+    """
+    Recompute the rollups of days `start`..`end` (inclusive; open-ended if
+    None) from order history. Orders placed while it runs may be counted
+    twice or not at all for the current day, so run it for closed days or
+    when the store is quiet. Returns the number of rows written.
+    """
+    days = {}
+    if start:
+        days['day__gte'] = start
+    if end:
+        days['day__lte'] = end
+    orders = Order.objects.order_by().annotate(day=TruncDate('order_date')).filter(**days)
+    items = OrderItem.objects.order_by().annotate(day=TruncDate('order__order_date')).filter(**days)
+    daily = {}
+    for row in orders.values('day', 'status').annotate(count=Count('pk')):
+        daily[row['day'], row['status']] = DailySales(day=row['day'], status=row['status'], orders=row['count'])
+    for row in items.values('day', 'order__status').annotate(
+        units=Sum('quantity'), revenue=Sum(F('quantity') * F('price_at_purchase')),
+    ):
+        sales = daily.setdefault((row['day'], row['order__status']), DailySales(day=row['day'], status=row['order__status']))
+        sales.units = row['units']
+        sales.revenue = row['revenue']
+    books = (
+        items.values('day', 'book_id', 'book__category_id')
+        .annotate(orders=Count('order_id', distinct=True), units=Sum('quantity'),
+                  revenue=Sum(F('quantity') * F('price_at_purchase')))
+        .iterator(chunk_size=batch_size)
+    )
+    with transaction.atomic():
+        DailySales.objects.filter(**days).delete()
+        DailyBookSales.objects.filter(**days).delete()
+        DailySales.objects.bulk_create(daily.values(), batch_size=batch_size)
+        written = len(daily)
+        batch = []
+        for row in books:
+            batch.append(DailyBookSales(
+                day=row['day'], book_id=row['book_id'], category_id=row['book__category_id'],
+                orders=row['orders'], units=row['units'], revenue=row['revenue'],
+            ))
+            if len(batch) == batch_size:
+                DailyBookSales.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        DailyBookSales.objects.bulk_create(batch)
+        written += len(batch)
+    return written
+
+
+def period(interval):
+    trunc = INTERVALS[interval]
+    return F('day') if trunc is None else trunc('day')
+
+
+def revenue_series(start, end, interval='day', statuses=None):
+    queryset = DailySales.objects.filter(day__range=(start, end))
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    return (
+        queryset.values(period=period(interval))
+        .annotate(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('period')
+    )
+
+
+def category_series(start, end, interval='day', category=None):
+    queryset = DailyBookSales.objects.filter(day__range=(start, end))
+    if category is not None:
+        queryset = queryset.filter(category_id=category)
+    return (
+        queryset.values('category_id', period=period(interval), category_name=F('category__name'))
+        .annotate(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('period', 'category_name')
+    )
+
+
+def bestsellers(start, end, limit=10, category=None, rank_by='units'):
+    queryset = DailyBookSales.objects.filter(day__range=(start, end))
+    if category is not None:
+        queryset = queryset.filter(category_id=category)
+    return (
+        queryset.values('book_id', title=F('book__title'), author=F('book__author'))
+        .annotate(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'))
+        .order_by(f'-{rank_by}', 'book_id')[:limit]
+    )
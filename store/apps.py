@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class StoreConfig(AppConfig):
@@ -7,3 +8,4 @@ class StoreConfig(AppConfig):
 
     def ready(self):
         import store.signals
+        post_migrate.connect(store.signals.repair_search_index, sender=self)
@@ -0,0 +1,159 @@
+"""
+Async versions of the hot catalog read endpoints.
+
+Each class subclasses the sync view it stands in for, so querysets, filter
+backends, pagination, permissions and serializers are shared and only the
+read actions are reimplemented on the async ORM. Requests for any other
+method (the staff writes on /books/, for instance) run the inherited sync
+code in a worker thread. store.urls routes these instead of the sync views
+when settings.ASYNC_CATALOG_VIEWS is on, which bookstore/asgi.py enables.
+"""
+import functools
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse
+from rest_framework.response import Response
+from .cache import cached_response
+from .conditional import conditional_response
+from .filters import facet_query, summarize_facets
+from .models import Review
+from .pagination import AsyncPageNumberPagination
+from .views import BookReviewListView, BookViewSet, CategoryViewSet
+
+
+def rendered(response):
+    # Hand Django a plain HttpResponse; a DRF Response would be rendered by
+    # the async handler in a thread, costing a hop per request
+    response.render()
+    plain = HttpResponse(response.content, status=response.status_code)
+    for header, value in response.items():
+        plain[header] = value
+    return plain
+
+
+class AsyncAPIViewMixin:
+    """
+    APIView.dispatch for views whose handlers are coroutines.
+
+    Authentication and permission checks run inline when the request
+    carries no credentials (nothing to look up), and in a thread otherwise.
+    """
+    @classmethod
+    def as_view(cls, *args, **initkwargs):
+        view = super().as_view(*args, **initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            return await view(request, *args, **kwargs)
+        # Keeps cls, initkwargs, actions and csrf_exempt for routers and schemas
+        return functools.update_wrapper(async_view, view)
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = getattr(self, request.method.lower(), None)
+        if not iscoroutinefunction(handler):
+            return await sync_to_async(self.sync_dispatch)(request, *args, **kwargs)
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return rendered(self.response)
+
+    def sync_dispatch(self, request, *args, **kwargs):
+        return rendered(super().dispatch(request, *args, **kwargs))
+
+    async def ainitial(self, request, *args, **kwargs):
+        has_credentials = (
+            'HTTP_AUTHORIZATION' in request.META or settings.SESSION_COOKIE_NAME in request.COOKIES
+        )
+        if has_credentials:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+        else:
+            self.initial(request, *args, **kwargs)
+
+    async def afilter_queryset(self, queryset):
+        # Filter backends only touch the database to validate parameters
+        # (e.g. a category id), so a request without any stays inline
+        if self.request.query_params:
+            return await sync_to_async(self.filter_queryset)(queryset)
+        return self.filter_queryset(queryset)
+
+    async def aget_object(self):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+
+class AsyncListModelMixin:
+    async def list(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer([obj async for obj in queryset], many=True).data)
+
+
+class AsyncRetrieveModelMixin:
+    async def retrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(self.get_serializer(instance).data)
+
+
+# Public: Book list and detail (writes fall back to BookViewSet)
+class AsyncBookViewSet(AsyncAPIViewMixin, BookViewSet):
+    @conditional_response
+    @cached_response
+    async def list(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        if self.wants_facets():
+            response.data['facets'] = summarize_facets([row async for row in facet_query(queryset)])
+        return response
+
+    @conditional_response
+    @cached_response
+    async def retrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        data = self.get_serializer(instance).data
+        if self.wants_reviews():
+            paginator = self.get_review_paginator(instance)
+            reviews = await paginator.apaginate_from(Review.objects.filter(book=instance))
+            self.embed_reviews(data, reviews, paginator)
+        return Response(data)
+
+
+# Public: Category list and detail (writes fall back to CategoryViewSet)
+class AsyncCategoryViewSet(AsyncAPIViewMixin, AsyncListModelMixin, AsyncRetrieveModelMixin, CategoryViewSet):
+    pagination_class = AsyncPageNumberPagination
+
+    @conditional_response
+    @cached_response
+    async def list(self, request, *args, **kwargs):
+        return await super().list(request, *args, **kwargs)
+
+    @conditional_response
+    @cached_response
+    async def retrieve(self, request, *args, **kwargs):
+        return await super().retrieve(request, *args, **kwargs)
+
+
+# Public: Reviews of a book
+class AsyncBookReviewListView(AsyncAPIViewMixin, AsyncListModelMixin, BookReviewListView):
+    async def get(self, request, *args, **kwargs):
+        return await self.list(request, *args, **kwargs)
+
+    @cached_response
+    async def list(self, request, *args, **kwargs):
+        return await super().list(request, *args, **kwargs)
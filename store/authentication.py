@@ -0,0 +1,115 @@
+"""
+JWT authentication that builds request.user from the token's signed claims.
+
+simplejwt's JWTAuthentication loads the User row on every request. Tokens
+issued here also carry `username` and `is_staff`, and ClaimsJWTAuthentication
+turns them into a ClaimsUser without touching the users table. Revocation
+still works: each token is checked against a small per-user state (active
+flag, claims, password fingerprint) cached for AUTH_USER_CACHE_TIMEOUT
+seconds and dropped as soon as the user is saved or deleted, so a
+deactivated account, a password change or a change of staff status rejects
+existing tokens. Tokens issued before the claims were added fall back to the
+database lookup.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+USER_CLAIMS = ('username', 'is_staff')
+CACHE_PREFIX = 'auth:user'
+
+
+def get_cache():
+    return caches[getattr(settings, 'AUTH_USER_CACHE_ALIAS', 'default')]
+
+
+def state_key(user_id):
+    return f'{CACHE_PREFIX}:{user_id}'
+
+
+def user_state(user):
+    return {
+        'username': user.username,
+        'is_staff': user.is_staff,
+        'is_active': user.is_active,
+        'password': get_md5_hash_password(user.password),
+    }
+
+
+def get_user_state(user_id):
+    """
+    Cached authentication state of a user, or None if there is no such
+    user. Missing users are cached too, so a token for a deleted account
+    doesn't cost a query per request.
+    """
+    cache = get_cache()
+    key = state_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        user = User.objects.filter(pk=user_id).only('username', 'is_staff', 'is_active', 'password').first()
+        state = user_state(user) if user else {}
+        cache.set(key, state, timeout=getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60))
+    return state or None
+
+
+def forget_user(user_id):
+    # The next request re-reads the user, so revocation applies at once
+    get_cache().delete(state_key(user_id))
+
+
+class ClaimsUser(TokenUser):
+    """
+    Stand-in for the User of a token, with `id`, `pk`, `username` and
+    `is_staff` from its claims. Use `user_id=request.user.pk` in queries;
+    `instance` loads the full model for code that needs it.
+    """
+    @cached_property
+    def instance(self):
+        return User.objects.get(pk=self.pk)
+
+
+class ClaimsRefreshToken(RefreshToken):
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for claim in USER_CLAIMS:
+            token[claim] = getattr(user, claim)
+        return token
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    # Access tokens minted from the refresh token copy its claims
+    token_class = ClaimsRefreshToken
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication returning a ClaimsUser checked against the cached
+    user state instead of a User loaded from the database.
+    """
+    def get_user(self, validated_token):
+        if any(claim not in validated_token for claim in USER_CLAIMS):
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        state = get_user_state(user_id)
+        if state is None:
+            raise AuthenticationFailed("User not found", code='user_not_found')
+        if api_settings.CHECK_USER_IS_ACTIVE and not state['is_active']:
+            raise AuthenticationFailed("User is inactive", code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != state['password']:
+            raise AuthenticationFailed("The user's password has been changed.", code='password_changed')
+        if any(validated_token[claim] != state[claim] for claim in USER_CLAIMS):
+            raise AuthenticationFailed("Token claims are out of date; sign in again.", code='claims_changed')
+        return ClaimsUser(validated_token)
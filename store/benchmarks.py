@@ -0,0 +1,459 @@
+"""
+Endpoint benchmarks driven through the Django test client.
+
+Used by the `benchmark_api` management command against a database seeded
+with `seed_catalog`. Each scenario records wall-clock latency percentiles
+and the number of SQL queries per request.
+"""
+import asyncio
+import contextlib
+import copy
+import csv
+import importlib.util
+import io
+import json
+import math
+import platform
+import time
+import uuid
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, reverse
+from django.utils import timezone
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient
+from .authentication import ClaimsRefreshToken
+from .feeds import FEED_FIELDS
+from .models import Book, Order, OrderItem, Review, StockReservation
+from .reservations import reserve
+
+
+def percentile(samples, pct):
+    """
+    Nearest-rank percentile of a non-empty list.
+    """
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(timings):
+    return {
+        'samples': len(timings),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+def route_names(patterns, namespace=''):
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            prefix = f'{pattern.namespace}:' if pattern.namespace else namespace
+            names |= route_names(pattern.url_patterns, prefix)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(namespace + pattern.name)
+    return names
+
+
+@contextlib.contextmanager
+def capture_queries():
+    with contextlib.ExitStack() as stack:
+        contexts = [stack.enter_context(CaptureQueriesContext(connection)) for connection in connections.all()]
+        yield contexts
+
+
+class Scenario:
+    """
+    One request shape. `data` may be a callable taking the iteration number,
+    for payloads that must be unique. Write scenarios run inside a
+    transaction that is rolled back, so the dataset is not modified.
+    """
+    def __init__(self, name, route, path, method='get', auth=None, data=None, write=False, format='json'):
+        self.name = name
+        self.route = route
+        self.path = path
+        self.method = method
+        self.auth = auth
+        self.data = data
+        self.write = write
+        self.format = format
+
+
+class BenchmarkContext:
+    """
+    Sample objects and credentials picked from the seeded database.
+    """
+    def __init__(self, password):
+        self.password = password
+        self.book = Book.objects.filter(stock__gt=0).order_by('-review_count', 'pk').first()
+        self.order = Order.objects.order_by('-pk').first()
+        if self.book is None or self.order is None:
+            raise ValueError("The database has no books or orders; run seed_catalog first.")
+        self.user = self.order.user
+        self.review = Review.objects.filter(book=self.book).order_by('-pk').first()
+        self.staff, _ = User.objects.get_or_create(username='bench_staff', defaults={'is_staff': True})
+        # A purchased book the user has not reviewed yet, for review creation
+        self.unreviewed = OrderItem.objects.filter(order__user=self.user).exclude(
+            Exists(Review.objects.filter(user=OuterRef('order__user'), book=OuterRef('book')))
+        ).values_list('book_id', flat=True).first()
+        # A live hold to read back; it expires and is released like any other
+        self.reservation = StockReservation.objects.filter(user=self.user, expires_at__gt=timezone.now()).first()
+        if self.reservation is None:
+            self.reservation = reserve(self.user.pk, {self.book.pk: 1}, ttl=1800)[0]
+        self.tokens = {
+            'user': str(ClaimsRefreshToken.for_user(self.user).access_token),
+            'staff': str(ClaimsRefreshToken.for_user(self.staff).access_token),
+        }
+        self.refresh = str(ClaimsRefreshToken.for_user(self.user))
+
+
+def import_feed(book, rows=100):
+    # The sample book (an update) followed by new titles in its category
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FEED_FIELDS)
+    category = book.category.name
+    writer.writerow([book.ISBN, book.title, book.author, category, book.price, book.stock, book.published_date])
+    for n in range(rows - 1):
+        writer.writerow([f'978{n:010d}', f'Benchmark Title {n}', 'Bench Author', category, '9.99', 5, '2020-01-01'])
+    return buffer.getvalue().encode('utf-8')
+
+
+def build_scenarios(ctx):
+    book, order = ctx.book, ctx.order
+    last_page = max(1, math.ceil(Book.objects.count() / api_settings.PAGE_SIZE))
+    scenarios = [
+        Scenario('api-root', 'api-root', reverse('api-root')),
+        Scenario('book-list', 'book-list', reverse('book-list')),
+        Scenario('book-list:last-page', 'book-list', reverse('book-list') + f'?page={last_page}&ordering=-price'),
+        Scenario('book-list:cursor', 'book-list', reverse('book-list') + '?pagination=cursor&ordering=-price'),
+        Scenario('book-list:search', 'book-list', reverse('book-list') + '?q=shadow%20river&ordering=relevance'),
+        Scenario('book-list:isbn', 'book-list', reverse('book-list') + f'?q={book.ISBN}'),
+        Scenario('book-list:filtered', 'book-list', reverse('book-list') + f'?category={book.category_id}&ordering=-average_rating'),
+        Scenario('book-detail', 'book-detail', reverse('book-detail', args=[book.pk])),
+        Scenario('book-export', 'book-export', reverse('book-export') + f'?category={book.category_id}', auth='staff'),
+        Scenario('book-import', 'book-import', reverse('book-import'), method='post', auth='staff', write=True,
+                 format='multipart', data=lambda i: {'file': SimpleUploadedFile('feed.csv', import_feed(book))}),
+        Scenario('book-review-list', 'book-review-list', reverse('book-review-list', args=[book.pk])),
+        Scenario('category-list', 'category-list', reverse('category-list')),
+        Scenario('category-detail', 'category-detail', reverse('category-detail', args=[book.category_id])),
+        Scenario('review-list', 'review-list', reverse('review-list')),
+        Scenario('order-list', 'order-list', reverse('order-list'), auth='user'),
+        Scenario('order-list:staff', 'order-list', reverse('order-list'), auth='staff'),
+        Scenario('order-list:summary', 'order-list', reverse('order-list') + '?representation=summary', auth='staff'),
+        Scenario('reservation-list', 'reservation-list', reverse('reservation-list'), auth='user'),
+        Scenario('reservation-create', 'reservation-list', reverse('reservation-list'), method='post', auth='user',
+                 write=True, data={'items': [{'book': book.pk, 'quantity': 1}]}),
+        Scenario('reservation-detail', 'reservation-detail', reverse('reservation-detail', args=[ctx.reservation.pk]),
+                 auth='user'),
+        Scenario('purchased-book-list', 'purchased-book-list', reverse('purchased-book-list'), auth='user'),
+        Scenario('order-detail', 'order-detail', reverse('order-detail', args=[order.pk]), auth='user'),
+        Scenario('order-create', 'order-list', reverse('order-list'), method='post', auth='user', write=True,
+                 data={'items': [{'book': book.pk, 'quantity': 1}]}),
+        Scenario('order-update-status', 'order-update-status', reverse('order-update-status', args=[order.pk]),
+                 method='patch', auth='staff', write=True, data={'status': 'shipped'}),
+        Scenario('order-export', 'order-export', reverse('order-export') + '?status=pending', auth='staff'),
+        Scenario('order-bulk-status', 'order-bulk-status', reverse('order-bulk-status'), method='post', auth='staff',
+                 write=True, data={'ids': [order.pk], 'status': 'shipped'}),
+        Scenario('token_obtain_pair', 'token_obtain_pair', reverse('token_obtain_pair'), method='post',
+                 data={'username': ctx.user.username, 'password': ctx.password}),
+        Scenario('token_refresh', 'token_refresh', reverse('token_refresh'), method='post',
+                 data={'refresh': ctx.refresh}),
+        Scenario('user-register', 'user-register', reverse('user-register'), method='post', write=True,
+                 data=lambda i: {
+                     'username': f'bench_{uuid.uuid4().hex[:12]}', 'password': 'bench-Pass-123',
+                     'address': f'{uuid.uuid4().hex} Street', 'phone': uuid.uuid4().hex[:15],
+                 }),
+        Scenario('cache-stats', 'cache-stats', reverse('cache-stats'), auth='staff'),
+        Scenario('metrics', 'metrics', reverse('metrics')),
+        Scenario('analytics-revenue', 'analytics-revenue', reverse('analytics-revenue') + '?interval=week', auth='staff'),
+        Scenario('analytics-categories', 'analytics-categories', reverse('analytics-categories'), auth='staff'),
+        Scenario('analytics-bestsellers', 'analytics-bestsellers', reverse('analytics-bestsellers'), auth='staff'),
+        Scenario('schema-swagger-ui', 'schema-swagger-ui', reverse('schema-swagger-ui')),
+        Scenario('schema-redoc', 'schema-redoc', reverse('schema-redoc')),
+    ]
+    if ctx.review is not None:
+        scenarios.append(Scenario('review-detail', 'review-detail', reverse('review-detail', args=[ctx.review.pk])))
+    if ctx.unreviewed is not None:
+        scenarios.append(Scenario(
+            'review-create', 'review-list', reverse('review-list'), method='post', auth='user', write=True,
+            data={'book': ctx.unreviewed, 'rating': 4, 'comment': 'Benchmark review'},
+        ))
+    return scenarios
+
+
+def run_scenario(client, ctx, scenario, iterations, warmup, cold_cache=False):
+    timings = []
+    queries = []
+    status_codes = set()
+    headers = {}
+    if scenario.auth:
+        headers['HTTP_AUTHORIZATION'] = f'Bearer {ctx.tokens[scenario.auth]}'
+    for i in range(warmup + iterations):
+        data = scenario.data(i) if callable(scenario.data) else scenario.data
+        if cold_cache:
+            caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')].clear()
+        with contextlib.ExitStack() as stack:
+            if scenario.write:
+                stack.enter_context(transaction.atomic())
+            contexts = stack.enter_context(capture_queries())
+            started = time.perf_counter()
+            response = getattr(client, scenario.method)(scenario.path, data, format=scenario.format, **headers)
+            elapsed = (time.perf_counter() - started) * 1000
+            if scenario.write:
+                transaction.set_rollback(True)
+        if i >= warmup:
+            timings.append(elapsed)
+            queries.append(sum(len(context.captured_queries) for context in contexts))
+            status_codes.add(response.status_code)
+    result = summarize(timings)
+    result.update({
+        'route': scenario.route,
+        'method': scenario.method.upper(),
+        'path': scenario.path,
+        'status': sorted(status_codes),
+        'queries': max(queries),
+    })
+    return result
+
+
+def run_benchmarks(password='bench-pass', iterations=20, warmup=2, cold_cache=False, only=None, log=None):
+    ctx = BenchmarkContext(password)
+    client = APIClient(SERVER_NAME='localhost')
+    scenarios = [s for s in build_scenarios(ctx) if not only or s.name in only or s.route in only]
+    results = {}
+    for scenario in scenarios:
+        results[scenario.name] = run_scenario(client, ctx, scenario, iterations, warmup, cold_cache)
+        if log:
+            log(scenario.name, results[scenario.name])
+    from . import urls
+    covered = {s.route for s in scenarios}
+    return {
+        'meta': {
+            'started_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': connections['default'].vendor,
+            'iterations': iterations,
+            'warmup': warmup,
+            'cold_cache': cold_cache,
+            'dataset': {
+                'books': Book.objects.count(),
+                'orders': Order.objects.count(),
+                'reviews': Review.objects.count(),
+            },
+            'uncovered_routes': sorted(route_names(urls.urlpatterns) - covered),
+        },
+        'results': results,
+    }
+
+
+def check_budgets(results, budgets):
+    """
+    Compare results against `{scenario: {"p95_ms": .., "queries": ..}}` and
+    return a list of human-readable violations.
+    """
+    failures = []
+    for name, budget in budgets.items():
+        result = results.get(name)
+        if result is None:
+            failures.append(f"{name}: no result")
+            continue
+        for metric, limit in budget.items():
+            if result[metric] > limit:
+                failures.append(f"{name}: {metric} {result[metric]} exceeds budget {limit}")
+    return failures
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Scenarios whose p95 grew by more than `tolerance` (a fraction) or that
+    issue more queries than in `baseline`.
+    """
+    regressions = []
+    for name, before in baseline.items():
+        after = results.get(name)
+        if after is None:
+            continue
+        if after['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {after['p95_ms']}ms")
+        if after['queries'] > before['queries']:
+            regressions.append(f"{name}: queries {before['queries']} -> {after['queries']}")
+    return regressions
+
+
+def write_report(path, report):
+    with open(path, 'w') as fh:
+        json.dump(report, fh, indent=2, sort_keys=True)
+
+
+async def fetch(reader, writer, host, path):
+    """
+    One keep-alive HTTP/1.1 GET. Returns `(status, keep_alive)`.
+    """
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: application/json\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    status = int(head[0].split()[1])
+    headers = {}
+    for line in head[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    keep_alive = headers.get('connection') != 'close'
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        keep_alive = False
+    return status, keep_alive
+
+
+async def generate_load(base_url, paths, concurrency, total, timeout):
+    parsed = urlsplit(base_url)
+    host, port = parsed.hostname, parsed.port or 80
+    prefix = parsed.path.rstrip('/')
+    timings, statuses, errors = [], {}, []
+    remaining = iter(range(total))
+
+    async def client():
+        connection = None
+        for n in remaining:
+            path = prefix + paths[n % len(paths)]
+            started = time.perf_counter()
+            try:
+                if connection is None:
+                    connection = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+                status, keep_alive = await asyncio.wait_for(fetch(*connection, parsed.netloc, path), timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError) as exc:
+                errors.append(type(exc).__name__)
+                keep_alive = False
+            else:
+                timings.append((time.perf_counter() - started) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+            if not keep_alive and connection is not None:
+                connection[1].close()
+                connection = None
+        if connection is not None:
+            connection[1].close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    result = summarize(timings) if timings else {'samples': 0}
+    if timings:
+        result['p99_ms'] = round(percentile(timings, 99), 3)
+    result.update({
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': len(errors),
+        'error_types': sorted(set(errors)),
+        'status': {str(code): count for code, count in sorted(statuses.items())},
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(timings) / elapsed, 1) if elapsed else None,
+    })
+    return result
+
+
+def load_test(base_url, paths, concurrency=100, total=2000, timeout=30):
+    """
+    Fire `total` GETs over `concurrency` keep-alive connections, cycling
+    through `paths`, and report latency percentiles and throughput. A
+    plain asyncio client, so one process can hold many slow connections.
+    """
+    return asyncio.run(generate_load(base_url, paths, concurrency, total, timeout))
+
+
+def catalog_read_paths():
+    """
+    The read endpoints served by store.async_views, on sample rows.
+    """
+    book = Book.objects.order_by('-review_count', 'pk').first()
+    if book is None:
+        raise ValueError("The database has no books; run seed_catalog first.")
+    return [
+        reverse('book-list'),
+        reverse('book-list') + f'?category={book.category_id}&ordering=-price',
+        reverse('book-list') + '?q=shadow&ordering=relevance',
+        reverse('book-detail', args=[book.pk]),
+        reverse('category-list'),
+        reverse('book-review-list', args=[book.pk]),
+    ]
+
+
+def connection_settings(alias='default'):
+    """
+    Settings of `alias` for each way of getting a connection per request:
+    a new one every time, one kept open (CONN_MAX_AGE) and, on PostgreSQL
+    with psycopg 3 and psycopg_pool installed, one borrowed from a pool.
+    """
+    settings_dict = copy.deepcopy(connections[alias].settings_dict)
+    options = settings_dict['OPTIONS']
+    pool = options.pop('pool', None)
+    modes = {
+        'new': dict(settings_dict, CONN_MAX_AGE=0),
+        'persistent': dict(settings_dict, CONN_MAX_AGE=None),
+    }
+    if connections[alias].vendor == 'postgresql' and all(
+        importlib.util.find_spec(name) for name in ('psycopg', 'psycopg_pool')
+    ):
+        pool = pool if isinstance(pool, dict) else {'min_size': 1, 'max_size': 1}
+        modes['pooled'] = dict(settings_dict, CONN_MAX_AGE=0, OPTIONS=dict(options, pool=pool))
+    return modes
+
+
+def benchmark_connections(alias='default', iterations=200, warmup=5):
+    """
+    Time the database side of a request, `SELECT 1` between the connection
+    handling Django does when a request starts and finishes, once per mode
+    of connection_settings(). Reports latency percentiles and how many
+    server connections were opened; the gap to 'new' is the handshake the
+    other modes save on every request.
+    """
+    connection_class = type(connections[alias])
+    results = {}
+    for mode, settings_dict in connection_settings(alias).items():
+        connection = connection_class(settings_dict, alias=f'{alias}:benchmark-{mode}')
+        pool = getattr(connection, 'pool', None)
+        timings = []
+        opened = 0
+        try:
+            for iteration in range(warmup + iterations):
+                if iteration == warmup and pool:
+                    pool.pop_stats()
+                started = time.perf_counter()
+                connection.close_if_unusable_or_obsolete()
+                opened += connection.connection is None and iteration >= warmup
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+                connection.close_if_unusable_or_obsolete()
+                if iteration >= warmup:
+                    timings.append((time.perf_counter() - started) * 1000)
+            if pool:
+                # Checkouts always start disconnected; the pool knows what it opened
+                opened = pool.get_stats().get('connections_num', 0)
+        finally:
+            connection.close()
+            if pool:
+                connection.close_pool()
+        results[mode] = dict(summarize(timings), connections_opened=opened)
+    return {
+        'database': alias,
+        'vendor': connections[alias].vendor,
+        'iterations': iterations,
+        'results': results,
+    }
@@ -0,0 +1,183 @@
+import functools
+import hashlib
+import json
+import time
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+from .routers import read_from_replica
+
+CACHE_PREFIX = 'catalog'
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def version_key(namespace):
+    return f'{CACHE_PREFIX}:version:{namespace}'
+
+
+def bumped_key(namespace):
+    return f'{CACHE_PREFIX}:bumped:{namespace}'
+
+
+def stats_key(namespace, outcome):
+    return f'{CACHE_PREFIX}:stats:{namespace}:{outcome}'
+
+
+def get_versions(namespaces):
+    """
+    Current version of each namespace. A missing version (first use, or
+    evicted) starts from the clock so it can't collide with an older one.
+    """
+    cache = get_cache()
+    keys = [version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_namespaces(*namespaces):
+    """
+    Invalidate every cached response in `namespaces` once the current
+    transaction commits (immediately in autocommit mode). With read
+    replicas, the bump is also remembered for REPLICA_PIN_SECONDS, while
+    they may still be catching up (see `cacheable()`).
+    """
+    def bump():
+        cache = get_cache()
+        for namespace in namespaces:
+            try:
+                cache.incr(version_key(namespace))
+            except ValueError:
+                cache.set(version_key(namespace), time.time_ns(), timeout=None)
+        lag = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+        if getattr(settings, 'REPLICA_DATABASES', None) and lag:
+            cache.set_many({bumped_key(namespace): True for namespace in namespaces}, timeout=lag)
+    transaction.on_commit(bump)
+
+
+def cacheable(namespaces):
+    """
+    Whether what the current request read may be cached under the current
+    versions of `namespaces`. Not when it came from a replica shortly after
+    a bump: the replica may not have the change yet, and caching its rows
+    under the new version would serve them to everyone, the writer
+    included, until the entry expires.
+    """
+    if not read_from_replica():
+        return True
+    return not get_cache().get_many([bumped_key(namespace) for namespace in namespaces])
+
+
+def record(namespace, outcome):
+    cache = get_cache()
+    key = stats_key(namespace, outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def cache_stats(namespaces):
+    """
+    Hit/miss counters per namespace, shared by every worker using the cache.
+    """
+    cache = get_cache()
+    keys = {(ns, outcome): stats_key(ns, outcome) for ns in namespaces for outcome in ('hit', 'miss')}
+    values = cache.get_many(list(keys.values()))
+    return {
+        ns: {outcome: values.get(keys[(ns, outcome)], 0) for outcome in ('hit', 'miss')}
+        for ns in namespaces
+    }
+
+
+def request_variant(request, view):
+    """
+    What a view's response depends on besides the data. Query params are
+    normalized so ?a=1&b=2 and ?b=2&a=1 match; the host is included
+    because pagination links are absolute.
+    """
+    params = sorted(
+        (key, sorted(value for value in request.query_params.getlist(key) if value))
+        for key in request.query_params
+    )
+    return [
+        view.__class__.__name__, getattr(view, 'action', None), sorted(view.kwargs.items()),
+        request.scheme, request.get_host(), [param for param in params if param[1]],
+    ]
+
+
+def response_cache_key(request, view, namespaces, kind='response'):
+    parts = request_variant(request, view) + [get_versions(namespaces)]
+    digest = hashlib.md5(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+    return f'{CACHE_PREFIX}:{kind}:{digest}'
+
+
+def lookup(request, view):
+    """
+    Return `(key, data)` for the cached response of `view`, with data None
+    on a miss, and count the hit or miss.
+    """
+    namespaces = view.cache_namespaces
+    key = response_cache_key(request, view, namespaces)
+    data = get_cache().get(key)
+    record(namespaces[0], 'miss' if data is None else 'hit')
+    return key, data
+
+
+def store_response(key, response, namespaces):
+    if response.status_code == 200 and cacheable(namespaces):
+        get_cache().set(key, response.data, timeout=getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+
+
+def hit_response(data):
+    response = Response(data)
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+def cached_response(method):
+    """
+    Read-through cache for a DRF view action. Successful responses are
+    stored by serialized data under a key that embeds the current version
+    of each namespace in `view.cache_namespaces`, so bumping a namespace
+    orphans its entries instead of deleting them. Authentication and
+    permissions have already run by the time the action is called.
+
+    Async actions are supported; the cache calls for a request are then
+    made in one thread hop each for the lookup and the store.
+    """
+    if iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await method(self, request, *args, **kwargs)
+            key, data = await sync_to_async(lookup)(request, self)
+            if data is not None:
+                return hit_response(data)
+            response = await method(self, request, *args, **kwargs)
+            await sync_to_async(store_response)(key, response, self.cache_namespaces)
+            response['X-Cache'] = 'MISS'
+            return response
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return method(self, request, *args, **kwargs)
+        key, data = lookup(request, self)
+        if data is not None:
+            return hit_response(data)
+        response = method(self, request, *args, **kwargs)
+        store_response(key, response, self.cache_namespaces)
+        response['X-Cache'] = 'MISS'
+        return response
+    return wrapper
@@ -0,0 +1,115 @@
+"""
+Conditional GETs (ETag / Last-Modified) for catalog reads.
+
+Book and Category carry an `updated_at` timestamp that every write to a
+rendered column moves forward. `conditional_response` derives validators
+from it with one aggregate query over the view's filtered queryset and
+answers If-None-Match / If-Modified-Since with a 304 before the action
+runs, so an unchanged resource costs neither serialization nor the
+response cache. Apply it above @cached_response; the view needs
+`cache_namespaces` covering every write that moves `updated_at`.
+"""
+import functools
+import hashlib
+import json
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from .cache import cacheable, get_cache, request_variant, response_cache_key
+
+
+def current_state(view):
+    """
+    What the validators are derived from: `[count, newest updated_at]` of
+    a list, `[updated_at]` of a detail, or None if the object is missing.
+    """
+    queryset = view.filter_queryset(view.get_queryset()).order_by()
+    if view.action != 'retrieve':
+        # COUNT(*) lets the updated_at index answer on its own
+        totals = queryset.aggregate(count=Count('*'), updated_at=Max('updated_at'))
+        return [totals['count'], totals['updated_at']]
+    lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+    try:
+        updated_at = queryset.filter(**{view.lookup_field: view.kwargs[lookup_url_kwarg]}).values_list(
+            'updated_at', flat=True,
+        ).first()
+    except (TypeError, ValueError, ValidationError):
+        return None
+    return None if updated_at is None else [updated_at]
+
+
+def get_validators(request, view):
+    """
+    `(etag, last_modified)` for the view's current action, or (None, None)
+    for a missing object. A detail's Last-Modified is its row's
+    `updated_at`; a list only gets an ETag, which also covers the row
+    count, because deleting a row doesn't move the newest `updated_at`.
+
+    The state is cached like responses are, under the versions of
+    `view.cache_namespaces`, so revalidating an unchanged resource usually
+    costs no query at all.
+    """
+    key = response_cache_key(request, view, view.cache_namespaces, kind='validators')
+    cache = get_cache()
+    cached = cache.get(key)
+    if cached is None:
+        cached = {'state': current_state(view)}
+        if cacheable(view.cache_namespaces):
+            cache.set(key, cached, timeout=getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+    state = cached['state']
+    if state is None:
+        return None, None
+    parts = request_variant(request, view) + [request.accepted_media_type] + state
+    digest = hashlib.md5(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+    # Weak: the body is only equivalent, e.g. across renderer versions
+    return f'W/"{digest}"', state[0] if view.action == 'retrieve' else None
+
+
+def not_modified(request, etag, last_modified):
+    # HTTP dates have whole seconds, so compare at that precision
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request._request, etag=etag, last_modified=timestamp)
+    return response and set_validators(response, etag, last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    if etag and response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def conditional_response(method):
+    """
+    ETag / Last-Modified validation for a DRF list or retrieve action.
+    Returns 304 Not Modified when the client's copy is current, and adds
+    the validators to a full response otherwise. Authentication,
+    permissions and content negotiation have already run.
+
+    Async actions are supported; the validator lookup is then made in one
+    thread hop.
+    """
+    if iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await method(self, request, *args, **kwargs)
+            etag, last_modified = await sync_to_async(get_validators)(request, self)
+            if etag and (response := not_modified(request, etag, last_modified)):
+                return response
+            return set_validators(await method(self, request, *args, **kwargs), etag, last_modified)
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return method(self, request, *args, **kwargs)
+        etag, last_modified = get_validators(request, self)
+        if etag and (response := not_modified(request, etag, last_modified)):
+            return response
+        return set_validators(method(self, request, *args, **kwargs), etag, last_modified)
+    return wrapper
@@ -0,0 +1,393 @@
+"""
+Bulk feeds: CSV/JSONL import and export of books keyed on ISBN, bulk
+user provisioning, and the order history export.
+
+Both directions work in fixed-size chunks so memory stays flat however
+large the feed is. Imports write one statement per chunk and collect
+per-row errors instead of aborting; exports iterate the queryset with a
+server-side cursor where the database supports one. Under ASGI, exports
+are served through `aiter_lines()` so they stream there too.
+"""
+import csv
+import io
+import itertools
+import json
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from .cache import bump_namespaces
+from .models import Book, Category, OrderItem, Profile
+from .search import normalize_isbn
+from .serializers import ProfileSerializer
+
+FEED_FORMATS = ('csv', 'jsonl')
+FEED_FIELDS = ('ISBN', 'title', 'author', 'category', 'price', 'stock', 'published_date')
+UPDATE_FIELDS = ['title', 'author', 'category', 'price', 'stock', 'published_date', 'updated_at']
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+ORDER_EXPORT_FIELDS = (
+    'order_id', 'order_date', 'status', 'user_id', 'username', 'order_total',
+    'item_id', 'ISBN', 'title', 'author', 'category', 'quantity', 'price_at_purchase',
+)
+
+
+class FeedError(Exception):
+    pass
+
+
+def guess_format(filename, default='csv'):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension == 'ndjson':
+        return 'jsonl'
+    return extension if extension in FEED_FORMATS else default
+
+
+def read_rows(stream, file_format, columns=FEED_FIELDS):
+    """
+    Yield `(line_number, row)` pairs from a text stream. Rows are dicts, or
+    an exception instance for lines that can't be parsed at all. CSV input
+    must have a header with every name in `columns`.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        missing = set(columns) - set(reader.fieldnames or ())
+        if missing:
+            raise FeedError(f"CSV header is missing column(s): {', '.join(sorted(missing))}.")
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError("Expected a JSON object.")
+            except ValueError as exc:
+                yield line_number, exc
+            else:
+                yield line_number, row
+    else:
+        raise FeedError(f"Unsupported format {file_format!r}; use one of {', '.join(FEED_FORMATS)}.")
+
+
+def clean_values(row, fields, optional=()):
+    """
+    Convert and validate `row` with the given model fields' own to_python
+    and validators. Raises ValidationError with every failing field.
+    """
+    values = {}
+    errors = {}
+    for name, field in fields.items():
+        raw = row.get(name)
+        if isinstance(raw, str):
+            raw = raw.strip()
+        if raw in (None, ''):
+            if name not in optional:
+                errors[name] = ["This field is required."]
+            continue
+        if name == 'ISBN':
+            raw = normalize_isbn(str(raw))
+            if raw is None:
+                errors[name] = ["Enter a valid ISBN-10 or ISBN-13."]
+                continue
+        try:
+            value = field.to_python(raw)
+            field.run_validators(value)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+            continue
+        values[name] = value
+    if errors:
+        raise ValidationError(errors)
+    return values
+
+
+def clean_row(row):
+    """
+    Validate one book feed row. Returns the cleaned values, with `category`
+    as a name.
+    """
+    fields = {name: Book._meta.get_field(name) for name in FEED_FIELDS if name != 'category'}
+    fields['category'] = Category._meta.get_field('name')
+    values = clean_values(row, fields)
+    if values['stock'] < 0:
+        raise ValidationError({'stock': ["Ensure this value is greater than or equal to 0."]})
+    return values
+
+
+class FeedImporter:
+    """
+    Validate feed rows one at a time and write them `chunk_size` at a time.
+    Subclasses implement `clean()` and `flush()`. At most `max_errors` row
+    errors are kept; `failed` always holds the full count.
+    """
+    key_field = None
+
+    def __init__(self, chunk_size=2000, max_errors=1000):
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.rows = self.created = self.updated = self.failed = 0
+        self.errors = []
+
+    def run(self, rows):
+        chunk = []
+        for line_number, row in rows:
+            self.rows += 1
+            if isinstance(row, Exception):
+                self.error(line_number, None, {'non_field_errors': [str(row)]})
+                continue
+            try:
+                chunk.append((line_number, self.clean(row)))
+            except ValidationError as exc:
+                self.error(line_number, row.get(self.key_field), exc.message_dict)
+            if len(chunk) >= self.chunk_size:
+                self.flush(chunk)
+                chunk = []
+        if chunk:
+            self.flush(chunk)
+        self.finish()
+        return self.summary()
+
+    def clean(self, row):
+        raise NotImplementedError
+
+    def flush(self, chunk):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def error(self, line_number, key, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line_number, self.key_field: key, 'errors': errors})
+
+    def summary(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+class BookImporter(FeedImporter):
+    """
+    Upsert books on ISBN, one INSERT ... ON CONFLICT per chunk. Unknown
+    categories are created in bulk unless `create_categories` is False, in
+    which case the row is reported as an error. Each chunk invalidates the
+    catalog cache as it commits, so a long import never serves stale pages.
+    """
+    key_field = 'ISBN'
+
+    def __init__(self, create_categories=True, **options):
+        super().__init__(**options)
+        self.create_categories = create_categories
+
+    def clean(self, row):
+        return clean_row(row)
+
+    def resolve_categories(self, names):
+        """
+        Category ids by name, and whether any had to be created.
+        """
+        categories = dict(Category.objects.filter(name__in=names).values_list('name', 'pk'))
+        missing = names - categories.keys()
+        if not (missing and self.create_categories):
+            return categories, False
+        Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+        categories.update(Category.objects.filter(name__in=missing).values_list('name', 'pk'))
+        return categories, True
+
+    def flush(self, chunk):
+        # The same ISBN twice in one statement is an error on Postgres; the
+        # last occurrence in the chunk wins, and the earlier ones are reported
+        last_lines = {values['ISBN']: line_number for line_number, values in chunk}
+        latest = {}
+        for line_number, values in chunk:
+            last_line = last_lines[values['ISBN']]
+            if line_number == last_line:
+                latest[values['ISBN']] = (line_number, values)
+            else:
+                self.error(line_number, values['ISBN'], {'ISBN': [f"Duplicate ISBN, superseded by line {last_line}."]})
+        with transaction.atomic():
+            categories, created = self.resolve_categories({values['category'] for _, values in latest.values()})
+            books = []
+            for line_number, values in latest.values():
+                category_id = categories.get(values.pop('category'))
+                if category_id is None:
+                    self.error(line_number, values['ISBN'], {'category': ["Unknown category."]})
+                    continue
+                books.append(Book(category_id=category_id, **values))
+            existing = set(Book.objects.filter(ISBN__in=[book.ISBN for book in books]).values_list('ISBN', flat=True))
+            Book.objects.bulk_create(books, update_conflicts=True, unique_fields=['ISBN'], update_fields=UPDATE_FIELDS)
+            bump_namespaces('books', *(['categories'] if created else []))
+        self.created += len(books) - len(existing)
+        self.updated += len(existing)
+
+
+def import_books(stream, file_format='csv', **options):
+    return BookImporter(**options).run(read_rows(stream, file_format))
+
+
+USER_COLUMNS = ('username', 'address', 'phone')
+
+
+class UserProvisioner(FeedImporter):
+    """
+    Create users with their profiles from `username, email, password,
+    address, phone` rows. Conflicts with existing accounts or earlier rows
+    are reported with the registration endpoint's messages. Rows without a
+    password get an unusable one, to be set through a password reset.
+
+    Hashing is by far the slowest step (PBKDF2 is deliberately expensive),
+    so it runs before each chunk's transaction is opened.
+    """
+    key_field = 'username'
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.fields = {
+            'username': User._meta.get_field('username'),
+            'email': User._meta.get_field('email'),
+            'address': Profile._meta.get_field('address'),
+            'phone': Profile._meta.get_field('phone'),
+        }
+
+    def clean(self, row):
+        values = clean_values(row, self.fields, optional=('email',))
+        values['username'] = User.normalize_username(values['username'])
+        values['email'] = User.objects.normalize_email(values.get('email', ''))
+        values['password'] = row.get('password') or None
+        return values
+
+    def flush(self, chunk):
+        messages = ProfileSerializer.conflict_messages
+        taken = {
+            'username': set(User.objects.filter(
+                username__in=[values['username'] for _, values in chunk]).values_list('username', flat=True)),
+            'phone': set(Profile.objects.filter(
+                phone__in=[values['phone'] for _, values in chunk]).values_list('phone', flat=True)),
+            'address': set(Profile.objects.filter(
+                address__in=[values['address'] for _, values in chunk]).values_list('address', flat=True)),
+        }
+        accepted = []
+        for line_number, values in chunk:
+            conflicts = {field: [messages[field]] for field in taken if values[field] in taken[field]}
+            if conflicts:
+                self.error(line_number, values['username'], conflicts)
+                continue
+            for field in taken:
+                taken[field].add(values[field])
+            user = User(username=values['username'], email=values['email'], password=make_password(values['password']))
+            profile = Profile(address=values['address'], phone=values['phone'])
+            accepted.append((line_number, user, profile))
+        try:
+            with transaction.atomic():
+                users = User.objects.bulk_create([user for _, user, _ in accepted])
+                for user, (_, _, profile) in zip(users, accepted):
+                    profile.user_id = user.pk
+                Profile.objects.bulk_create([profile for _, _, profile in accepted])
+            self.created += len(accepted)
+        except IntegrityError:
+            # Something registered concurrently; retry row by row to isolate it
+            for line_number, user, profile in accepted:
+                user.pk = profile.pk = None
+                try:
+                    with transaction.atomic():
+                        user.save()
+                        profile.user = user
+                        profile.save()
+                    self.created += 1
+                except IntegrityError:
+                    self.error(line_number, user.username, ProfileSerializer.find_conflicts(
+                        username=user.username, phone=profile.phone, address=profile.address,
+                    ))
+
+
+def provision_users(stream, file_format='csv', **options):
+    return UserProvisioner(**options).run(read_rows(stream, file_format, USER_COLUMNS))
+
+
+class Echo:
+    # File-like object whose write() hands the formatted line back
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, chunk_size=2000):
+    values = queryset.values_list('ISBN', 'title', 'author', 'category__name', 'price', 'stock', 'published_date')
+    return values.iterator(chunk_size=chunk_size)
+
+
+def stream_csv(rows, header):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_jsonl(rows, header):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(header, row))) + '\n'
+
+
+STREAMERS = {'csv': stream_csv, 'jsonl': stream_jsonl}
+
+
+def get_streamer(file_format):
+    if file_format not in STREAMERS:
+        raise FeedError(f"Unsupported format {file_format!r}; use one of {', '.join(FEED_FORMATS)}.")
+    return STREAMERS[file_format]
+
+
+async def aiter_lines(lines, batch_size=500):
+    """
+    Async iterator over the lines of a sync export generator, joined into
+    one chunk per `batch_size` lines. Each batch is pulled in the thread
+    that runs sync code, so the generator's queries and server-side cursor
+    stay on one connection, and only one batch is in memory at a time.
+    """
+    lines = iter(lines)
+    next_batch = sync_to_async(lambda: ''.join(itertools.islice(lines, batch_size)))
+    while batch := await next_batch():
+        yield batch
+
+
+def export_books(queryset, file_format='csv', chunk_size=2000):
+    """
+    Generator of CSV or JSONL lines for the books in `queryset`, in the
+    same columns the importer reads.
+    """
+    return get_streamer(file_format)(export_rows(queryset, chunk_size), FEED_FIELDS)
+
+
+def export_order_rows(orders, chunk_size=2000):
+    # One row per item, in (order, item) order, which the (order, id) index
+    # returns without sorting, so the first rows arrive straight away
+    items = OrderItem.objects.filter(order__in=orders.order_by().values('pk')).order_by('order_id', 'pk')
+    values = items.values_list(
+        'order_id', 'order__order_date', 'order__status', 'order__user_id', 'order__user__username',
+        'order__total_price', 'pk', 'book__ISBN', 'book__title', 'book__author', 'book__category__name',
+        'quantity', 'price_at_purchase',
+    )
+    return values.iterator(chunk_size=chunk_size)
+
+
+def export_orders(orders, file_format='csv', chunk_size=2000):
+    """
+    Generator of CSV or JSONL lines for the orders in `orders`, one per
+    order item, with the order, user and book fields alongside.
+    """
+    return get_streamer(file_format)(export_order_rows(orders, chunk_size), ORDER_EXPORT_FIELDS)
+
+
+def text_stream(binary):
+    # utf-8-sig drops the BOM spreadsheet tools put in front of CSV exports
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
@@ -0,0 +1,118 @@
+"""
+Sparse fieldsets: `?fields=id,title,price` or `?omit=description` on read
+endpoints.
+
+SparseFieldsMixin lets a serializer drop fields it was built with, so
+unrequested fields are never computed. SparseFieldsViewMixin reads the
+query parameters on safe requests, passes the selection to the serializer,
+narrows the SQL column list with `only()` and lets the view skip work for
+response keys it adds itself (see `wants()`).
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import permissions
+from rest_framework.exceptions import ValidationError
+from .filters import ordering_name
+
+
+class SparseFieldsMixin:
+    """
+    Serializer taking `fields` (names to keep) and/or `omit` (names to
+    drop) keyword arguments.
+    """
+    def __init__(self, *args, fields=None, omit=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        for name in omit or ():
+            self.fields.pop(name, None)
+
+
+def split_names(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsViewMixin:
+    """
+    View mixin applying `?fields=` / `?omit=` to the serializer and the
+    queryset. `extra_fields` lists response keys the view adds outside the
+    serializer, which can be selected too.
+    """
+    fields_param = 'fields'
+    omit_param = 'omit'
+    extra_fields = ()
+
+    def get_field_selection(self):
+        """
+        `(fields, omit)` sets for this request, `fields` being None when
+        every field is wanted; `(None, set())` for anything but a read.
+        """
+        if hasattr(self, '_field_selection'):
+            return self._field_selection
+        selection = (None, set())
+        request = getattr(self, 'request', None)
+        if request is not None and request.method in permissions.SAFE_METHODS:
+            fields = request.query_params.get(self.fields_param)
+            omit = request.query_params.get(self.omit_param)
+            if fields is not None or omit:
+                available = set(self.get_serializer_class()().fields) | set(self.extra_fields)
+                selection = (split_names(fields) if fields is not None else None, split_names(omit or ''))
+                for param, names in zip((self.fields_param, self.omit_param), selection):
+                    unknown = sorted((names or set()) - available)
+                    if unknown:
+                        raise ValidationError({param: [f"Unknown field(s): {', '.join(unknown)}."]})
+        self._field_selection = selection
+        return selection
+
+    def wants(self, name):
+        fields, omit = self.get_field_selection()
+        return name not in omit and (fields is None or name in fields)
+
+    def get_serializer(self, *args, **kwargs):
+        fields, omit = self.get_field_selection()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        if omit:
+            kwargs.setdefault('omit', omit)
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        return self.narrow_queryset(super().filter_queryset(queryset))
+
+    def narrow_queryset(self, queryset):
+        """
+        Load only the columns behind the selected serializer fields, plus
+        the primary key and whatever ordering, pagination cursors and
+        select_related need. Left alone if a selected field isn't backed
+        by a model field or an annotation (it might read anything).
+        """
+        fields, omit = self.get_field_selection()
+        if fields is None and not omit:
+            return queryset
+        model = queryset.model
+        columns = {model._meta.pk.name}
+        serializer = self.get_serializer()
+        for field in serializer.fields.values():
+            source = field.source_attrs[0] if field.source_attrs else None
+            if source in queryset.query.annotations:
+                continue
+            try:
+                model_field = model._meta.get_field(source) if source else None
+            except FieldDoesNotExist:
+                model_field = None
+            if model_field is None:
+                return queryset
+            if model_field.concrete:
+                columns.add(model_field.name)
+        ordering = list(queryset.query.order_by) + list(model._meta.ordering)
+        ordering += list(getattr(self.pagination_class, 'ordering', None) or ())
+        for term in ordering:
+            name = str(ordering_name(term)).lstrip('-').split('__')[0]
+            try:
+                if model._meta.get_field(name).concrete:
+                    columns.add(name)
+            except FieldDoesNotExist:
+                continue
+        if isinstance(queryset.query.select_related, dict):
+            columns.update(queryset.query.select_related)
+        return queryset.only(*columns)
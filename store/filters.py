@@ -0,0 +1,173 @@
+from datetime import date
+import django_filters
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Count, F, OrderBy, Q
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+from .models import Book, Order
+from .search import search_books
+
+# Facet buckets are half-open [min, max); None leaves a side unbounded.
+# The bounds line up with the price__gte/price__lt and
+# published_date__year__gte/published_date__year__lt filters.
+PRICE_BUCKETS = ((None, 10), (10, 25), (25, 50), (50, 100), (100, None))
+YEAR_BUCKETS = ((None, 1970), (1970, 1990), (1990, 2000), (2000, 2010), (2010, 2020), (2020, None))
+
+
+class NullsLastOrderingFilter(OrderingFilter):
+    """
+    OrderingFilter that sorts NULLs last in nullable columns in either
+    direction, as KeysetPagination does; PostgreSQL would put them first
+    when descending (e.g. unrated books on ?ordering=-average_rating).
+    """
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        if not ordering:
+            return queryset
+        return queryset.order_by(*[self.order_term(queryset.model, term) for term in ordering])
+
+    def order_term(self, model, term):
+        name = term.lstrip('-')
+        try:
+            nullable = '__' not in name and model._meta.get_field(name).null
+        except FieldDoesNotExist:
+            nullable = False
+        if not nullable:
+            return term
+        return F(name).desc(nulls_last=True) if term.startswith('-') else F(name).asc(nulls_last=True)
+
+
+def ordering_name(term):
+    """
+    An `order_by()` term as a '-name' string, including the expressions
+    NullsLastOrderingFilter orders by; other expressions are returned as is.
+    """
+    if isinstance(term, OrderBy) and isinstance(term.expression, F):
+        return ('-' if term.descending else '') + term.expression.name
+    return term
+
+
+class BookSearchFilter(BaseFilterBackend):
+    """
+    Ranked full-text search over title and author via `?q=`, with an exact
+    ISBN fast path. `?ordering=relevance` sorts matches best first.
+    `?search=` is still accepted for older clients.
+    """
+    search_param = 'q'
+    legacy_search_param = 'search'
+    ordering_param = 'ordering'
+
+    def get_search_query(self, request):
+        query = request.query_params.get(self.search_param) or request.query_params.get(self.legacy_search_param)
+        return query.strip() if query else ''
+
+    def filter_queryset(self, request, queryset, view):
+        query = self.get_search_query(request)
+        if not query:
+            return queryset
+        queryset = search_books(queryset, query)
+        if request.query_params.get(self.ordering_param) == 'relevance':
+            queryset = queryset.order_by('-relevance', 'id')
+        return queryset
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.search_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Full-text search over title and author, or an exact ISBN.',
+                'schema': {'type': 'string'},
+            },
+        ]
+
+
+class BookFilter(django_filters.FilterSet):
+    """
+    Exact, range and multi-value (`?category__in=1,2`) filters for the book
+    list, plus `?in_stock=true|false`.
+    """
+    in_stock = django_filters.BooleanFilter(method='filter_in_stock')
+
+    class Meta:
+        model = Book
+        fields = {
+            'category': ['exact', 'in'],
+            'price': ['exact', 'gte', 'lte', 'gt', 'lt'],
+            'published_date': ['gte', 'lte', 'year', 'year__gte', 'year__lt'],
+            'average_rating': ['gte', 'lte'],
+            'review_count': ['gte'],
+        }
+
+    def filter_in_stock(self, queryset, name, value):
+        return queryset.filter(stock__gt=0) if value else queryset.filter(stock=0)
+
+
+class OrderFilter(django_filters.FilterSet):
+    class Meta:
+        model = Order
+        fields = {
+            'status': ['exact', 'in'],
+            'user': ['exact'],
+            'order_date': ['gte', 'lte'],
+        }
+
+
+def bucket_filter(field, low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(**{f'{field}__gte': low})
+    if high is not None:
+        condition &= Q(**{f'{field}__lt': high})
+    return condition
+
+
+def year_start(year):
+    return None if year is None else date(year, 1, 1)
+
+
+def facet_query(queryset):
+    """
+    The one aggregate query behind the facets of `queryset`: a row per
+    category with its book count and a conditional count per price and
+    publication-year bucket and for books in stock, so the result stays a
+    row per category whatever the catalog size.
+    """
+    buckets = {f'price_{i}': bucket_filter('price', low, high) for i, (low, high) in enumerate(PRICE_BUCKETS)}
+    buckets.update({
+        f'year_{i}': bucket_filter('published_date', year_start(low), year_start(high))
+        for i, (low, high) in enumerate(YEAR_BUCKETS)
+    })
+    buckets['in_stock'] = Q(stock__gt=0)
+    return (
+        queryset.order_by()
+        .values('category_id', category_name=F('category__name'))
+        .annotate(count=Count('pk'), **{name: Count('pk', filter=condition) for name, condition in buckets.items()})
+    )
+
+
+def summarize_facets(rows):
+    """
+    Facet counts from the rows of `facet_query()`: books per category, per
+    price and publication-year bucket, and in or out of stock.
+    """
+    def total(name):
+        return sum(row[name] for row in rows)
+
+    in_stock = total('in_stock')
+    return {
+        'category': [
+            {'id': row['category_id'], 'name': row['category_name'], 'count': row['count']}
+            for row in sorted(rows, key=lambda row: (row['category_name'], row['category_id']))
+        ],
+        'price': [
+            {'min': low, 'max': high, 'count': total(f'price_{i}')} for i, (low, high) in enumerate(PRICE_BUCKETS)
+        ],
+        'year': [
+            {'min': low, 'max': high, 'count': total(f'year_{i}')} for i, (low, high) in enumerate(YEAR_BUCKETS)
+        ],
+        'stock': {'in_stock': in_stock, 'out_of_stock': total('count') - in_stock},
+    }
+
+
+def book_facets(queryset):
+    return summarize_facets(list(facet_query(queryset)))
@@ -0,0 +1,52 @@
+"""
+Bulk order status transitions for fulfilment.
+
+`transition_orders()` moves many orders at once: per chunk of ids, one
+locked read of their statuses, then one UPDATE and one rollup move
+(store.analytics) per source status. Queryset updates send no signals, so
+the per-order work store.signals does on Order.save() happens here once
+per batch instead.
+"""
+from collections import defaultdict
+from django.db import transaction
+from . import analytics
+from .models import Order
+
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+NOT_FOUND = 'not_found'
+INVALID_TRANSITION = 'invalid_transition'
+OUTCOMES = (UPDATED, UNCHANGED, NOT_FOUND, INVALID_TRANSITION)
+
+
+def transition_orders(order_ids, status, chunk_size=500):
+    """
+    Move `order_ids` to `status` wherever Order.STATUS_TRANSITIONS allows
+    it and return {order_id: outcome}. Each chunk commits on its own, so an
+    error part way keeps the chunks already applied.
+    """
+    outcomes = {}
+    order_ids = list(dict.fromkeys(order_ids))
+    for start in range(0, len(order_ids), chunk_size):
+        chunk = order_ids[start:start + chunk_size]
+        with transaction.atomic():
+            # Locked in id order so concurrent batches can't deadlock
+            current = dict(
+                Order.objects.select_for_update().filter(pk__in=chunk).order_by('pk').values_list('pk', 'status')
+            )
+            moves = defaultdict(list)
+            for order_id in chunk:
+                previous = current.get(order_id)
+                if previous is None:
+                    outcomes[order_id] = NOT_FOUND
+                elif previous == status:
+                    outcomes[order_id] = UNCHANGED
+                elif status not in Order.STATUS_TRANSITIONS.get(previous, ()):
+                    outcomes[order_id] = INVALID_TRANSITION
+                else:
+                    outcomes[order_id] = UPDATED
+                    moves[previous].append(order_id)
+            for previous, ids in moves.items():
+                Order.objects.filter(pk__in=ids).update(status=status)
+                analytics.move_status(ids, previous, status)
+    return outcomes
@@ -0,0 +1,150 @@
+"""
+A background job queue kept in the database, for side effects that don't
+need to finish before the response.
+
+`enqueue()` inserts a Job row in the caller's transaction, so workers only
+see it once that commits and it disappears with a rollback. The `run_jobs`
+command claims due jobs with SELECT ... FOR UPDATE SKIP LOCKED, so any
+number of workers can share the queue, and passes each task up to its
+`batch_size` waiting jobs in one call. A batch runs in the transaction that
+deletes its jobs, so database side effects and completion commit together.
+If a batch fails its jobs are run one by one, and the failing ones retried
+with exponential backoff, then kept as failed after `max_attempts`.
+"""
+import random
+import time
+import traceback
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .metrics import registry
+from .models import Job
+
+TASKS = {}
+
+
+class Task:
+    def __init__(self, name, func, batch_size, max_attempts):
+        self.name = name
+        self.func = func
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts or getattr(settings, 'JOB_MAX_ATTEMPTS', 5)
+
+
+def task(name, batch_size=100, max_attempts=None):
+    """
+    Register `func(payloads)` as the handler of task `name`. It is called
+    with a list of up to `batch_size` job payloads, oldest first, and must
+    be safe to call again with any of them if it raises.
+    """
+    def decorator(func):
+        TASKS[name] = Task(name, func, batch_size, max_attempts)
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, key=None, delay=0):
+    """
+    Queue a `name` job with a JSON-serializable `payload`, due in `delay`
+    seconds. With a `key`, nothing is queued if a job with the same task
+    and key is still waiting; a job a worker has claimed no longer holds
+    its key, since its handler may already have read what it needs.
+    """
+    job = Job(task=name, payload=payload or {}, key=key, run_at=timezone.now() + timedelta(seconds=delay))
+    Job.objects.bulk_create([job], ignore_conflicts=key is not None)
+
+
+def ready_jobs():
+    return Job.objects.filter(failed_at__isnull=True, run_at__lte=timezone.now())
+
+
+def backoff(attempts):
+    # Doubling delays with jitter, so jobs that failed together spread out
+    base = getattr(settings, 'JOB_RETRY_DELAY', 10)
+    delay = min(base * 2 ** (attempts - 1), getattr(settings, 'JOB_MAX_RETRY_DELAY', 3600))
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+
+def give_up_or_retry(job, task, error):
+    job.attempts += 1
+    job.last_error = error
+    if task is None or job.attempts >= task.max_attempts:
+        job.failed_at = timezone.now()
+    else:
+        job.run_at = timezone.now() + backoff(job.attempts)
+    job.save(update_fields=['attempts', 'last_error', 'failed_at', 'run_at'])
+    return 'failed' if job.failed_at else 'retried'
+
+
+def call(task, jobs):
+    # In a savepoint, so a failure rolls back only the handler's writes
+    with transaction.atomic():
+        task.func([job.payload for job in jobs])
+
+
+def run_batch():
+    """
+    Claim and run one batch: up to `batch_size` due jobs of the task whose
+    oldest job is due first. Returns the number of jobs processed, 0 when
+    nothing is due (or every due job is claimed by another worker).
+    """
+    with transaction.atomic():
+        head = (
+            ready_jobs().select_for_update(skip_locked=True).order_by('run_at', 'id')
+            .values_list('task', flat=True).first()
+        )
+        if head is None:
+            return 0
+        task = TASKS.get(head)
+        jobs = list(
+            ready_jobs().filter(task=head).select_for_update(skip_locked=True)
+            .order_by('run_at', 'id')[:task.batch_size if task else 1]
+        )
+        keyed = [job.pk for job in jobs if job.key is not None]
+        if keyed:
+            # Later enqueues with these keys must queue a new job
+            Job.objects.filter(pk__in=keyed).update(key=None)
+        started = timezone.now()
+        clock = time.perf_counter()
+        outcomes = Counter()
+        done = []
+        if task is None:
+            outcomes[give_up_or_retry(jobs[0], None, f"No handler is registered for task {head!r}.")] += 1
+        else:
+            try:
+                call(task, jobs)
+                done = jobs
+            except Exception:
+                if len(jobs) == 1:
+                    outcomes[give_up_or_retry(jobs[0], task, traceback.format_exc())] += 1
+                else:
+                    # Isolate the failing jobs instead of retrying the whole batch
+                    for job in jobs:
+                        try:
+                            call(task, [job])
+                            done.append(job)
+                        except Exception:
+                            outcomes[give_up_or_retry(job, task, traceback.format_exc())] += 1
+        Job.objects.filter(pk__in=[job.pk for job in done]).delete()
+        outcomes['done'] += len(done)
+    registry.observe_jobs(
+        head, outcomes, time.perf_counter() - clock,
+        [max((started - job.run_at).total_seconds(), 0) for job in jobs],
+    )
+    return len(jobs)
+
+
+def run_pending(limit=None):
+    """
+    Run batches until nothing is due (or `limit` jobs were processed).
+    Returns the number of jobs processed.
+    """
+    processed = 0
+    while limit is None or processed < limit:
+        count = run_batch()
+        if not count:
+            break
+        processed += count
+    return processed
@@ -0,0 +1,62 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from store.benchmarks import check_budgets, compare_to_baseline, run_benchmarks, write_report
+
+
+class Command(BaseCommand):
+    help = (
+        "Request every API route through the test client and report p50/p95 latency "
+        "and query counts as JSON. Run against a database seeded with seed_catalog; "
+        "write requests are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help="Measured requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=2, help="Unmeasured requests per scenario.")
+        parser.add_argument('--password', default='bench-pass', help="Password the seeded users were created with.")
+        parser.add_argument('--scenario', action='append', dest='only', help="Only run this scenario or route (repeatable).")
+        parser.add_argument('--cold-cache', action='store_true', help="Clear the catalog cache before every request.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+        parser.add_argument(
+            '--budgets',
+            help='JSON file of {"scenario": {"p95_ms": .., "queries": ..}}; exceeding any budget fails the run.',
+        )
+        parser.add_argument('--baseline', help="Earlier JSON report to compare against; regressions fail the run.")
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help="Allowed p95 growth over the baseline, as a fraction (default: 0.25).",
+        )
+
+    def handle(self, *args, **options):
+        def log(name, result):
+            self.stderr.write(
+                f"  {name}: p50 {result['p50_ms']}ms p95 {result['p95_ms']}ms "
+                f"queries {result['queries']} status {result['status']}"
+            )
+
+        try:
+            report = run_benchmarks(
+                password=options['password'], iterations=options['iterations'], warmup=options['warmup'],
+                cold_cache=options['cold_cache'], only=options['only'], log=log,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        for route in report['meta']['uncovered_routes']:
+            self.stderr.write(self.style.WARNING(f"No scenario covers route {route}"))
+
+        if options['output']:
+            write_report(options['output'], report)
+        else:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+
+        failures = []
+        if options['budgets']:
+            with open(options['budgets']) as fh:
+                failures += check_budgets(report['results'], json.load(fh))
+        if options['baseline']:
+            with open(options['baseline']) as fh:
+                baseline = json.load(fh)['results']
+            failures += compare_to_baseline(report['results'], baseline, options['tolerance'])
+        if failures:
+            raise CommandError("Performance budget exceeded:\n  " + "\n  ".join(failures))
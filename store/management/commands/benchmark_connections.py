@@ -0,0 +1,38 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from store.benchmarks import benchmark_connections, write_report
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure what a request pays for its database connection: opening a new one each time, "
+        "keeping one open (CONN_MAX_AGE) or borrowing one from a psycopg pool. Uses the connection "
+        "settings of --database, so run it against the real server (and sslmode) to see the handshake cost."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help="Database alias to connect to (default: default).")
+        parser.add_argument('--iterations', type=int, default=200, help="Measured requests per mode (default: 200).")
+        parser.add_argument('--warmup', type=int, default=5, help="Unmeasured requests per mode (default: 5).")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['database'] not in connections:
+            raise CommandError(f"Unknown database alias '{options['database']}'.")
+        if options['iterations'] < 1:
+            raise CommandError("--iterations must be at least 1.")
+        report = benchmark_connections(options['database'], options['iterations'], options['warmup'])
+        baseline = report['results']['new']
+        for mode, result in report['results'].items():
+            saved = round(baseline['p50_ms'] - result['p50_ms'], 3)
+            self.stderr.write(
+                f"  {mode}: p50 {result['p50_ms']}ms p95 {result['p95_ms']}ms, "
+                f"{result['connections_opened']} connections opened, p50 saving {saved}ms"
+            )
+        if 'pooled' not in report['results']:
+            self.stderr.write(self.style.WARNING("Pooling needs PostgreSQL with psycopg[pool]; skipped."))
+        if options['output']:
+            write_report(options['output'], report)
+        else:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
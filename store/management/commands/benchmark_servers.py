@@ -0,0 +1,104 @@
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from django.core.management.base import BaseCommand, CommandError
+from store.benchmarks import catalog_read_paths, load_test, write_report
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the WSGI (sync views) and ASGI (async catalog views) servers under concurrent "
+        "load on the catalog read endpoints. Either point it at running servers with "
+        "--wsgi-url/--asgi-url, or pass --spawn to start both with gunicorn."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi-url', help="Base URL of a running WSGI server.")
+        parser.add_argument('--asgi-url', help="Base URL of a running ASGI server.")
+        parser.add_argument('--spawn', action='store_true', help="Start both servers with gunicorn on free ports.")
+        parser.add_argument('--workers', type=int, default=3, help="Worker processes per spawned server (default: 3).")
+        parser.add_argument(
+            '--asgi-worker-class', default='uvicorn.workers.UvicornWorker',
+            help="gunicorn worker class for the ASGI server (default: uvicorn.workers.UvicornWorker).",
+        )
+        parser.add_argument('--concurrency', type=int, default=200, help="Open connections (default: 200).")
+        parser.add_argument('--requests', type=int, default=5000, help="Requests per server (default: 5000).")
+        parser.add_argument('--timeout', type=float, default=30, help="Per-request timeout in seconds.")
+        parser.add_argument('--path', action='append', dest='paths', help="Path to request (repeatable).")
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            paths = options['paths'] or catalog_read_paths()
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        with contextlib.ExitStack() as stack:
+            targets = {}
+            if options['spawn']:
+                targets['wsgi'] = stack.enter_context(self.server('bookstore.wsgi:application', None, options))
+                targets['asgi'] = stack.enter_context(
+                    self.server('bookstore.asgi:application', options['asgi_worker_class'], options)
+                )
+            for name in ('wsgi', 'asgi'):
+                if options[f'{name}_url']:
+                    targets[name] = options[f'{name}_url']
+            if not targets:
+                raise CommandError("Give --wsgi-url and/or --asgi-url, or --spawn.")
+
+            results = {}
+            for name, url in targets.items():
+                self.stderr.write(f"{name}: {options['requests']} requests, {options['concurrency']} connections -> {url}")
+                results[name] = load_test(url, paths, options['concurrency'], options['requests'], options['timeout'])
+                result = results[name]
+                self.stderr.write(
+                    f"  {result.get('throughput_rps')} req/s, p50 {result.get('p50_ms')}ms, "
+                    f"p95 {result.get('p95_ms')}ms, p99 {result.get('p99_ms')}ms, errors {result['errors']}"
+                )
+
+        report = {'paths': paths, 'results': results}
+        if options['output']:
+            write_report(options['output'], report)
+        else:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+
+    @contextlib.contextmanager
+    def server(self, application, worker_class, options):
+        port = free_port()
+        command = [
+            sys.executable, '-m', 'gunicorn', application, '--bind', f'127.0.0.1:{port}',
+            '--workers', str(options['workers']), '--log-level', 'warning',
+        ]
+        if worker_class:
+            command += ['--worker-class', worker_class]
+        env = dict(os.environ, ASYNC_CATALOG_VIEWS='true' if worker_class else 'false')
+        process = subprocess.Popen(command, env=env)
+        url = f'http://127.0.0.1:{port}'
+        try:
+            self.wait_until_ready(process, url)
+            yield url
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    def wait_until_ready(self, process, url, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f"Server for {url} exited with status {process.returncode}.")
+            try:
+                urllib.request.urlopen(url + '/categories/', timeout=2).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f"Server for {url} did not start within {timeout}s.")
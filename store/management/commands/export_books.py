@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from store.feeds import FEED_FORMATS, export_books, guess_format
+from store.models import Book
+
+
+class Command(BaseCommand):
+    help = "Stream every book as CSV or JSONL, in the columns import_books reads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Write to this file instead of stdout.")
+        parser.add_argument('--format', dest='file_format', choices=FEED_FORMATS,
+                            help="Output format (default: from --output's extension, else csv).")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per round trip (default: 2000).")
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['file_format'] or guess_format(output or '')
+        lines = export_books(Book.objects.order_by('pk'), file_format, options['chunk_size'])
+        if output:
+            with open(output, 'w', encoding='utf-8', newline='') as fh:
+                fh.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.feeds import FEED_FORMATS, export_orders, guess_format
+from store.filters import OrderFilter
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = "Stream order history as CSV or JSONL, one row per order item with its order and book."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Write to this file instead of stdout.")
+        parser.add_argument('--format', dest='file_format', choices=FEED_FORMATS,
+                            help="Output format (default: from --output's extension, else csv).")
+        parser.add_argument('--status', action='append', choices=[value for value, _ in Order.STATUS_CHOICES],
+                            help="Only orders with this status (repeatable).")
+        parser.add_argument('--since', help="Only orders placed at or after this date/time.")
+        parser.add_argument('--until', help="Only orders placed at or before this date/time.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per round trip (default: 2000).")
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['file_format'] or guess_format(output or '')
+        filters = {
+            'status__in': ','.join(options['status'] or ()),
+            'order_date__gte': options['since'],
+            'order_date__lte': options['until'],
+        }
+        filterset = OrderFilter({name: value for name, value in filters.items() if value}, queryset=Order.objects.all())
+        if not filterset.is_valid():
+            raise CommandError(' '.join(f"{name}: {' '.join(errors)}" for name, errors in filterset.errors.items()))
+        lines = export_orders(filterset.qs, file_format, options['chunk_size'])
+        if output:
+            with open(output, 'w', encoding='utf-8', newline='') as fh:
+                fh.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,43 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from store.feeds import FEED_FORMATS, FeedError, guess_format, import_books, text_stream
+
+
+class Command(BaseCommand):
+    help = "Upsert books by ISBN from a CSV or JSONL feed, streaming it in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Feed file, or - for stdin.")
+        parser.add_argument('--format', dest='file_format', choices=FEED_FORMATS,
+                            help="Feed format (default: from the file extension, else csv).")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows upserted per statement (default: 2000).")
+        parser.add_argument('--no-create-categories', action='store_false', dest='create_categories',
+                            help="Report rows with unknown categories as errors instead of creating them.")
+        parser.add_argument('--max-errors', type=int, default=1000, help="Row errors to print (default: 1000).")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or guess_format(path)
+        try:
+            binary = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as exc:
+            raise CommandError(str(exc))
+        try:
+            summary = import_books(
+                text_stream(binary), file_format, chunk_size=options['chunk_size'],
+                create_categories=options['create_categories'], max_errors=options['max_errors'],
+            )
+        except (FeedError, UnicodeDecodeError) as exc:
+            raise CommandError(str(exc))
+        finally:
+            if binary is not sys.stdin.buffer:
+                binary.close()
+
+        for error in summary['errors']:
+            self.stderr.write(f"line {error['line']} ({error['ISBN']}): {error['errors']}")
+        if summary['errors_truncated']:
+            self.stderr.write(f"... {summary['failed'] - len(summary['errors'])} more error(s) not shown")
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {summary['rows']} row(s): {summary['created']} created, "
+            f"{summary['updated']} updated, {summary['failed']} failed."
+        ))
@@ -0,0 +1,42 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from store.feeds import FEED_FORMATS, FeedError, guess_format, provision_users, text_stream
+
+
+class Command(BaseCommand):
+    help = (
+        "Create users and their profiles in bulk from a CSV or JSONL list with "
+        "username, email, password, address and phone columns."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="User list, or - for stdin.")
+        parser.add_argument('--format', dest='file_format', choices=FEED_FORMATS,
+                            help="List format (default: from the file extension, else csv).")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Users inserted per statement (default: 500).")
+        parser.add_argument('--max-errors', type=int, default=1000, help="Row errors to print (default: 1000).")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or guess_format(path)
+        try:
+            binary = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as exc:
+            raise CommandError(str(exc))
+        try:
+            summary = provision_users(
+                text_stream(binary), file_format, chunk_size=options['chunk_size'], max_errors=options['max_errors'],
+            )
+        except (FeedError, UnicodeDecodeError) as exc:
+            raise CommandError(str(exc))
+        finally:
+            if binary is not sys.stdin.buffer:
+                binary.close()
+
+        for error in summary['errors']:
+            self.stderr.write(f"line {error['line']} ({error['username']}): {error['errors']}")
+        if summary['errors_truncated']:
+            self.stderr.write(f"... {summary['failed'] - len(summary['errors'])} more error(s) not shown")
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {summary['rows']} row(s): {summary['created']} created, {summary['failed']} failed."
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from store.cache import bump_namespaces
+from store.models import Book
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized average_rating and review_count on every book."
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='*', type=int, help="Only rebuild these books.")
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Number of books updated per statement (default: 5000).",
+        )
+
+    def handle(self, *args, **options):
+        books = Book.objects.order_by('pk')
+        if options['book_ids']:
+            books = books.filter(pk__in=options['book_ids'])
+        batch_size = options['batch_size']
+        updated = 0
+        last_pk = 0
+        while True:
+            pks = list(books.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            updated += Book.objects.filter(pk__in=pks).refresh_rating_aggregates()
+            last_pk = pks[-1]
+        bump_namespaces('books')
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating aggregates for {updated} book(s)."))
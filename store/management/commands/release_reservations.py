@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = "Return the stock of expired checkout reservations, in batches. Meant to run every minute or so."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Reservations per transaction (default: 1000).")
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservation(s)."))
@@ -0,0 +1,48 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from store.jobs import run_batch, run_pending
+from store.metrics import registry
+from store.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs (store.jobs). Polls the queue until stopped; "
+        "start as many workers as needed, they never pick the same job. Also returns "
+        "expired checkout holds to stock every STOCK_RESERVATION_RELEASE_INTERVAL seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once no job is due.")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to wait when no job is due (default: 1).")
+
+    def handle(self, *args, **options):
+        processed = 0
+        interval = getattr(settings, 'STOCK_RESERVATION_RELEASE_INTERVAL', 60)
+        next_release = 0
+        try:
+            if options['once']:
+                release_expired()
+                processed = run_pending()
+            else:
+                while True:
+                    # Long-running: drop connections past CONN_MAX_AGE or broken
+                    close_old_connections()
+                    if interval and time.monotonic() >= next_release:
+                        # Until released, expired holds keep their units out of stock
+                        release_expired()
+                        next_release = time.monotonic() + interval
+                    count = run_batch()
+                    processed += count
+                    if not count:
+                        # Publish the last batches' metrics while idle
+                        registry.maybe_flush()
+                        time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            registry.maybe_flush(force=True)
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} job(s)."))
@@ -0,0 +1,176 @@
+import contextlib
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from store.models import Book, Category, Order, OrderItem, PurchasedBook, Review
+
+WORDS = (
+    'shadow', 'river', 'empire', 'garden', 'winter', 'silent', 'golden', 'storm', 'letters',
+    'night', 'ocean', 'memory', 'glass', 'iron', 'last', 'hidden', 'city', 'fire', 'secret',
+    'journey', 'house', 'light', 'wild', 'broken', 'north', 'song', 'stone', 'crown', 'paper',
+)
+NAMES = (
+    'Ada', 'Ben', 'Cora', 'Dev', 'Elif', 'Femi', 'Gao', 'Hana', 'Ivan', 'Jun', 'Kira', 'Luis',
+    'Mara', 'Nils', 'Omar', 'Pia', 'Quinn', 'Rosa', 'Sami', 'Tara', 'Uma', 'Vik', 'Wen', 'Yara',
+)
+
+
+@contextlib.contextmanager
+def explicit_timestamps(*fields):
+    # Let bulk_create keep the spread-out dates we generate instead of "now"
+    saved = [(field, field.auto_now_add) for field in fields]
+    for field, _ in saved:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in saved:
+            field.auto_now_add = value
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large synthetic catalog (categories, books, users, orders, reviews) "
+        "with bulk inserts, for benchmarks. Intended for empty development databases."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--books', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=200000)
+        parser.add_argument('--max-items', type=int, default=4, help="Maximum lines per order.")
+        parser.add_argument('--reviews', type=int, default=100000)
+        parser.add_argument('--days', type=int, default=365, help="Spread orders and reviews over this many days.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--password', default='bench-pass', help="Password shared by every seeded user.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for reproducible datasets.")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.days = options['days']
+        self.now = timezone.now()
+
+        categories = self.seed_categories(options['categories'])
+        books = self.seed_books(options['books'], categories)
+        users = self.seed_users(options['users'], options['password'])
+        self.seed_orders_and_reviews(options['orders'], options['max_items'], options['reviews'], books, users)
+
+        call_command('rebuild_book_ratings', batch_size=self.batch_size, stdout=self.stdout)
+        # bulk_create sends no signals, so the sales rollups start empty
+        call_command('backfill_sales', batch_size=self.batch_size, stdout=self.stdout)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        self.stdout.write(self.style.SUCCESS("Seeding complete."))
+
+    def log(self, label, count):
+        self.stdout.write(f"  {label}: {count}")
+
+    def random_moment(self):
+        return self.now - timedelta(seconds=self.rng.randrange(self.days * 86400))
+
+    def seed_categories(self, count):
+        start = Category.objects.count()
+        categories = Category.objects.bulk_create(
+            [Category(name=f'Category {start + i}', description='Seeded category') for i in range(count)],
+            batch_size=self.batch_size,
+        )
+        self.log('categories', len(categories))
+        return [c.pk for c in categories] or list(Category.objects.values_list('pk', flat=True))
+
+    def seed_books(self, count, categories):
+        start = Book.objects.count()
+        pks = []
+        for offset in range(0, count, self.batch_size):
+            batch = []
+            for i in range(offset, min(offset + self.batch_size, count)):
+                title = ' '.join(self.rng.sample(WORDS, self.rng.randint(2, 4))).title()
+                batch.append(Book(
+                    title=title,
+                    author=f'{self.rng.choice(NAMES)} {self.rng.choice(NAMES)}son',
+                    ISBN=f'979{start + i:010d}',
+                    price=Decimal(self.rng.randrange(299, 9999)) / 100,
+                    stock=self.rng.choice((0, 0, 3, 10, 25, 50, 100)),
+                    published_date=date(1950, 1, 1) + timedelta(days=self.rng.randrange(27000)),
+                    category_id=self.rng.choice(categories),
+                ))
+            pks += [b.pk for b in Book.objects.bulk_create(batch)]
+        self.log('books', len(pks))
+        return pks
+
+    def seed_users(self, count, password):
+        start = User.objects.count()
+        # Hash once: per-user PBKDF2 would dominate the run
+        hashed = make_password(password)
+        pks = []
+        for offset in range(0, count, self.batch_size):
+            batch = [
+                User(username=f'bench_user_{start + i}', email=f'bench_user_{start + i}@example.com', password=hashed)
+                for i in range(offset, min(offset + self.batch_size, count))
+            ]
+            pks += [u.pk for u in User.objects.bulk_create(batch)]
+        self.log('users', len(pks))
+        return pks
+
+    def seed_orders_and_reviews(self, count, max_items, review_target, books, users):
+        if not (books and users):
+            return
+        # Reviews are drawn from purchased (user, book) pairs, at most one each
+        review_ratio = min(1.0, review_target / max(1, count * (max_items + 1) / 2))
+        reviewed = set()
+        order_field = Order._meta.get_field('order_date')
+        review_field = Review._meta.get_field('created_at')
+        prices = dict(Book.objects.values_list('pk', 'price').iterator())
+        orders_created = items_created = reviews_created = 0
+        with explicit_timestamps(order_field, review_field):
+            for offset in range(0, count, self.batch_size):
+                size = min(self.batch_size, count - offset)
+                lines = []
+                orders = []
+                for _ in range(size):
+                    chosen = self.rng.sample(books, self.rng.randint(1, min(max_items, len(books))))
+                    quantities = [(pk, self.rng.randint(1, 3)) for pk in chosen]
+                    lines.append(quantities)
+                    orders.append(Order(
+                        user_id=self.rng.choice(users),
+                        total_price=sum(prices[pk] * qty for pk, qty in quantities),
+                        status=self.rng.choice(('pending', 'shipped', 'delivered', 'delivered')),
+                        order_date=self.random_moment(),
+                    ))
+                with transaction.atomic():
+                    Order.objects.bulk_create(orders)
+                    items = []
+                    purchases = []
+                    reviews = []
+                    for order, quantities in zip(orders, lines):
+                        for pk, qty in quantities:
+                            items.append(OrderItem(order_id=order.pk, book_id=pk, quantity=qty, price_at_purchase=prices[pk]))
+                            purchases.append(PurchasedBook(user_id=order.user_id, book_id=pk, purchased_at=order.order_date))
+                            pair = (order.user_id, pk)
+                            if (
+                                reviews_created + len(reviews) < review_target
+                                and pair not in reviewed and self.rng.random() < review_ratio
+                            ):
+                                reviewed.add(pair)
+                                reviews.append(Review(
+                                    user_id=order.user_id, book_id=pk, rating=self.rng.randint(1, 5),
+                                    comment='Seeded review', created_at=order.order_date + timedelta(days=7),
+                                ))
+                    OrderItem.objects.bulk_create(items, batch_size=self.batch_size)
+                    # bulk_create sends no signals, so fill the purchase index here
+                    PurchasedBook.objects.bulk_create(purchases, batch_size=self.batch_size, ignore_conflicts=True)
+                    Review.objects.bulk_create(reviews, batch_size=self.batch_size)
+                orders_created += len(orders)
+                items_created += len(items)
+                reviews_created += len(reviews)
+        self.log('orders', orders_created)
+        self.log('order items', items_created)
+        self.log('reviews', reviews_created)
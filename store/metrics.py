@@ -0,0 +1,257 @@
+"""
+Per-endpoint request metrics in the Prometheus text exposition format.
+
+MetricsMiddleware records, for every request, latency, SQL query count and
+SQL time as histograms plus a request counter by status, labelled with the
+resolved URL name and DRF action. Job workers (store.jobs) record
+throughput, batch sizes and queueing delay per task, and the database
+backend (store.postgresql) the connections it opens and the time spent
+waiting for pooled ones. Each worker process keeps its own registry; when
+settings.METRICS_DIR is set, workers write a snapshot to a per-process
+file there at most every METRICS_FLUSH_INTERVAL seconds, and the /metrics
+view merges all of them so counters add up across gunicorn workers. Uses only the standard library.
+"""
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from django.conf import settings
+from django.db import connections
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+WAIT_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 10.0)
+
+COUNTERS = {
+    'http_requests_total': "Requests handled, by view, action, method and status.",
+    'jobs_total': "Background jobs processed, by task and outcome (done, retried, failed).",
+    'db_connections_total': "Database connections opened, each a full handshake, by database.",
+    'db_pool_checkouts_total': "Connections taken from the pool, by database and outcome (ok, error).",
+}
+HISTOGRAMS = {
+    'http_request_duration_seconds': ("Time to produce the response.", LATENCY_BUCKETS),
+    'http_request_db_queries': ("SQL queries executed per request.", QUERY_BUCKETS),
+    'http_request_db_duration_seconds': ("Time spent executing SQL per request.", LATENCY_BUCKETS),
+    'job_batch_size': ("Jobs run per batch, by task.", BATCH_BUCKETS),
+    'job_batch_duration_seconds': ("Time to run a batch of jobs, by task.", LATENCY_BUCKETS),
+    'job_wait_seconds': ("Time jobs were due before a worker started them, by task.", WAIT_BUCKETS),
+    'db_pool_wait_seconds': ("Time spent waiting for a pooled connection, by database.", POOL_WAIT_BUCKETS),
+}
+
+
+class QueryStats:
+    """
+    Database execute wrapper counting queries and their wall time.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+    @contextlib.contextmanager
+    def installed(self):
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+
+class Registry:
+    """
+    Counters and histograms keyed by `(metric, labels)`, where labels is a
+    tuple of `(name, value)` pairs. Histogram entries hold per-bucket
+    counts (made cumulative when rendered), then the sum and the count.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+        self.pid = os.getpid()
+        # pids are reused; a fresh id keeps a new worker from overwriting
+        # the totals of the one it replaced
+        self.file_id = f'{self.pid}-{uuid.uuid4().hex[:8]}'
+        self.last_flush = 0.0
+
+    def check_fork(self):
+        # A registry inherited across fork belongs to the parent
+        if os.getpid() != self.pid:
+            self.reset()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        entry = self.histograms.get(key)
+        if entry is None:
+            entry = self.histograms[key] = [0] * len(buckets) + [0.0, 0]
+        index = bisect.bisect_left(buckets, value)
+        if index < len(buckets):
+            entry[index] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def observe_request(self, labels, status, duration, queries):
+        with self.lock:
+            self.check_fork()
+            self.inc('http_requests_total', labels + (('status', str(status)),))
+            self.observe('http_request_duration_seconds', labels, duration)
+            self.observe('http_request_db_queries', labels, queries.count)
+            self.observe('http_request_db_duration_seconds', labels, queries.duration)
+        self.maybe_flush()
+
+    def observe_jobs(self, task, outcomes, duration, waits):
+        labels = (('task', task),)
+        with self.lock:
+            self.check_fork()
+            for outcome, count in outcomes.items():
+                self.inc('jobs_total', labels + (('outcome', outcome),), count)
+            self.observe('job_batch_size', labels, sum(outcomes.values()))
+            self.observe('job_batch_duration_seconds', labels, duration)
+            for wait in waits:
+                self.observe('job_wait_seconds', labels, wait)
+        self.maybe_flush()
+
+    def observe_db_connection(self, alias):
+        with self.lock:
+            self.check_fork()
+            self.inc('db_connections_total', (('database', alias),))
+        self.maybe_flush()
+
+    def observe_pool_checkout(self, alias, wait, outcome):
+        labels = (('database', alias),)
+        with self.lock:
+            self.check_fork()
+            self.inc('db_pool_checkouts_total', labels + (('outcome', outcome),))
+            self.observe('db_pool_wait_seconds', labels, wait)
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, list(entry)] for (name, labels), entry in self.histograms.items()],
+            }
+
+    def maybe_flush(self, force=False):
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 5):
+            return
+        self.last_flush = now
+        path = Path(directory) / f'{self.file_id}.json'
+        temporary = Path(directory) / f'{self.file_id}.{threading.get_ident()}.tmp'
+        try:
+            temporary.write_text(json.dumps(self.snapshot()))
+            os.replace(temporary, path)
+        except OSError:
+            pass
+
+    def collect(self):
+        """
+        Merged snapshot of every worker writing to METRICS_DIR, or of this
+        process alone when it isn't set.
+        """
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return merge([self.snapshot()])
+        self.maybe_flush(force=True)
+        snapshots = []
+        for path in Path(directory).glob('*.json'):
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue
+        return merge(snapshots)
+
+
+def merge(snapshots):
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, entry in snapshot['histograms']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], entry)]
+            else:
+                histograms[key] = list(entry)
+    return counters, histograms
+
+
+def format_labels(labels, extra=()):
+    pairs = []
+    for name, value in tuple(labels) + tuple(extra):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(counters, histograms):
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (metric, labels), entry in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, entry):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels, [("le", "+Inf")])} {entry[-1]}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(entry[-2])}')
+            lines.append(f'{name}_count{format_labels(labels)} {entry[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def render_metrics():
+    return render(*registry.collect())
+
+
+def request_labels(request):
+    """
+    `(view, action, method)` labels: the URL name, and for viewsets the
+    action the method maps to (so POST /orders/ is order-list/create).
+    """
+    method = request.method
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return (('view', 'unmatched'), ('action', ''), ('method', method))
+    actions = getattr(match.func, 'actions', None)
+    action = actions.get(method.lower(), '') if actions else method.lower()
+    return (('view', match.view_name or match.route), ('action', action), ('method', method))
@@ -0,0 +1,99 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from rest_framework import permissions
+from .metrics import QueryStats, registry, request_labels
+from .routers import ReplicaReads, get_replicas, pin, replica_reads
+
+
+class MetricsMiddleware:
+    """
+    Record latency, status and SQL usage of every request in the metrics
+    registry. Works in both WSGI and ASGI stacks without a thread hop.
+    Place it first so the timing covers the other middleware too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = QueryStats()
+        started = time.perf_counter()
+        status = 500
+        try:
+            with queries.installed():
+                response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            registry.observe_request(request_labels(request), status, time.perf_counter() - started, queries)
+
+    async def __acall__(self, request):
+        queries = QueryStats()
+        started = time.perf_counter()
+        status = 500
+        try:
+            with queries.installed():
+                response = await self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            registry.observe_request(request_labels(request), status, time.perf_counter() - started, queries)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Let store.routers.ReplicaRouter send the catalog reads of safe-method
+    requests to a replica, and pin the user to the primary after a
+    successful write. Does nothing unless settings.REPLICA_DATABASES is set.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        replicas = get_replicas()
+        if not replicas:
+            return self.get_response(request)
+        token = replica_reads.set(self.reads(request, replicas))
+        try:
+            response = self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+        self.pin_writer(request, response)
+        return response
+
+    async def __acall__(self, request):
+        replicas = get_replicas()
+        if not replicas:
+            return await self.get_response(request)
+        token = replica_reads.set(self.reads(request, replicas))
+        try:
+            response = await self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+        if request.method not in permissions.SAFE_METHODS:
+            await sync_to_async(self.pin_writer)(request, response)
+        return response
+
+    def reads(self, request, replicas):
+        return ReplicaReads(request, replicas) if request.method in permissions.SAFE_METHODS else None
+
+    def pin_writer(self, request, response):
+        # DRF authenticates inside the view and copies the user onto the request
+        if request.method in permissions.SAFE_METHODS or response.status_code >= 400:
+            return
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            pin(user.pk)
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from store.search import get_native_backend
+
+
+def install_search_index(apps, schema_editor):
+    Book = apps.get_model('store', 'Book')
+    get_native_backend(schema_editor.connection).install(schema_editor, Book._meta.db_table)
+
+
+def uninstall_search_index(apps, schema_editor):
+    Book = apps.get_model('store', 'Book')
+    get_native_backend(schema_editor.connection).uninstall(schema_editor, Book._meta.db_table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_book_average_rating_book_review_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
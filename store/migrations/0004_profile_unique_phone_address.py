@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:23
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_profiles(apps, schema_editor):
+    # Fail with the offending values rather than a bare IntegrityError;
+    # which duplicate to keep is a support decision, not a migration's
+    Profile = apps.get_model('store', 'Profile')
+    profiles = Profile.objects.using(schema_editor.connection.alias)
+    for field in ('phone', 'address'):
+        duplicates = list(
+            profiles.order_by().values(field).annotate(n=Count('id')).filter(n__gt=1).values_list(field, flat=True)[:10]
+        )
+        if duplicates:
+            raise RuntimeError(
+                f"Cannot make Profile.{field} unique; resolve the duplicated values first: {duplicates}"
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_book_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_profiles, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='profile',
+            name='address',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='phone',
+            field=models.CharField(max_length=20, unique=True),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def backfill_purchases(apps, schema_editor):
+    OrderItem = apps.get_model('store', 'OrderItem')
+    PurchasedBook = apps.get_model('store', 'PurchasedBook')
+    alias = schema_editor.connection.alias
+    pairs = (
+        OrderItem.objects.using(alias).order_by().values('order__user_id', 'book_id')
+        .annotate(first=Min('order__order_date')).iterator(chunk_size=5000)
+    )
+    batch = []
+    for pair in pairs:
+        batch.append(PurchasedBook(user_id=pair['order__user_id'], book_id=pair['book_id'], purchased_at=pair['first']))
+        if len(batch) == 5000:
+            PurchasedBook.objects.using(alias).bulk_create(batch)
+            batch = []
+    PurchasedBook.objects.using(alias).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_profile_unique_phone_address'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchasedBook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('purchased_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['user', 'book'], name='store_review_user_book_idx'),
+        ),
+        migrations.AddField(
+            model_name='purchasedbook',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='purchases', to='store.book'),
+        ),
+        migrations.AddField(
+            model_name='purchasedbook',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='purchased_books', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='purchasedbook',
+            index=models.Index(fields=['user', '-purchased_at', '-id'], name='store_purchase_user_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='purchasedbook',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='store_purchasedbook_user_book_uniq'),
+        ),
+        migrations.RunPython(backfill_purchases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_hot_path_indexes'),
+    ]
+
+    operations = [
+        # Build the composite index before dropping the FK's own one
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['order', 'id'], name='store_orderitem_order_idx'),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='store.order'),
+        ),
+    ]
@@ -1,9 +1,14 @@
 from django.db import models
+from django.db.models import Avg, Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
+    # Change tracking for conditional GETs (store.conditional)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -11,6 +16,19 @@ class Category(models.Model):
     class Meta:
         verbose_name_plural = "Categories"
 
+class BookQuerySet(models.QuerySet):
+    def refresh_rating_aggregates(self):
+        """
+        Recompute average_rating and review_count from the reviews table
+        in a single UPDATE over the books in this queryset.
+        """
+        reviews = Review.objects.filter(book=OuterRef('pk')).order_by().values('book')
+        return self.update(
+            average_rating=Subquery(reviews.annotate(avg=Avg('rating')).values('avg')),
+            review_count=Coalesce(Subquery(reviews.annotate(n=Count('id')).values('n')), 0),
+            updated_at=timezone.now(),
+        )
+
 class Book(models.Model):
     title = models.CharField(max_length=200)
     author = models.CharField(max_length=100)
@@ -19,10 +37,29 @@ class Book(models.Model):
     stock = models.IntegerField()
     published_date = models.DateField()
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='books')
+    # Denormalized from Review, kept in sync by store.signals
+    average_rating = models.DecimalField(max_digits=3, decimal_places=2, null=True, blank=True, editable=False, db_index=True)
+    review_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    # Change tracking for conditional GETs (store.conditional). save() sets
+    # it; queryset updates of rendered columns must set it themselves.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = BookQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.title} by {self.author}"
 
+    class Meta:
+        indexes = [
+            # ?ordering=price / published_date, both directions; id is the
+            # keyset pagination tiebreak
+            models.Index(fields=['price', 'id'], name='store_book_price_idx'),
+            models.Index(fields=['published_date', 'id'], name='store_book_published_idx'),
+            models.Index(fields=['category', 'price'], name='store_book_category_price_idx'),
+            # ?in_stock=true, the storefront default, by price
+            models.Index(fields=['price', 'id'], condition=Q(stock__gt=0), name='store_book_in_stock_idx'),
+        ]
+
 class Review(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reviews')
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='reviews')
@@ -35,6 +72,12 @@ class Review(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Backs the one-review-per-book check on review creation
+            models.Index(fields=['user', 'book'], name='store_review_user_book_idx'),
+            # Newest reviews of a book (ReviewPagination)
+            models.Index(fields=['book', '-created_at', '-id'], name='store_review_book_recent_idx'),
+        ]
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -42,6 +85,12 @@ class Order(models.Model):
         ('shipped', 'Shipped'),
         ('delivered', 'Delivered'),
     ]
+    # Fulfilment only moves forward (store.fulfilment)
+    STATUS_TRANSITIONS = {
+        'pending': ('shipped', 'delivered'),
+        'shipped': ('delivered',),
+        'delivered': (),
+    }
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     books = models.ManyToManyField('Book', through='OrderItem', related_name='orders')
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -53,9 +102,17 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-order_date']
+        indexes = [
+            # A user's order history, and the staff list of all orders
+            models.Index(fields=['user', '-order_date', '-id'], name='store_order_user_date_idx'),
+            models.Index(fields=['-order_date', '-id'], name='store_order_date_idx'),
+            # Staff work queue: ?status=pending
+            models.Index(fields=['-order_date', '-id'], condition=Q(status='pending'), name='store_order_pending_idx'),
+        ]
 
 class OrderItem(models.Model):
-    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    # Indexed by store_orderitem_order_idx instead
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items', db_index=False)
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='order_items')
     quantity = models.IntegerField()
     price_at_purchase = models.DecimalField(max_digits=8, decimal_places=2)
@@ -63,10 +120,124 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{self.quantity} x {self.book.title} in Order #{self.order.id}"
 
+    class Meta:
+        indexes = [
+            # Items of an order, and the order export's (order, item) scan
+            models.Index(fields=['order', 'id'], name='store_orderitem_order_idx'),
+        ]
+
+class PurchasedBook(models.Model):
+    """
+    One row per (user, book) the user has ever ordered, so purchase checks
+    and the purchased-books list don't join through order history. Kept in
+    sync with OrderItem by store.signals.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='purchased_books')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='purchases')
+    # Date of the first order containing the book
+    purchased_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user.username} bought {self.book.title}"
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'book'], name='store_purchasedbook_user_book_uniq')]
+        indexes = [models.Index(fields=['user', '-purchased_at', '-id'], name='store_purchase_user_date_idx')]
+
+class StockReservation(models.Model):
+    """
+    Units of a book held for a user during checkout, already taken out of
+    Book.stock. Converted by placing an order before `expires_at`, or
+    returned to stock by store.reservations once expired.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_reservations')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.book.title} held for {self.user.username}"
+
+    class Meta:
+        ordering = ['expires_at']
+        indexes = [
+            # Conversion at checkout, and the expiry sweep
+            models.Index(fields=['user', 'book'], name='store_reservation_user_idx'),
+            models.Index(fields=['expires_at'], name='store_reservation_expiry_idx'),
+        ]
+
+class DailySales(models.Model):
+    """
+    Orders, units and revenue per day and order status, so revenue series
+    don't scan order history. Kept up to date by store.analytics; rebuilt
+    with `manage.py backfill_sales`.
+    """
+    day = models.DateField()
+    status = models.CharField(max_length=10, choices=Order.STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Sales on {self.day} ({self.status})"
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'status'], name='store_dailysales_day_status_uniq')]
+
+class DailyBookSales(models.Model):
+    """
+    Orders, units and revenue per day and book, for bestsellers and
+    per-category series. `category` is the book's category when sold.
+    """
+    day = models.DateField()
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='daily_sales')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_sales')
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Sales of {self.book.title} on {self.day}"
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'book'], name='store_dailybooksales_day_book_uniq')]
+        indexes = [models.Index(fields=['category', 'day'], name='store_booksales_cat_day_idx')]
+
+class Job(models.Model):
+    """
+    Deferred work for store.jobs. Rows are deleted once their task
+    succeeds; `failed_at` marks jobs that ran out of attempts.
+    """
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    # Optional: a job enqueued while one with the same task and key is
+    # still waiting is dropped, since that one will do the work. Cleared
+    # when a worker claims the job.
+    key = models.CharField(max_length=200, null=True, blank=True)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.task} job #{self.pk}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'key'], condition=Q(failed_at__isnull=True), name='store_job_task_key_uniq'),
+        ]
+        indexes = [
+            # What workers poll: due jobs, oldest first
+            models.Index(fields=['run_at', 'id'], condition=Q(failed_at__isnull=True), name='store_job_ready_idx'),
+        ]
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
-    address = models.CharField(max_length=255)
-    phone = models.CharField(max_length=20)
+    # Unique indexes back the registration conflict checks
+    address = models.CharField(max_length=255, unique=True)
+    phone = models.CharField(max_length=20, unique=True)
 
     def __str__(self):
         return f"Profile of {self.user.username}"
@@ -0,0 +1,302 @@
+import base64
+import binascii
+import datetime
+import json
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.core.paginator import InvalidPage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from .filters import ordering_name
+
+
+def estimate_count(queryset):
+    """
+    Row estimate from the query planner, without running COUNT(*).
+    Returns None on databases that don't expose one.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    query, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {query}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder drops microseconds, which would make rows that share
+    # a millisecond fall between two pages
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks with a range condition on the ordering
+    columns instead of OFFSET, and never counts.
+
+    By default the ordering is the one already on the queryset (so it
+    follows OrderingFilter), falling back to the model's Meta.ordering, with
+    `id` appended as a tie-breaker so every row has a distinct position.
+    Set `ordering` on a subclass to pin it instead. NULLs sort last.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    page_size = api_settings.PAGE_SIZE
+    ordering = None
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering, cursor = self.prepare(queryset, request)
+        if self.estimate_requested:
+            self.estimated_count = estimate_count(queryset)
+        return self.paginate_from(queryset, cursor, ordering)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        ordering, cursor = self.prepare(queryset, request)
+        if self.estimate_requested:
+            self.estimated_count = await sync_to_async(estimate_count)(queryset)
+        return await self.apaginate_from(queryset, cursor, ordering)
+
+    def prepare(self, queryset, request):
+        self.base_url = request.build_absolute_uri()
+        self.estimate_requested = request.query_params.get(self.count_query_param) == 'estimate'
+        ordering = self.get_ordering(queryset)
+        return ordering, self.decode_cursor(request, queryset, ordering)
+
+    def get_ordering(self, queryset):
+        terms = self.ordering or queryset.query.order_by or queryset.model._meta.ordering or ['-id']
+        ordering = []
+        for term in map(ordering_name, terms):
+            if not isinstance(term, str) or '__' in term or term.lstrip('-') == '?':
+                raise ValidationError({'ordering': [f"Cursor pagination does not support ordering by {term}."]})
+            name = term.lstrip('-')
+            ordering.append(('id' if name == 'pk' else name, term.startswith('-')))
+        if 'id' not in [name for name, desc in ordering]:
+            ordering.append(('id', ordering[0][1]))
+        return ordering
+
+    def paginate_from(self, queryset, cursor=None, ordering=None):
+        """
+        Return the page starting after `cursor` (a `(values, reverse)` pair,
+        or None for the first page). Runs exactly one query.
+        """
+        window = self.window(queryset, cursor, ordering)
+        return self.set_page(list(window), cursor)
+
+    async def apaginate_from(self, queryset, cursor=None, ordering=None):
+        window = self.window(queryset, cursor, ordering)
+        return self.set_page([obj async for obj in window], cursor)
+
+    def window(self, queryset, cursor, ordering):
+        # The unevaluated query for one page plus a lookahead row
+        ordering = ordering or self.get_ordering(queryset)
+        self.ordering_fields = [name for name, desc in ordering]
+        values, reverse = cursor or (None, False)
+        if reverse:
+            ordering = [(name, not desc) for name, desc in ordering]
+        queryset = queryset.order_by(*[self.order_term(queryset, name, desc, reverse) for name, desc in ordering])
+        if values is not None:
+            queryset = queryset.filter(self.seek_condition(queryset, ordering, values, nulls_last=not reverse))
+        return queryset[:self.page_size + 1]
+
+    def order_term(self, queryset, name, desc, reverse):
+        # NULLs are only placed explicitly in nullable columns: elsewhere the
+        # default placement lets a btree index be scanned in either direction
+        nulls = {}
+        if self.get_field(queryset, name).null:
+            nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+        return F(name).desc(**nulls) if desc else F(name).asc(**nulls)
+
+    def set_page(self, results, cursor):
+        values, reverse = cursor or (None, False)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = values is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        self.page = results
+        return results
+
+    def seek_condition(self, queryset, ordering, values, nulls_last):
+        # (a, b) > (x, y) expanded to: a > x OR (a = x AND b > y), where a
+        # NULL sorts after every value when nulls_last and before otherwise
+        condition = Q()
+        equal = Q()
+        for (name, desc), value in zip(ordering, values):
+            if value is None:
+                after = Q() if nulls_last else Q(**{f'{name}__isnull': False})
+                same = Q(**{f'{name}__isnull': True})
+            else:
+                after = Q(**{f"{name}__{'lt' if desc else 'gt'}": value})
+                if nulls_last and self.get_field(queryset, name).null:
+                    after |= Q(**{f'{name}__isnull': True})
+                same = Q(**{name: value})
+            if after:
+                condition |= equal & after
+            equal &= same
+        return condition
+
+    def get_field(self, queryset, name):
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        try:
+            return queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise ValidationError({'ordering': [f"Cursor pagination does not support ordering by {name}."]})
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.position(self.page[0]), reverse=True)
+
+    def position(self, instance):
+        return [getattr(instance, name) for name in self.ordering_fields]
+
+    def encode_cursor(self, values, reverse):
+        payload = json.dumps({'v': values, 'r': int(reverse)}, cls=CursorEncoder)
+        encoded = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request, queryset, ordering):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            values, reverse = payload['v'], bool(payload['r'])
+            if len(values) != len(ordering):
+                raise ValueError
+            values = [
+                None if value is None else self.get_field(queryset, name).to_python(value)
+                for (name, desc), value in zip(ordering, values)
+            ]
+        except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if getattr(self, 'estimate_requested', False):
+            payload['estimated_count'] = self.estimated_count
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'estimated_count': {'type': 'integer', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class ReviewPagination(KeysetPagination):
+    """
+    Newest reviews first. Shared by the book detail view, which embeds the
+    first page, and BookReviewListView, which serves the rest.
+    """
+    ordering = ('-created_at', '-id')
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    """
+    PageNumberPagination that async views can drive with `apaginate_queryset`,
+    fetching the count and the page with the async ORM.
+    """
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Paginator.count is a cached_property; fill it without blocking
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.page.object_list = [obj async for obj in self.page.object_list]
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return list(self.page)
+
+
+class HybridPagination(AsyncPageNumberPagination):
+    """
+    Page numbers by default, so existing clients keep working; keyset
+    cursors when the request asks for `?pagination=cursor` or carries a
+    `cursor` (as every cursor-mode next/previous link does).
+    """
+    cursor_pagination_class = KeysetPagination
+    mode_query_param = 'pagination'
+
+    def use_cursor(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_pagination_class.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.use_cursor(request):
+            return self.get_cursor_paginator(request).paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.use_cursor(request):
+            return await self.get_cursor_paginator(request).apaginate_queryset(queryset, request, view)
+        return await super().apaginate_queryset(queryset, request, view)
+
+    def get_cursor_paginator(self, request):
+        self.cursor_paginator = self.cursor_pagination_class()
+        self.cursor_paginator.page_size = self.get_page_size(request)
+        return self.cursor_paginator
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class ReviewListPagination(HybridPagination):
+    cursor_pagination_class = ReviewPagination
+
+
+class PurchasePagination(KeysetPagination):
+    # Matches the (user, -purchased_at, -id) index
+    ordering = ('-purchased_at', '-id')
+
+
+class PurchaseListPagination(HybridPagination):
+    cursor_pagination_class = PurchasePagination
@@ -1,5 +1,5 @@
 from rest_framework import permissions
-from .models import Order, Book
+from .models import Book, PurchasedBook
 
 class IsAdminOrReadOnly(permissions.BasePermission):
     """
@@ -21,8 +21,11 @@ class IsReviewerAndPurchasedBook(permissions.BasePermission):
         book_id = request.data.get('book')
         if not user or not user.is_authenticated or not book_id:
             return False
-        # Check if user has an order with this book
-        return Order.objects.filter(user=user, items__book_id=book_id).exists()
+        # One lookup on the (user, book) unique index of the purchase table
+        try:
+            return PurchasedBook.objects.filter(user_id=user.pk, book_id=int(book_id)).exists()
+        except (TypeError, ValueError):
+            return False
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     """
@@ -31,5 +34,5 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
-        # Assumes the object has a 'user' attribute
-        return hasattr(obj, 'user') and obj.user == request.user
+        # Assumes the object has a 'user' foreign key; compared by id so no user is loaded
+        return hasattr(obj, 'user_id') and obj.user_id == request.user.pk
@@ -0,0 +1,32 @@
+"""
+PostgreSQL backend that reports its connections to store.metrics.
+
+Behaves exactly like django.db.backends.postgresql; set ENGINE to
+'store.postgresql' to count every connection opened (each one a full,
+possibly TLS, handshake) and, with OPTIONS['pool'], how long each request
+waited for a pooled connection. Fewer opened connections than pool
+checkouts is the handshakes the pool saved.
+"""
+import time
+from django.db.backends.postgresql import base
+from ..metrics import registry
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        if not self.pool:
+            return super().get_new_connection(conn_params)
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            connection = super().get_new_connection(conn_params)
+            outcome = 'ok'
+            return connection
+        finally:
+            registry.observe_pool_checkout(self.alias, time.perf_counter() - started, outcome)
+
+    def _configure_connection(self, connection):
+        # Runs once per new server connection: from init_connection_state
+        # without a pool, from the pool's own threads with one
+        registry.observe_db_connection(self.alias)
+        return super()._configure_connection(connection)
@@ -0,0 +1,157 @@
+"""
+Short-lived stock reservations for checkout.
+
+Reserving takes the quantities out of Book.stock straight away, with the
+same conditional UPDATE order placement uses, so a hold can never oversell
+and `stock` is always what is still available. A user may hold at most
+STOCK_RESERVATION_MAX_QUANTITY units of each book. Placing an order converts
+the user's live holds on its books: reserved units are not decremented
+again, and only the unreserved remainder touches the (hot) book row.
+Expired holds go back to stock in batches, periodically from the
+`run_jobs` worker (or `release_reservations`), and on demand when a
+reservation or checkout finds too little stock.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.utils import timezone
+from .cache import bump_namespaces
+from .models import Book, StockReservation
+
+
+class StockError(Exception):
+    pass
+
+
+def adjust_stock(deltas):
+    """
+    Subtract `deltas[book_id]` from each book's stock in one UPDATE that
+    only matches books with enough stock; negative deltas return stock.
+    Returns whether every book matched. Callers run it in a transaction
+    and roll back when it didn't.
+    """
+    deltas = {book_id: delta for book_id, delta in deltas.items() if delta}
+    if not deltas:
+        return True
+    in_stock = Q()
+    for book_id, delta in deltas.items():
+        in_stock |= Q(pk=book_id, stock__gte=delta)
+    updated = Book.objects.filter(in_stock).update(stock=F('stock') - Case(
+        *[When(pk=book_id, then=Value(delta)) for book_id, delta in deltas.items()],
+        output_field=IntegerField(),
+    ), updated_at=timezone.now())
+    return updated == len(deltas)
+
+
+def shortage_message(quantities):
+    books = Book.objects.in_bulk(list(quantities))
+    for book_id, quantity in quantities.items():
+        book = books.get(book_id)
+        if book is None:
+            return f"Book with id {book_id} does not exist."
+        if book.stock < quantity:
+            return f"Not enough stock for '{book.title}'. Available: {book.stock}, requested: {quantity}"
+    return "Stock changed while reserving. Please try again."
+
+
+def check_hold_limit(user_id, quantities, limit):
+    """
+    Raise StockError if holding `quantities` on top of the user's live holds
+    would exceed `limit` units of any book. The user's row is locked first,
+    so concurrent reservations by one user are checked one at a time.
+    """
+    list(User.objects.select_for_update().filter(pk=user_id).values_list('pk', flat=True))
+    held = dict(
+        StockReservation.objects.filter(user_id=user_id, book_id__in=list(quantities), expires_at__gt=timezone.now())
+        .order_by().values('book_id').annotate(total=Sum('quantity')).values_list('book_id', 'total')
+    )
+    for book_id, quantity in quantities.items():
+        if held.get(book_id, 0) + quantity > limit:
+            title = Book.objects.filter(pk=book_id).values_list('title', flat=True).first()
+            raise StockError(
+                f"You can hold at most {limit} of '{title or book_id}'. "
+                f"Held: {held.get(book_id, 0)}, requested: {quantity}"
+            )
+
+
+def reserve(user_id, quantities, ttl=None):
+    """
+    Hold `quantities` ({book_id: quantity}) for `ttl` seconds (default
+    settings.STOCK_RESERVATION_TTL). All or nothing: raises StockError if
+    the user would hold too many of a book, or if any book is short, after
+    first releasing expired holds on those books.
+    """
+    ttl = ttl or getattr(settings, 'STOCK_RESERVATION_TTL', 600)
+    limit = getattr(settings, 'STOCK_RESERVATION_MAX_QUANTITY', 10)
+    for attempt in range(2):
+        with transaction.atomic():
+            if limit:
+                check_hold_limit(user_id, quantities, limit)
+            if adjust_stock(quantities):
+                expires_at = timezone.now() + timedelta(seconds=ttl)
+                reservations = StockReservation.objects.bulk_create([
+                    StockReservation(user_id=user_id, book_id=book_id, quantity=quantity, expires_at=expires_at)
+                    for book_id, quantity in quantities.items()
+                ])
+                bump_namespaces('books')
+                return reservations
+            transaction.set_rollback(True)
+        if attempt or not release_expired(book_ids=list(quantities)):
+            break
+    raise StockError(shortage_message(quantities))
+
+
+def claim(user_id, book_ids):
+    """
+    Lock and return the user's live reservations on `book_ids` as
+    ({book_id: reserved quantity}, reservation ids). Call inside the order
+    transaction and delete the ids once the order is written.
+    """
+    reserved = defaultdict(int)
+    ids = []
+    rows = (
+        StockReservation.objects.select_for_update()
+        .filter(user_id=user_id, book_id__in=book_ids, expires_at__gt=timezone.now())
+        .values_list('pk', 'book_id', 'quantity')
+    )
+    for pk, book_id, quantity in rows:
+        reserved[book_id] += quantity
+        ids.append(pk)
+    return reserved, ids
+
+
+def release(queryset, batch_size=1000):
+    """
+    Delete the reservations in `queryset` and return their stock, one
+    transaction per `batch_size` rows. Rows locked by a concurrent
+    checkout or release are skipped. Returns the number released.
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                queryset.select_for_update(skip_locked=True).order_by('pk')
+                .values_list('pk', 'book_id', 'quantity')[:batch_size]
+            )
+            if not batch:
+                break
+            returned = defaultdict(int)
+            for _, book_id, quantity in batch:
+                returned[book_id] -= quantity
+            adjust_stock(returned)
+            StockReservation.objects.filter(pk__in=[pk for pk, _, _ in batch]).delete()
+            bump_namespaces('books')
+        released += len(batch)
+        if len(batch) < batch_size:
+            break
+    return released
+
+
+def release_expired(book_ids=None, batch_size=1000):
+    expired = StockReservation.objects.filter(expires_at__lte=timezone.now())
+    if book_ids is not None:
+        expired = expired.filter(book_id__in=book_ids)
+    return release(expired, batch_size)
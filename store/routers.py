@@ -0,0 +1,103 @@
+"""
+Read-replica routing with read-your-writes stickiness.
+
+ReplicaRouter sends reads of the catalog models (Book, Category, Review)
+to one of settings.REPLICA_DATABASES, but only while
+ReplicaRoutingMiddleware allows it: during a safe-method request from a
+user who hasn't written anything in the last REPLICA_PIN_SECONDS. All
+other reads and every write go to the primary ('default'), as does
+anything outside a request (management commands, job workers).
+
+A successful unsafe request pins its user to the primary for the window,
+through a cache entry every worker sees, so replication lag never hides a
+user's own order or review from them. For the same window after a
+write, store.cache doesn't cache what a request read from a replica, so
+a lagging replica's rows never land in the shared response cache under
+the new version. Replicas should lag less than REPLICA_PIN_SECONDS.
+"""
+import contextvars
+import random
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_MODELS = {'store.book', 'store.category', 'store.review'}
+CACHE_PREFIX = 'replicas:pin'
+
+replica_reads = contextvars.ContextVar('replica_reads', default=None)
+
+
+def get_cache():
+    return caches[getattr(settings, 'REPLICA_PIN_CACHE_ALIAS', 'default')]
+
+
+def pin_key(user_id):
+    return f'{CACHE_PREFIX}:{user_id}'
+
+
+def get_replicas():
+    return list(getattr(settings, 'REPLICA_DATABASES', ()))
+
+
+def pin(user_id):
+    timeout = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+    if timeout:
+        get_cache().set(pin_key(user_id), True, timeout=timeout)
+
+
+def is_pinned(user_id):
+    return bool(get_cache().get(pin_key(user_id)))
+
+
+class ReplicaReads:
+    """
+    Routing state of one safe-method request. The replica is picked once,
+    so all of a request's reads see the same snapshot; the pin is checked
+    on the first catalog read, after DRF has authenticated the user.
+    """
+    def __init__(self, request, replicas):
+        self.request = request
+        self.alias = random.choice(replicas)
+        self.checked = {}
+        self.used = False
+
+    def database(self):
+        user = getattr(self.request, 'user', None)
+        user_id = user.pk if user is not None and user.is_authenticated else None
+        if user_id is not None and user_id not in self.checked:
+            self.checked[user_id] = is_pinned(user_id)
+        if user_id is not None and self.checked[user_id]:
+            return DEFAULT_DB_ALIAS
+        self.used = True
+        return self.alias
+
+
+def read_from_replica():
+    """
+    Whether the current request has read anything from a replica so far.
+    """
+    reads = replica_reads.get()
+    return reads is not None and reads.used
+
+
+class ReplicaRouter:
+    """
+    Catalog reads go to a replica when the current request allows it;
+    everything else goes to the primary. Replicas are never migrated.
+    """
+    def db_for_read(self, model, **hints):
+        reads = replica_reads.get()
+        if reads is not None and model._meta.label_lower in REPLICA_MODELS:
+            return reads.database()
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Not the instance's database: objects read from a replica save to the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the primary's data, so rows can relate across them
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in get_replicas() else None
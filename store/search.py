@@ -0,0 +1,172 @@
+import re
+from django.conf import settings
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+ISBN_RE = re.compile(r'\d{9}[\dX]|\d{13}')
+
+
+def normalize_isbn(query):
+    """
+    Return `query` as a bare ISBN-10/13 if it looks like one, else None.
+    """
+    candidate = re.sub(r'[\s-]', '', query).upper()
+    return candidate if ISBN_RE.fullmatch(candidate) else None
+
+
+class BookSearchBackend:
+    """
+    Full-text search over Book.title and Book.author.
+
+    `search()` returns the queryset filtered to matching books and annotated
+    with a `relevance` score (higher is better). `install()`/`uninstall()`
+    create and drop the database objects backing the index and are run from
+    the store migrations.
+    """
+    def install(self, schema_editor, table):
+        pass
+
+    def uninstall(self, schema_editor, table):
+        pass
+
+    def repair(self, schema_editor, table):
+        pass
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+
+class PostgresSearchBackend(BookSearchBackend):
+    """
+    Stored generated tsvector column (title weighted above author) with a
+    GIN index, ranked with ts_rank_cd.
+    """
+    config = 'english'
+
+    def install(self, schema_editor, table):
+        schema_editor.execute(
+            f"ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            f"setweight(to_tsvector('{self.config}', coalesce(title, '')), 'A') || "
+            f"setweight(to_tsvector('{self.config}', coalesce(author, '')), 'B')) STORED"
+        )
+        schema_editor.execute(f"CREATE INDEX {table}_search_vector_idx ON {table} USING gin (search_vector)")
+
+    def uninstall(self, schema_editor, table):
+        schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_vector_idx")
+        schema_editor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector")
+
+    def search(self, queryset, query):
+        table = queryset.model._meta.db_table
+        tsquery = f"websearch_to_tsquery('{self.config}', %s)"
+        return queryset.annotate(
+            search_match=RawSQL(f'"{table}"."search_vector" @@ {tsquery}', [query], output_field=BooleanField()),
+            relevance=RawSQL(f'ts_rank_cd("{table}"."search_vector", {tsquery})', [query], output_field=FloatField()),
+        ).filter(search_match=True)
+
+
+class SQLiteSearchBackend(BookSearchBackend):
+    """
+    External-content FTS5 table kept in sync by triggers, ranked with bm25.
+    Lets local SQLite runs behave like Postgres.
+    """
+    title_weight = 10.0
+    author_weight = 5.0
+
+    def install(self, schema_editor, table):
+        fts = f'{table}_fts'
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"title, author, content='{table}', content_rowid='id', tokenize='porter unicode61')"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, title, author) VALUES (new.id, new.title, new.author); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, title, author) VALUES ('delete', old.id, old.title, old.author); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF title, author ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, title, author) VALUES ('delete', old.id, old.title, old.author); "
+            f"INSERT INTO {fts}(rowid, title, author) VALUES (new.id, new.title, new.author); END"
+        )
+        schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+    def uninstall(self, schema_editor, table):
+        fts = f'{table}_fts'
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {fts}")
+
+    def repair(self, schema_editor, table):
+        # Django rebuilds SQLite tables for most ALTERs, which drops triggers
+        fts = f'{table}_fts'
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE name IN (%s, %s)", [fts, f'{fts}_au']
+            )
+            found = {name for name, in cursor.fetchall()}
+        if fts in found and len(found) == 1:
+            self.install(schema_editor, table)
+
+    def search(self, queryset, query):
+        # Quote every token so user input can't be read as FTS5 syntax
+        tokens = re.findall(r'\w+', query)
+        if not tokens:
+            return queryset.none()
+        match = ' '.join(f'"{token}"' for token in tokens)
+        table = queryset.model._meta.db_table
+        fts = f'{table}_fts'
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", [match])
+        ).annotate(relevance=RawSQL(
+            f'SELECT -bm25({fts}, {self.title_weight}, {self.author_weight}) FROM {fts} '
+            f'WHERE {fts} MATCH %s AND rowid = "{table}"."id"',
+            [match], output_field=FloatField(),
+        ))
+
+
+class ContainsSearchBackend(BookSearchBackend):
+    """
+    Unindexed icontains fallback for databases without a native backend.
+    """
+    def search(self, queryset, query):
+        condition = Q()
+        for token in query.split():
+            condition &= Q(title__icontains=token) | Q(author__icontains=token)
+        return queryset.filter(condition).annotate(relevance=Value(1.0, output_field=FloatField()))
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_native_backend(connection):
+    return BACKENDS.get(connection.vendor, ContainsSearchBackend)()
+
+
+def get_search_backend(using='default'):
+    """
+    The backend named by settings.BOOK_SEARCH_BACKEND, otherwise the native
+    backend for the database vendor behind `using`.
+    """
+    path = getattr(settings, 'BOOK_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return get_native_backend(connections[using])
+
+
+def search_books(queryset, query):
+    """
+    Filter `queryset` to books matching `query`, annotated with `relevance`.
+    ISBN-shaped queries take the unique-index lookup instead of the text index.
+    """
+    isbn = normalize_isbn(query)
+    if isbn:
+        return queryset.filter(ISBN=isbn).annotate(relevance=Value(1.0, output_field=FloatField()))
+    return get_search_backend(queryset.db).search(queryset, query)
@@ -1,25 +1,57 @@
+from datetime import timedelta
 from rest_framework import serializers
-from django.db.models import Avg
+from rest_framework.settings import api_settings
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Category, Book, Review, Order, OrderItem, Profile
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+from .models import Category, Book, Review, Order, OrderItem, Profile, PurchasedBook, StockReservation
+from .reservations import StockError, adjust_stock, claim, release_expired, reserve
+from .signals import order_placed
+from .fieldsets import SparseFieldsMixin
+from .filters import OrderFilter
 
-class CategorySerializer(serializers.ModelSerializer):
+def parse_items(items_data, subject):
+    """
+    `{book_id: quantity}` from `[{"book": id, "quantity": n}, ...]`, with
+    repeated lines merged so each book is updated once.
+    """
+    if not items_data:
+        raise serializers.ValidationError(f"{subject} must have at least one item.")
+    quantities = {}
+    for item in items_data:
+        try:
+            book_id, quantity = int(item['book']), int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise serializers.ValidationError("Each item must have an integer 'book' and 'quantity'.")
+        if quantity < 1:
+            raise serializers.ValidationError("Quantity must be at least 1.")
+        quantities[book_id] = quantities.get(book_id, 0) + quantity
+    return quantities
+
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
 
-class BookSerializer(serializers.ModelSerializer):
-    average_rating = serializers.SerializerMethodField()
+class BookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Stored on Book and maintained by store.signals; rendered as a number
+    average_rating = serializers.FloatField(read_only=True)
 
     class Meta:
         model = Book
         fields = '__all__'
 
-    def get_average_rating(self, obj):
-        avg = obj.reviews.aggregate(avg=Avg('rating'))['avg']
-        return round(avg, 2) if avg is not None else None
+class PurchasedBookSerializer(serializers.ModelSerializer):
+    book = BookSerializer(read_only=True)
+
+    class Meta:
+        model = PurchasedBook
+        fields = ['id', 'book', 'purchased_at']
+        read_only_fields = fields
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
@@ -32,7 +64,7 @@ class ReviewSerializer(serializers.ModelSerializer):
         book = data.get('book')
         if self.instance is None and user and book:
             # Only on create, not update
-            if Review.objects.filter(user=user, book=book).exists():
+            if Review.objects.filter(user_id=user.pk, book=book).exists():
                 raise serializers.ValidationError("You have already reviewed this book. Please update your review instead.")
         return data
 
@@ -53,7 +85,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['id', 'book', 'quantity', 'price_at_purchase']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
 
     class Meta:
@@ -66,70 +98,231 @@ class OrderSerializer(serializers.ModelSerializer):
         if self.instance is not None:
             return data
         request = self.context.get('request')
-        items_data = request.data.get('items') if request else None
-        if not items_data:
-            raise serializers.ValidationError("Order must have at least one item.")
-        for item in items_data:
-            try:
-                book = Book.objects.get(pk=item['book'])
-            except Book.DoesNotExist:
-                raise serializers.ValidationError(f"Book with id {item['book']} does not exist.")
-            if book.stock < int(item['quantity']):
-                raise serializers.ValidationError(
-                    f"Not enough stock for '{book.title}'. Available: {book.stock}, requested: {item['quantity']}"
-                )
+        data['quantities'] = parse_items(request.data.get('items') if request else None, "Order")
         return data
-    
+
     def create(self, validated_data):
         request = self.context.get('request')
-        user = request.user
-        items_data = request.data.get('items')
-        total_price = 0
-        order = Order.objects.create(user=user, total_price=0)  # temp price
-
-        for item in items_data:
-            book = Book.objects.get(pk=item['book'])
-            quantity = int(item['quantity'])
-            price = book.price * quantity
-            total_price += price
-            OrderItem.objects.create(
-                order=order,
-                book=book,
-                quantity=quantity,
-                price_at_purchase=book.price
-            )
-        order.total_price = total_price
-        order.save(update_fields=['total_price'])
+        quantities = validated_data.pop('quantities')
+        for attempt in range(2):
+            try:
+                order = self.place(request.user.pk, quantities)
+                break
+            except StockError as exc:
+                # Holds that expired but weren't released yet still take stock
+                if attempt or not release_expired(book_ids=list(quantities)):
+                    raise self.order_error(str(exc))
+        # Render the response from one query instead of one per item
+        prefetch_related_objects([order], Prefetch('items', queryset=OrderItem.objects.select_related('book')))
         return order
 
+    def place(self, user_id, quantities):
+        """
+        Write the order in one transaction, or raise StockError (rolled
+        back) if a book is short.
+        """
+        with transaction.atomic():
+            # The user's holds on these books cover part of the order; only
+            # the rest is taken from stock (and surplus holds go back to it)
+            reserved, reservation_ids = claim(user_id, list(quantities))
+            deltas = {book_id: quantity - reserved.get(book_id, 0) for book_id, quantity in quantities.items()}
+            # No book row locks here: the conditional decrement below is what
+            # prevents overselling, so checkouts of a hot title don't queue
+            books = Book.objects.in_bulk(list(quantities))
+            for book_id, quantity in quantities.items():
+                book = books.get(book_id)
+                if book is None:
+                    raise self.order_error(f"Book with id {book_id} does not exist.")
+                if book.stock < deltas[book_id]:
+                    raise StockError(
+                        f"Not enough stock for '{book.title}'. Available: {book.stock + reserved.get(book_id, 0)}, "
+                        f"requested: {quantity}"
+                    )
+
+            total_price = sum(books[book_id].price * quantity for book_id, quantity in quantities.items())
+            # Inserted without post_save, like the items: order_placed below
+            # records the order and its items in the sales rollups together
+            order, = Order.objects.bulk_create([Order(user_id=user_id, total_price=total_price)])
+            items = OrderItem.objects.bulk_create([
+                OrderItem(order=order, book=books[book_id], quantity=quantity, price_at_purchase=books[book_id].price)
+                for book_id, quantity in quantities.items()
+            ])
+            if not adjust_stock(deltas):
+                raise StockError("Stock changed while placing the order. Please try again.")
+            if reservation_ids:
+                StockReservation.objects.filter(pk__in=reservation_ids).delete()
+
+            order_placed.send(sender=Order, order=order, items=items)
+        return order
+
+    def order_error(self, message):
+        return serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]})
+
+class OrderSummarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Annotated by OrderViewSet.get_queryset
+    item_count = serializers.IntegerField(read_only=True)
+    total_quantity = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'user', 'item_count', 'total_quantity', 'total_price', 'status', 'order_date']
+        read_only_fields = fields
+
+class StockReservationSerializer(serializers.ModelSerializer):
+    book = OrderItemBookSerializer(read_only=True)
+
+    class Meta:
+        model = StockReservation
+        fields = ['id', 'book', 'quantity', 'expires_at', 'created_at']
+        read_only_fields = fields
+
+class ReserveSerializer(serializers.Serializer):
+    """
+    `{"items": [{"book": id, "quantity": n}, ...], "ttl": seconds}`; holds
+    are all or nothing.
+    """
+    items = serializers.ListField(child=serializers.DictField())
+    ttl = serializers.IntegerField(min_value=30, required=False)
+
+    def validate_items(self, value):
+        return parse_items(value, "Reservation")
+
+    def validate_ttl(self, value):
+        limit = getattr(settings, 'STOCK_RESERVATION_MAX_TTL', 1800)
+        if value > limit:
+            raise serializers.ValidationError(f"Ensure this value is less than or equal to {limit}.")
+        return value
+
+    def create(self, validated_data):
+        request = self.context['request']
+        try:
+            return reserve(request.user.pk, validated_data['items'], validated_data.get('ttl'))
+        except StockError as exc:
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [str(exc)]})
+
 class ProfileSerializer(serializers.ModelSerializer):
     username = serializers.CharField(write_only=True)
     password = serializers.CharField(write_only=True)
     email = serializers.EmailField(write_only=True, required=False, allow_blank=True)
 
+    conflict_messages = {
+        'username': "A user with that username already exists.",
+        'phone': "A profile with that phone number already exists.",
+        'address': "A profile with that address already exists.",
+    }
+
     class Meta:
         model = Profile
         fields = ['username', 'password', 'email', 'address', 'phone']
+        # The validate_* methods below report conflicts with our own messages
+        extra_kwargs = {'address': {'validators': []}, 'phone': {'validators': []}}
 
     def validate_username(self, value):
         if User.objects.filter(username=value).exists():
-            raise serializers.ValidationError("A user with that username already exists.")
+            raise serializers.ValidationError(self.conflict_messages['username'])
         return value
 
     def validate_phone(self, value):
         if Profile.objects.filter(phone=value).exists():
-            raise serializers.ValidationError("A profile with that phone number already exists.")
+            raise serializers.ValidationError(self.conflict_messages['phone'])
         return value
 
     def validate_address(self, value):
         if Profile.objects.filter(address=value).exists():
-            raise serializers.ValidationError("A profile with that address already exists.")
+            raise serializers.ValidationError(self.conflict_messages['address'])
         return value
 
     def create(self, validated_data):
         username = validated_data.pop('username')
         password = validated_data.pop('password')
         email = validated_data.pop('email', '')
-        user = User.objects.create_user(username=username, email=email, password=password)
-        profile = Profile.objects.create(user=user, **validated_data)
-        return profile
+        user = User(username=User.normalize_username(username), email=User.objects.normalize_email(email))
+        # Hash before opening the transaction; it is the slow part
+        user.set_password(password)
+        try:
+            with transaction.atomic():
+                user.save()
+                return Profile.objects.create(user=user, **validated_data)
+        except IntegrityError:
+            # A concurrent signup took a value after validation ran
+            raise serializers.ValidationError(self.find_conflicts(username=username, **validated_data))
+
+    @classmethod
+    def find_conflicts(cls, username, phone, address):
+        lookups = {
+            'username': User.objects.filter(username=username),
+            'phone': Profile.objects.filter(phone=phone),
+            'address': Profile.objects.filter(address=address),
+        }
+        conflicts = {field: [cls.conflict_messages[field]] for field, queryset in lookups.items() if queryset.exists()}
+        return conflicts or {api_settings.NON_FIELD_ERRORS_KEY: ["Registration conflicted with another request."]}
+
+class BulkStatusSerializer(serializers.Serializer):
+    """
+    Orders to move to `status`: either `ids`, or `filter`, the order list
+    filters (e.g. {"status": "pending", "order_date__lte": "..."}). A
+    filter must narrow the orders down: unknown keys are rejected rather
+    than ignored, and it may match at most `max_orders` orders.
+    """
+    max_orders = 10000
+
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False,
+                                max_length=max_orders)
+    filter = serializers.DictField(required=False, allow_empty=False)
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+
+    def validate_filter(self, value):
+        unknown = sorted(set(value) - set(OrderFilter.base_filters))
+        if unknown:
+            raise serializers.ValidationError(f"Unknown filter(s): {', '.join(unknown)}.")
+        # django-filter skips empty values, which would match every order
+        if all(value[key] in (None, '', []) for key in value):
+            raise serializers.ValidationError("Give at least one filter value.")
+        return value
+
+    def validate(self, data):
+        if ('ids' in data) == ('filter' in data):
+            raise serializers.ValidationError("Give either ids or filter.")
+        return data
+
+class SalesQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the analytics endpoints. The window defaults to
+    the last 30 days, today included.
+    """
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    interval = serializers.ChoiceField(choices=['day', 'week', 'month'], default='day')
+    status = serializers.MultipleChoiceField(choices=Order.STATUS_CHOICES, required=False)
+    category = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    rank_by = serializers.ChoiceField(choices=['units', 'revenue', 'orders'], default='units')
+
+    max_days = 3660
+
+    def validate(self, data):
+        data.setdefault('end', timezone.localdate())
+        data.setdefault('start', data['end'] - timedelta(days=29))
+        if data['start'] > data['end']:
+            raise serializers.ValidationError({'start': "Must not be after end."})
+        if (data['end'] - data['start']).days >= self.max_days:
+            raise serializers.ValidationError({'start': f"The window is limited to {self.max_days} days."})
+        return data
+
+class SalesPeriodSerializer(serializers.Serializer):
+    period = serializers.DateField()
+    orders = serializers.IntegerField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+class CategorySalesSerializer(SalesPeriodSerializer):
+    category_id = serializers.IntegerField()
+    category_name = serializers.CharField()
+
+class BestsellerSerializer(serializers.Serializer):
+    book_id = serializers.IntegerField()
+    title = serializers.CharField()
+    author = serializers.CharField()
+    orders = serializers.IntegerField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
@@ -1,12 +1,149 @@
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
-from django.db.models import Avg
-from .models import Order, OrderItem, Review, Book
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver, Signal
+from django.db.models import Avg, Exists, OuterRef, Subquery
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from .models import Order, OrderItem, PurchasedBook, Review, Book, Category, StockReservation
+from .search import get_native_backend
+from . import analytics
+from .authentication import forget_user
+from .reservations import release
+from .cache import bump_namespaces
+from .jobs import enqueue
+
+# Sent by OrderSerializer.create inside the placement transaction, after the
+# order and its items (both bulk inserted, so no post_save) and the stock
+# decrement are written. Arguments: order, items.
+order_placed = Signal()
+
+@receiver(pre_save, sender=Review)
+def remember_previous_review_book(sender, instance, raw=False, **kwargs):
+    # A review moved to another book must refresh the old book's aggregates too
+    instance._previous_book_id = None
+    if instance.pk and not raw:
+        instance._previous_book_id = (
+            Review.objects.filter(pk=instance.pk).values_list('book_id', flat=True).first()
+        )
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def refresh_book_rating(sender, instance, **kwargs):
+    book_ids = {instance.book_id, getattr(instance, '_previous_book_id', None)} - {None}
+    Book.objects.filter(pk__in=book_ids).refresh_rating_aggregates()
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_cache(sender, **kwargs):
+    bump_namespaces('books')
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, **kwargs):
+    bump_namespaces('categories')
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_cache(sender, **kwargs):
+    # Reviews change the rating columns and the reviews embedded in book detail
+    bump_namespaces('reviews', 'books')
+
+@receiver(order_placed)
+def invalidate_stock_cache(sender, **kwargs):
+    bump_namespaces('books')
+
+@receiver(order_placed)
+def record_purchases(sender, order, items, **kwargs):
+    PurchasedBook.objects.bulk_create(
+        [PurchasedBook(user_id=order.user_id, book_id=item.book_id, purchased_at=order.order_date) for item in items],
+        ignore_conflicts=True,
+    )
 
 @receiver(post_save, sender=OrderItem)
-def reduce_stock_on_order_item(sender, instance, created, **kwargs):
+def record_purchase(sender, instance, created, raw=False, **kwargs):
+    # Items saved one at a time (admin, fixtures); placement goes through order_placed
+    if created and not raw:
+        record_purchases(sender, order=instance.order, items=[instance])
+
+@receiver(post_delete, sender=OrderItem)
+def forget_purchase(sender, instance, **kwargs):
+    # Drop the index entry once no remaining order contains the book
+    owner = Order.objects.filter(pk=instance.order_id).values('user_id')
+    PurchasedBook.objects.filter(user_id=Subquery(owner), book_id=instance.book_id).exclude(
+        Exists(OrderItem.objects.filter(order__user_id=OuterRef('user_id'), book_id=OuterRef('book_id')))
+    ).delete()
+
+# Sales rollups (store.analytics): placed orders are recorded by a job queued
+# from order_placed, orders and items saved one at a time (admin, shell) here,
+# and status changes move the order's totals between statuses
+@receiver(post_save, sender=Order)
+def record_order_sales(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
     if created:
-        book = instance.book
-        book.stock = max(0, book.stock - instance.quantity)
-        book.save(update_fields=['stock'])
+        analytics.record_order(instance)
+    elif instance._previous_status not in (None, instance.status):
+        analytics.move_status([instance.pk], instance._previous_status, instance.status)
+
+@receiver(pre_save, sender=Order)
+def remember_previous_order_status(sender, instance, raw=False, **kwargs):
+    instance._previous_status = None
+    if instance.pk and not raw:
+        instance._previous_status = Order.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+@receiver(post_delete, sender=Order)
+def forget_order_sales(sender, instance, **kwargs):
+    job = analytics.placement_job(instance.pk)
+    if job is not None:
+        # Never recorded: dropping its job is all there is to undo
+        job.delete()
+    else:
+        analytics.record_order(instance, sign=-1)
+
+@receiver(order_placed)
+def record_placed_sales(sender, order, items, **kwargs):
+    # Not needed for the response: queued in the order's transaction
+    enqueue('sales.record_placed', analytics.placed_order_payload(order, items))
+
+@receiver(pre_save, sender=OrderItem)
+def remember_previous_item(sender, instance, raw=False, **kwargs):
+    instance._previous_item = None
+    if instance.pk and not raw:
+        instance._previous_item = OrderItem.objects.select_related('book').filter(pk=instance.pk).first()
+
+@receiver(post_save, sender=OrderItem)
+def record_single_item_sales(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if instance._previous_item is not None:
+        analytics.record_items(instance.order, [instance._previous_item], sign=-1)
+    analytics.record_items(instance.order, [instance])
+
+@receiver(post_delete, sender=OrderItem)
+def forget_item_sales(sender, instance, **kwargs):
+    order = Order.objects.filter(pk=instance.order_id).first()
+    if order is None:
+        return
+    job = analytics.placement_job(order.pk)
+    if job is not None:
+        job.payload['items'] = [item for item in job.payload['items'] if item[0] != instance.book_id]
+        job.save(update_fields=['payload'])
+    else:
+        analytics.record_items(order, [instance], sign=-1)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def revoke_cached_user(sender, instance, **kwargs):
+    # After commit, so a concurrent request can't cache the old row again
+    user_id = instance.pk
+    transaction.on_commit(lambda: forget_user(user_id))
+
+@receiver(pre_delete, sender=User)
+def release_user_reservations(sender, instance, **kwargs):
+    # Held units would otherwise vanish with the cascade
+    release(StockReservation.objects.filter(user_id=instance.pk))
 
+def repair_search_index(sender, using, **kwargs):
+    # Connected to post_migrate in StoreConfig.ready
+    connection = connections[using]
+    with connection.schema_editor() as schema_editor:
+        get_native_backend(connection).repair(schema_editor, Book._meta.db_table)
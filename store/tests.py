@@ -1,14 +1,45 @@
+import importlib
+import json
+from io import StringIO
 import pytest
-from django.urls import reverse
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.urls import clear_url_caches, resolve, reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth.models import User
-from .models import Book, Category, Order, OrderItem, Review
+from django.core.management import CommandError, call_command
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+from django.test import AsyncClient
+from django.db.utils import load_backend
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework_simplejwt.tokens import RefreshToken
+from .models import (
+    Book, Category, DailyBookSales, DailySales, Job, Order, OrderItem, Profile, PurchasedBook, Review, StockReservation,
+)
+from .authentication import ClaimsRefreshToken
+from .benchmarks import benchmark_connections
+from .feeds import aiter_lines
+from .jobs import TASKS, enqueue, run_pending, task
+from .routers import is_pinned
+from .metrics import registry, render_metrics
+from .serializers import BulkStatusSerializer, ProfileSerializer
+from . import urls as store_urls
+from bookstore import urls as project_urls
 
 @pytest.fixture
 def api_client():
     return APIClient()
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Cached responses and namespace versions must not leak between tests
+    cache.clear()
+
 @pytest.fixture
 def user(db):
     return User.objects.create_user(username='testuser', password='testpass')
@@ -63,7 +94,7 @@ def test_book_listing_pagination_and_filtering(api_client, book, category):
 
 @pytest.mark.django_db
 def test_order_creation_reduces_stock(api_client, user, book):
-    # This test expects stock to reduce after order creation due to OrderItem signal
+    # This test expects stock to reduce after order creation via the placement transaction
     api_client.force_authenticate(user=user)
     url = reverse('order-list')
     data = {
@@ -105,3 +136,1040 @@ def test_jwt_authentication(api_client, user):
     protected_url = reverse('order-list')
     response2 = api_client.get(protected_url)
     assert response2.status_code in [200, 403, 404]  # 200 if user has orders, 403/404 if not
+
+@pytest.mark.django_db
+def test_book_rating_aggregates_follow_review_changes(user, book, category):
+    other_book = Book.objects.create(
+        title='Book 2', author='Author 2', ISBN='1234567890124', price=20.00,
+        stock=3, published_date='2023-01-02', category=category
+    )
+    other_user = User.objects.create_user(username='other', password='otherpass')
+    review = Review.objects.create(user=user, book=book, rating=5, comment='Great')
+    Review.objects.create(user=other_user, book=book, rating=2, comment='Meh')
+    book.refresh_from_db()
+    assert book.review_count == 2
+    assert float(book.average_rating) == 3.5
+
+    review.rating = 4
+    review.save()
+    book.refresh_from_db()
+    assert float(book.average_rating) == 3.0
+
+    review.book = other_book
+    review.save()
+    book.refresh_from_db()
+    other_book.refresh_from_db()
+    assert (book.review_count, float(book.average_rating)) == (1, 2.0)
+    assert (other_book.review_count, float(other_book.average_rating)) == (1, 4.0)
+
+    review.delete()
+    other_book.refresh_from_db()
+    assert other_book.review_count == 0
+    assert other_book.average_rating is None
+
+@pytest.mark.django_db
+def test_book_list_rating_does_not_query_per_row(api_client, user, category, django_assert_max_num_queries):
+    for i in range(5):
+        b = Book.objects.create(
+            title=f'Book {i}', author='Author', ISBN=f'99900000000{i:02d}', price=10 + i,
+            stock=1, published_date='2023-01-01', category=category
+        )
+        Review.objects.create(user=user, book=b, rating=i % 5 + 1, comment='ok')
+    Book.objects.create(
+        title='Unrated', author='Author', ISBN='9990000000099', price=10, stock=1, published_date='2023-01-01', category=category
+    )
+    Book.objects.update(average_rating=None, review_count=0)
+    call_command('rebuild_book_ratings')
+    # Validators (count/max updated_at), page count, page
+    with django_assert_max_num_queries(3):
+        response = api_client.get(reverse('book-list'), {'ordering': '-average_rating'})
+    assert response.status_code == 200
+    ratings = [b['average_rating'] for b in response.data['results']]
+    # Unrated books last in either direction, on every database
+    assert ratings == [5.0, 4.0, 3.0, 2.0, 1.0, None]
+    response = api_client.get(reverse('book-list'), {'ordering': 'average_rating'})
+    assert [b['average_rating'] for b in response.data['results']] == [1.0, 2.0, 3.0, 4.0, 5.0, None]
+    response = api_client.get(reverse('book-list'), {'average_rating__gte': 4})
+    assert response.data['count'] == 2
+
+@pytest.mark.django_db
+def test_book_detail_embeds_latest_reviews_with_cursor(api_client, user, book, django_assert_num_queries):
+    reviews = [
+        Review.objects.create(user=user, book=book, rating=i % 5 + 1, comment=f'Review {i}')
+        for i in range(7)
+    ]
+    newest_first = [r.id for r in reversed(reviews)]
+    # Validator (updated_at), book, reviews
+    with django_assert_num_queries(3):
+        response = api_client.get(reverse('book-detail', args=[book.id]))
+    assert response.status_code == 200
+    assert [r['id'] for r in response.data['reviews']] == newest_first[:5]
+    assert response.data['reviews_next']
+
+    response = api_client.get(response.data['reviews_next'])
+    assert response.status_code == 200
+    assert [r['id'] for r in response.data['results']] == newest_first[5:]
+    assert response.data['next'] is None
+    response = api_client.get(response.data['previous'])
+    assert [r['id'] for r in response.data['results']] == newest_first[:5]
+    assert response.data['previous'] is None
+    assert api_client.get(reverse('book-review-list', args=[book.id]), {'cursor': 'bogus'}).status_code == 404
+
+@pytest.mark.django_db
+def test_order_placement_is_batched_and_all_or_nothing(api_client, user, book, category, django_assert_max_num_queries):
+    books = [book] + [
+        Book.objects.create(
+            title=f'Book {i}', author='Author', ISBN=f'99900000001{i:02d}', price=5,
+            stock=2, published_date='2023-01-01', category=category
+        )
+        for i in range(5)
+    ]
+    api_client.force_authenticate(user=user)
+    url = reverse('order-list')
+    items = [{'book': b.id, 'quantity': 1} for b in books] + [{'book': book.id, 'quantity': 1}]
+    # Two of these update the sales rollups, one looks for stock reservations
+    with django_assert_max_num_queries(11):
+        response = api_client.post(url, {'items': items}, format='json')
+    assert response.status_code == 201
+    order = Order.objects.get(pk=response.data['id'])
+    assert order.items.count() == len(books)
+    assert order.total_price == 10 * 2 + 5 * 5
+    book.refresh_from_db()
+    assert book.stock == 3
+
+    # One short line rejects the whole order and leaves stock untouched
+    items = [{'book': books[1].id, 'quantity': 1}, {'book': book.id, 'quantity': 4}]
+    response = api_client.post(url, {'items': items}, format='json')
+    assert response.status_code == 400
+    assert 'Not enough stock' in response.data['non_field_errors'][0]
+    assert Order.objects.count() == 1
+    assert Book.objects.get(pk=books[1].id).stock == 1
+
+@pytest.mark.django_db
+def test_book_full_text_search_with_relevance_and_isbn(api_client, book, category):
+    Book.objects.create(
+        title='Wizards of the Coast', author='Jane Doe', ISBN='9780000000001', price=12,
+        stock=1, published_date='2020-01-01', category=category
+    )
+    Book.objects.create(
+        title='Cooking Basics', author='Wizard Smith', ISBN='9780000000002', price=8,
+        stock=1, published_date='2021-01-01', category=category
+    )
+    url = reverse('book-list')
+    response = api_client.get(url, {'q': 'wizard', 'ordering': 'relevance'})
+    assert response.status_code == 200
+    # Title matches outrank author matches; "wizard" also matches "Wizards"
+    assert [b['title'] for b in response.data['results']] == ['Wizards of the Coast', 'Cooking Basics']
+    response = api_client.get(url, {'q': 'jane wizards'})
+    assert [b['title'] for b in response.data['results']] == ['Wizards of the Coast']
+    response = api_client.get(url, {'q': '978-0000000-002'})
+    assert [b['title'] for b in response.data['results']] == ['Cooking Basics']
+    response = api_client.get(url, {'q': 'nothing-matches-this'})
+    assert response.data['count'] == 0
+
+@pytest.mark.django_db
+def test_cursor_pagination_walks_ordering_with_ties(api_client, category, django_assert_num_queries):
+    for i in range(25):
+        Book.objects.create(
+            title=f'Book {i}', author='Author', ISBN=f'97811111111{i:02d}', price=10 + i % 3,
+            stock=1, published_date='2023-01-01', category=category
+        )
+    url = reverse('book-list')
+    expected = list(Book.objects.order_by('-price', '-id').values_list('id', flat=True))
+    seen = []
+    # The conditional GET validators, then the page itself: no count
+    with django_assert_num_queries(2):
+        response = api_client.get(url, {'ordering': '-price', 'pagination': 'cursor'})
+    assert 'count' not in response.data
+    while True:
+        seen += [b['id'] for b in response.data['results']]
+        if not response.data['next']:
+            break
+        response = api_client.get(response.data['next'])
+    assert seen == expected
+
+    # Walking back from the last page returns the previous page intact
+    response = api_client.get(response.data['previous'])
+    assert [b['id'] for b in response.data['results']] == expected[10:20]
+
+    # Page numbers remain the default, and planner estimates are opt-in
+    assert api_client.get(url, {'page': 2}).data['count'] == 25
+    response = api_client.get(url, {'pagination': 'cursor', 'count': 'estimate'})
+    assert 'estimated_count' in response.data
+
+@pytest.mark.django_db
+def test_cursor_pagination_orders_nulls_last(api_client, user, category):
+    books = [
+        Book.objects.create(
+            title=f'Book {i}', author='Author', ISBN=f'97822222222{i:02d}', price=10,
+            stock=1, published_date='2023-01-01', category=category
+        )
+        for i in range(15)
+    ]
+    for i, b in enumerate(books[:8]):
+        Review.objects.create(user=user, book=b, rating=i % 5 + 1, comment='ok')
+    response = api_client.get(reverse('book-list'), {'ordering': '-average_rating', 'pagination': 'cursor'})
+    seen = []
+    while True:
+        seen += [(b['average_rating'], b['id']) for b in response.data['results']]
+        if not response.data['next']:
+            break
+        response = api_client.get(response.data['next'])
+    rated = sorted([s for s in seen if s[0] is not None], key=lambda s: (-s[0], -s[1]))
+    assert seen == rated + sorted((s for s in seen if s[0] is None), reverse=True)
+    assert len(seen) == 15
+    back = []
+    while response.data['previous']:
+        response = api_client.get(response.data['previous'])
+        back = [(b['average_rating'], b['id']) for b in response.data['results']] + back
+    assert back == seen[:10]
+
+@pytest.mark.django_db
+def test_catalog_responses_are_cached_until_a_write(
+    api_client, staff_user, book, category, django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    url = reverse('book-list')
+    response = api_client.get(url, {'ordering': 'price', 'page': 1})
+    assert response['X-Cache'] == 'MISS'
+    with django_assert_num_queries(0):
+        response = api_client.get(url, {'page': 1, 'ordering': 'price'})
+    assert response['X-Cache'] == 'HIT'
+    assert response.data['results'][0]['stock'] == 5
+    assert api_client.get(reverse('category-list'))['X-Cache'] == 'MISS'
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Book.objects.filter(pk=book.pk).update(stock=4)
+        book.refresh_from_db()
+        book.save()
+    response = api_client.get(url, {'ordering': 'price', 'page': 1})
+    assert response['X-Cache'] == 'MISS'
+    assert response.data['results'][0]['stock'] == 4
+    # Only the books namespace was bumped
+    assert api_client.get(reverse('category-list'))['X-Cache'] == 'HIT'
+
+    api_client.force_authenticate(user=staff_user)
+    stats = api_client.get(reverse('cache-stats')).data
+    assert stats['books'] == {'hit': 1, 'miss': 2}
+
+@pytest.mark.django_db
+def test_order_list_is_prefetched_and_has_summary_view(api_client, user, staff_user, category, django_assert_num_queries):
+    books = [
+        Book.objects.create(
+            title=f'Book {i}', author='Author', ISBN=f'97833333333{i:02d}', price=5,
+            stock=100, published_date='2023-01-01', category=category
+        )
+        for i in range(3)
+    ]
+    for _ in range(10):
+        order = Order.objects.create(user=user, total_price=30)
+        for b in books:
+            OrderItem.objects.create(order=order, book=b, quantity=2, price_at_purchase=5)
+    api_client.force_authenticate(user=staff_user)
+    url = reverse('order-list')
+    with django_assert_num_queries(3):
+        response = api_client.get(url)
+    assert response.status_code == 200
+    assert len(response.data['results']) == 10
+    assert response.data['results'][0]['items'][0]['book']['title'].startswith('Book')
+
+    with django_assert_num_queries(2):
+        response = api_client.get(url, {'representation': 'summary'})
+    summary = response.data['results'][0]
+    assert 'items' not in summary
+    assert (summary['item_count'], summary['total_quantity'], summary['status']) == (3, 6, 'pending')
+
+@pytest.mark.django_db
+def test_seed_catalog_and_benchmark_report(tmp_path):
+    call_command(
+        'seed_catalog', categories=2, books=30, users=5, orders=40, reviews=20, batch_size=16, stdout=StringIO()
+    )
+    assert Book.objects.count() == 30
+    assert Order.objects.count() == 40
+    assert Review.objects.filter(book__review_count__gt=0).exists()
+    # The analytics benchmarks read the rollups, which bulk inserts skip
+    assert DailySales.objects.aggregate(orders=Sum('orders'))['orders'] == 40
+    assert DailyBookSales.objects.exists()
+
+    output = tmp_path / 'report.json'
+    budgets = tmp_path / 'budgets.json'
+    budgets.write_text(json.dumps({'book-list': {'queries': 100}}))
+    call_command('benchmark_api', iterations=2, warmup=0, output=str(output), budgets=str(budgets), stderr=StringIO())
+    report = json.loads(output.read_text())
+    assert report['meta']['uncovered_routes'] == []
+    assert report['results']['book-list']['status'] == [200]
+    assert report['results']['order-create']['status'] == [201]
+    assert report['results']['book-detail']['samples'] == 2
+    # Write scenarios are rolled back
+    assert Order.objects.count() == 40
+
+    budgets.write_text(json.dumps({'book-list': {'queries': 0}}))
+    with pytest.raises(CommandError, match='book-list: queries'):
+        call_command('benchmark_api', iterations=1, warmup=0, only=['book-list'], cold_cache=True, budgets=str(budgets), stdout=StringIO(), stderr=StringIO())
+
+@pytest.mark.django_db
+def test_book_feed_import_upserts_by_isbn_and_export_streams(api_client, staff_user, book, tmp_path, django_capture_on_commit_callbacks):
+    feed = '\n'.join([
+        'ISBN,title,author,category,price,stock,published_date',
+        '123-4567890123,Book 1 Revised,Author 1,Fiction,12.50,7,2023-01-01',
+        '9780000000001,New Book,New Author,Poetry,5.00,3,2021-05-05',
+        '9780000000002,Bad Price,Someone,Poetry,cheap,3,2021-05-05',
+        'not-an-isbn,Bad ISBN,Someone,Poetry,5.00,3,2021-05-05',
+        '9780000000001,New Book (2nd ed),New Author,Poetry,6.00,3,2021-05-05',
+    ])
+    api_client.force_authenticate(user=staff_user)
+    upload = SimpleUploadedFile('feed.csv', feed.encode('utf-8'))
+    response = api_client.post(reverse('book-import'), {'file': upload}, format='multipart')
+    assert response.status_code == 200
+    summary = response.data
+    assert (summary['rows'], summary['created'], summary['updated'], summary['failed']) == (5, 1, 1, 3)
+    assert [(e['line'], list(e['errors'])) for e in summary['errors']] == [(4, ['price']), (5, ['ISBN']), (3, ['ISBN'])]
+    assert summary['errors'][2]['errors'] == {'ISBN': ["Duplicate ISBN, superseded by line 6."]}
+    book.refresh_from_db()
+    assert (book.title, book.stock) == ('Book 1 Revised', 7)
+    new = Book.objects.get(ISBN='9780000000001')
+    assert (new.title, new.category.name, str(new.price)) == ('New Book (2nd ed)', 'Poetry', '6.00')
+
+    response = api_client.get(reverse('book-export'), {'file_format': 'jsonl'})
+    assert response.streaming
+    rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+    assert [row['ISBN'] for row in rows] == ['1234567890123', '9780000000001']
+    assert rows[1]['category'] == 'Poetry'
+
+    # A command export re-imports as pure updates
+    path = tmp_path / 'books.csv'
+    call_command('export_books', output=str(path))
+    out = StringIO()
+    with django_capture_on_commit_callbacks() as callbacks:
+        call_command('import_books', str(path), chunk_size=1, stdout=out)
+    assert '2 row(s): 0 created, 2 updated, 0 failed' in out.getvalue()
+    # Each chunk invalidates the catalog cache as it commits
+    assert len(callbacks) == 2
+
+    api_client.force_authenticate(user=None)
+    assert api_client.get(reverse('book-export')).status_code == 401
+
+@pytest.mark.django_db
+def test_registration_is_atomic_and_profiles_are_unique(api_client, tmp_path):
+    url = reverse('user-register')
+    data = {'username': 'reader', 'password': 'pw-123456', 'address': '1 Main St', 'phone': '555-0100'}
+    assert api_client.post(url, data, format='json').status_code == 201
+    response = api_client.post(url, {**data, 'username': 'reader2'}, format='json')
+    assert response.status_code == 400
+    assert response.data['phone'] == ["A profile with that phone number already exists."]
+    assert response.data['address'] == ["A profile with that address already exists."]
+
+    # A concurrent signup taking the phone after validation leaves no orphaned user
+    serializer = ProfileSerializer(data={**data, 'username': 'racer', 'phone': '555-0199', 'address': '2 Main St'})
+    assert serializer.is_valid()
+    Profile.objects.create(user=User.objects.create(username='other'), phone='555-0199', address='3 Main St')
+    with pytest.raises(ValidationError) as excinfo:
+        serializer.save()
+    assert excinfo.value.detail == {'phone': ["A profile with that phone number already exists."]}
+    assert not User.objects.filter(username='racer').exists()
+
+    path = tmp_path / 'users.csv'
+    path.write_text('\n'.join([
+        'username,email,password,address,phone',
+        'bulk1,bulk1@example.com,pw-1,10 High St,555-1001',
+        'bulk2,,,11 High St,555-1002',
+        'bulk3,,pw-3,12 High St,555-1002',
+        'reader,,pw-4,13 High St,555-1004',
+        'bad name!,,pw-5,14 High St,555-1005',
+    ]))
+    err = StringIO()
+    call_command('provision_users', str(path), chunk_size=10, stdout=StringIO(), stderr=err)
+    assert set(Profile.objects.filter(user__username__startswith='bulk').values_list('user__username', flat=True)) == {
+        'bulk1', 'bulk2'
+    }
+    assert User.objects.get(username='bulk1').check_password('pw-1')
+    assert not User.objects.get(username='bulk2').has_usable_password()
+    errors = err.getvalue()
+    assert 'line 4 (bulk3)' in errors and 'phone number already exists' in errors
+    assert 'line 5 (reader)' in errors and 'line 6 (bad name!)' in errors
+
+@pytest.mark.django_db
+def test_purchase_index_backs_review_permission_and_listing(api_client, user, book, category):
+    other = Book.objects.create(
+        title='Book 2', author='Author 2', ISBN='1234567890124', price=8, stock=5,
+        published_date='2023-01-01', category=category
+    )
+    api_client.force_authenticate(user=user)
+    assert api_client.post(reverse('review-list'), {'book': book.id, 'rating': 5, 'comment': 'x'}).status_code == 403
+
+    response = api_client.post(reverse('order-list'), {'items': [{'book': book.id, 'quantity': 1}, {'book': other.id, 'quantity': 1}]}, format='json')
+    assert response.status_code == 201
+    assert PurchasedBook.objects.filter(user=user).count() == 2
+    # A second order for the same book keeps the first purchase date
+    first = PurchasedBook.objects.get(user=user, book=book).purchased_at
+    api_client.post(reverse('order-list'), {'items': [{'book': book.id, 'quantity': 1}]}, format='json')
+    assert PurchasedBook.objects.get(user=user, book=book).purchased_at == first
+
+    response = api_client.get(reverse('purchased-book-list'), {'pagination': 'cursor'})
+    assert [row['book']['id'] for row in response.data['results']] == [other.id, book.id]
+    assert api_client.post(reverse('review-list'), {'book': book.id, 'rating': 5, 'comment': 'x'}).status_code == 201
+
+    # Deleting every order containing a book removes it from the index
+    Order.objects.filter(user=user, items__book=other).delete()
+    assert list(PurchasedBook.objects.filter(user=user).values_list('book_id', flat=True)) == [book.id]
+
+@pytest.mark.django_db
+def test_metrics_record_view_action_and_queries_across_workers(api_client, user, book, settings, tmp_path):
+    settings.METRICS_DIR = str(tmp_path)
+    registry.reset()
+    api_client.get(reverse('book-list'))
+    api_client.force_authenticate(user=user)
+    api_client.post(reverse('order-list'), {'items': [{'book': book.id, 'quantity': 1}]}, format='json')
+    # Another worker's totals, as flushed to the shared directory
+    (tmp_path / 'other.json').write_text(json.dumps({
+        'counters': [['http_requests_total', [['view', 'book-list'], ['action', 'list'], ['method', 'GET'], ['status', '200']], 4]],
+        'histograms': [],
+    }))
+
+    response = api_client.get('/metrics')
+    assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+    body = response.content.decode()
+    assert 'http_requests_total{view="book-list",action="list",method="GET",status="200"} 5' in body
+    assert 'http_requests_total{view="order-list",action="create",method="POST",status="201"} 1' in body
+    assert 'http_request_duration_seconds_count{view="order-list",action="create",method="POST"} 1' in body
+    queries = [line for line in body.splitlines() if line.startswith('http_request_db_queries_sum{view="order-list"')]
+    assert queries and float(queries[0].rsplit(' ', 1)[1]) > 0
+
+    settings.METRICS_TOKEN = 'secret'
+    assert api_client.get('/metrics').status_code == 401
+    assert api_client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code == 200
+
+@pytest.mark.django_db
+def test_async_catalog_views_match_sync_views(api_client, user, staff_user, book, category, django_assert_num_queries, settings):
+    for i in range(12):
+        Book.objects.create(
+            title=f'Shadow {i}', author='Author', ISBN=f'97811111111{i:02d}', price=i + 1, stock=3,
+            published_date='2022-01-01', category=category
+        )
+    Review.objects.create(user=user, book=book, rating=4, comment='Good')
+    urls = [
+        reverse('book-list'),
+        reverse('book-list') + f'?category={category.id}&ordering=-price&page=2',
+        reverse('book-list') + '?pagination=cursor&ordering=price',
+        reverse('book-list') + '?q=shadow',
+        reverse('book-list') + '?page=99',
+        reverse('book-list') + '?category=abc',
+        reverse('book-list') + f'?facets=true&category__in={category.id}&price__gte=2',
+        reverse('book-detail', args=[book.id]),
+        reverse('book-detail', args=[999999]),
+        reverse('category-list'),
+        reverse('category-detail', args=[category.id]),
+        reverse('book-review-list', args=[book.id]),
+    ]
+    def fetch_all():
+        results = []
+        for url in urls:
+            cache.clear()
+            response = api_client.get(url)
+            results.append((url, response.status_code, response.json()))
+        return results
+
+    expected = fetch_all()
+    with django_assert_num_queries(3):
+        api_client.get(reverse('book-list'), {'page': 2})
+
+    settings.ASYNC_CATALOG_VIEWS = True
+    importlib.reload(store_urls)
+    importlib.reload(project_urls)
+    clear_url_caches()
+    try:
+        assert iscoroutinefunction(resolve(reverse('book-list')).func)
+        assert fetch_all() == expected
+        cache.clear()
+        with django_assert_num_queries(3):
+            response = api_client.get(reverse('book-list'), {'page': 2})
+        assert response['X-Cache'] == 'MISS'
+        assert api_client.get(reverse('book-list'), {'page': 2})['X-Cache'] == 'HIT'
+
+        # Writes on the same routes run the sync code
+        api_client.force_authenticate(user=staff_user)
+        response = api_client.post(reverse('book-list'), {
+            'title': 'New', 'author': 'A', 'ISBN': '9782222222222', 'price': '3.00', 'stock': 1,
+            'published_date': '2024-01-01', 'category': category.id,
+        }, format='json')
+        assert response.status_code == 201
+    finally:
+        settings.ASYNC_CATALOG_VIEWS = False
+        importlib.reload(store_urls)
+        importlib.reload(project_urls)
+        clear_url_caches()
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_load_benchmark_reports_latency(live_server, book, tmp_path):
+    output = tmp_path / 'servers.json'
+    call_command(
+        'benchmark_servers', wsgi_url=live_server.url, requests=30, concurrency=5, output=str(output), stderr=StringIO()
+    )
+    result = json.loads(output.read_text())['results']['wsgi']
+    assert result['errors'] == 0
+    assert result['status'] == {'200': 30}
+    assert result['p50_ms'] <= result['p95_ms'] <= result['p99_ms']
+
+@pytest.mark.django_db
+def test_claims_tokens_authenticate_without_loading_the_user(
+    api_client, user, staff_user, book, purchased_order, django_capture_on_commit_callbacks
+):
+    response = api_client.post(reverse('token_obtain_pair'), {'username': 'testuser', 'password': 'testpass'})
+    access = response.data['access']
+    api_client.credentials(HTTP_AUTHORIZATION='Bearer ' + access)
+    assert api_client.get(reverse('order-list')).status_code == 200
+    with CaptureQueriesContext(connection) as queries:
+        response = api_client.get(reverse('order-list'))
+    assert response.status_code == 200 and response.data['count'] == 1
+    assert not any('"auth_user"' in query['sql'] for query in queries.captured_queries)
+
+    # Review create and owner checks work on the claims user
+    response = api_client.post(reverse('review-list'), {'book': book.id, 'rating': 4, 'comment': 'Good'}, format='json')
+    assert response.status_code == 201 and response.data['user'] == user.id
+    review_url = reverse('review-detail', args=[response.data['id']])
+    assert api_client.patch(review_url, {'rating': 5}, format='json').status_code == 200
+    staff_access = api_client.post(reverse('token_obtain_pair'), {'username': 'admin', 'password': 'adminpass'}).data['access']
+    api_client.credentials(HTTP_AUTHORIZATION='Bearer ' + staff_access)
+    assert api_client.patch(review_url, {'rating': 1}, format='json').status_code == 403
+    status_url = reverse('order-update-status', args=[purchased_order.id])
+    assert api_client.patch(status_url, {'status': 'shipped'}, format='json').status_code == 200
+
+    # Tokens without the claims still go through the database lookup
+    api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+    assert api_client.get(reverse('order-list')).status_code == 200
+
+    # Saving the user revokes the cached state: staff demotion, then a password change
+    api_client.credentials(HTTP_AUTHORIZATION='Bearer ' + staff_access)
+    with django_capture_on_commit_callbacks(execute=True):
+        staff_user.is_staff = False
+        staff_user.save()
+    assert api_client.get(reverse('order-list')).status_code == 401
+    api_client.credentials(HTTP_AUTHORIZATION='Bearer ' + access)
+    with django_capture_on_commit_callbacks(execute=True):
+        user.set_password('newpass123')
+        user.save()
+    assert api_client.get(reverse('order-list')).status_code == 401
+
+@pytest.mark.django_db
+def test_sales_rollups_follow_orders_and_match_backfill(api_client, user, staff_user, book, category):
+    other = Book.objects.create(
+        title='Book 2', author='Author 2', ISBN='9780000000002', price=4, stock=50,
+        published_date='2023-01-01', category=Category.objects.create(name='History'),
+    )
+    api_client.force_authenticate(user=user)
+    for items in ([{'book': book.id, 'quantity': 2}, {'book': other.id, 'quantity': 1}], [{'book': other.id, 'quantity': 5}]):
+        assert api_client.post(reverse('order-list'), {'items': items}, format='json').status_code == 201
+    # Placed orders reach the rollups through the job queue
+    assert run_pending() == 2
+    first = Order.objects.order_by('pk').first()
+    api_client.force_authenticate(user=staff_user)
+    api_client.patch(reverse('order-update-status', args=[first.id]), {'status': 'shipped'}, format='json')
+    # Admin edits go through the model signals
+    OrderItem.objects.filter(order=first, book=other).get().delete()
+
+    def snapshot():
+        daily = set(DailySales.objects.exclude(orders=0, units=0).values_list('day', 'status', 'orders', 'units', 'revenue'))
+        books = set(DailyBookSales.objects.exclude(orders=0, units=0).values_list('day', 'book_id', 'orders', 'units', 'revenue'))
+        return daily, books
+
+    incremental = snapshot()
+    today = first.order_date.date()
+    assert incremental[0] == {(today, 'shipped', 1, 2, 20), (today, 'pending', 1, 5, 20)}
+    call_command('backfill_sales', stdout=StringIO())
+    assert snapshot() == incremental
+
+    response = api_client.get(reverse('analytics-revenue'), {'interval': 'month'})
+    assert response.status_code == 200
+    assert [(row['orders'], row['units'], row['revenue']) for row in response.data['results']] == [(2, 7, '40.00')]
+    response = api_client.get(reverse('analytics-revenue'), {'status': 'shipped'})
+    assert response.data['results'][0]['revenue'] == '20.00'
+    response = api_client.get(reverse('analytics-bestsellers'), {'limit': 1})
+    assert [(row['title'], row['units']) for row in response.data['results']] == [('Book 2', 5)]
+    response = api_client.get(reverse('analytics-bestsellers'), {'rank_by': 'revenue', 'category': category.id})
+    assert [row['title'] for row in response.data['results']] == ['Book 1']
+    response = api_client.get(reverse('analytics-categories'))
+    assert {(row['category_name'], row['units']) for row in response.data['results']} == {('Fiction', 2), ('History', 5)}
+    assert api_client.get(reverse('analytics-revenue'), {'start': '2024-02-01', 'end': '2024-01-01'}).status_code == 400
+    api_client.force_authenticate(user=user)
+    assert api_client.get(reverse('analytics-revenue')).status_code == 403
+
+@pytest.mark.django_db
+def test_stock_reservations_hold_convert_and_expire(api_client, user, staff_user, book, settings):
+    url = reverse('reservation-list')
+    api_client.force_authenticate(user=user)
+    response = api_client.post(url, {'items': [{'book': book.id, 'quantity': 3}], 'ttl': 300}, format='json')
+    assert response.status_code == 201 and response.data[0]['quantity'] == 3
+    book.refresh_from_db()
+    assert book.stock == 2
+
+    # Held units are gone for everyone else
+    api_client.force_authenticate(user=staff_user)
+    response = api_client.post(url, {'items': [{'book': book.id, 'quantity': 3}]}, format='json')
+    assert response.status_code == 400
+    assert 'Available: 2' in response.data['non_field_errors'][0]
+    assert api_client.get(url).data == []
+
+    # Ordering converts the hold and takes only the rest from stock
+    api_client.force_authenticate(user=user)
+    response = api_client.post(reverse('order-list'), {'items': [{'book': book.id, 'quantity': 4}]}, format='json')
+    assert response.status_code == 201
+    book.refresh_from_db()
+    assert book.stock == 1
+    assert not StockReservation.objects.exists()
+
+    # Expired holds are returned on demand, by the sweep, or on release
+    api_client.post(url, {'items': [{'book': book.id, 'quantity': 1}]}, format='json')
+    StockReservation.objects.update(expires_at=timezone.now())
+    api_client.force_authenticate(user=staff_user)
+    assert api_client.post(url, {'items': [{'book': book.id, 'quantity': 1}]}, format='json').status_code == 201
+    StockReservation.objects.update(expires_at=timezone.now())
+    call_command('release_reservations', stdout=StringIO())
+    book.refresh_from_db()
+    assert book.stock == 1 and not StockReservation.objects.exists()
+    # The job worker sweeps them as well
+    api_client.post(url, {'items': [{'book': book.id, 'quantity': 1}]}, format='json')
+    StockReservation.objects.update(expires_at=timezone.now())
+    call_command('run_jobs', once=True, stdout=StringIO())
+    book.refresh_from_db()
+    assert book.stock == 1 and not StockReservation.objects.exists()
+    reservation_id = api_client.post(url, {'items': [{'book': book.id, 'quantity': 1}]}, format='json').data[0]['id']
+    assert api_client.delete(reverse('reservation-detail', args=[reservation_id])).status_code == 204
+    book.refresh_from_db()
+    assert book.stock == 1
+
+    # Checkout also takes back holds that expired before the sweep ran
+    api_client.post(url, {'items': [{'book': book.id, 'quantity': 1}]}, format='json')
+    StockReservation.objects.update(expires_at=timezone.now())
+    api_client.force_authenticate(user=user)
+    response = api_client.post(reverse('order-list'), {'items': [{'book': book.id, 'quantity': 1}]}, format='json')
+    assert response.status_code == 201
+    book.refresh_from_db()
+    assert book.stock == 0 and not StockReservation.objects.exists()
+    response = api_client.post(reverse('order-list'), {'items': [{'book': book.id, 'quantity': 1}]}, format='json')
+    assert response.status_code == 400 and 'Available: 0' in response.data['non_field_errors'][0]
+
+    # One account can't hold a title's whole stock
+    settings.STOCK_RESERVATION_MAX_QUANTITY = 3
+    Book.objects.filter(pk=book.pk).update(stock=10)
+    assert api_client.post(url, {'items': [{'book': book.id, 'quantity': 2}]}, format='json').status_code == 201
+    response = api_client.post(url, {'items': [{'book': book.id, 'quantity': 2}]}, format='json')
+    assert response.status_code == 400
+    assert response.data['non_field_errors'] == ["You can hold at most 3 of 'Book 1'. Held: 2, requested: 2"]
+    api_client.force_authenticate(user=staff_user)
+    assert api_client.post(url, {'items': [{'book': book.id, 'quantity': 3}]}, format='json').status_code == 201
+    book.refresh_from_db()
+    assert book.stock == 5
+
+@pytest.mark.django_db
+def test_sparse_fieldsets_narrow_output_and_columns(api_client, user, book, purchased_order, django_assert_num_queries):
+    Review.objects.create(user=user, book=book, rating=4, comment='Fine')
+    with CaptureQueriesContext(connection) as queries:
+        response = api_client.get(reverse('book-list'), {'fields': 'id,title,price', 'ordering': '-price'})
+    assert response.status_code == 200
+    assert set(response.data['results'][0]) == {'id', 'title', 'price'}
+    select = [query['sql'] for query in queries.captured_queries if 'FROM "store_book"' in query['sql']][-1]
+    assert '"store_book"."title"' in select and '"store_book"."author"' not in select
+
+    # Embedded reviews are only fetched when asked for
+    with django_assert_num_queries(2):
+        response = api_client.get(reverse('book-detail', args=[book.id]), {'fields': 'id,title'})
+    assert set(response.data) == {'id', 'title'}
+    response = api_client.get(reverse('book-detail', args=[book.id]), {'omit': 'stock,reviews_next'})
+    assert 'stock' not in response.data and len(response.data['reviews']) == 1
+    assert 'reviews_next' not in response.data
+
+    response = api_client.get(reverse('book-review-list', args=[book.id]), {'fields': 'rating', 'pagination': 'cursor'})
+    assert [set(review) for review in response.data['results']] == [{'rating'}]
+    response = api_client.get(reverse('category-list'), {'omit': 'description'})
+    assert 'description' not in response.data['results'][0]
+    assert api_client.get(reverse('book-list'), {'fields': 'id,secret'}).status_code == 400
+
+    # Orders without items skip the prefetch
+    api_client.force_authenticate(user=user)
+    with django_assert_num_queries(2):
+        response = api_client.get(reverse('order-list'), {'fields': 'id,status'})
+    assert response.data['results'] == [{'id': purchased_order.id, 'status': 'pending'}]
+    response = api_client.get(reverse('order-list'), {'representation': 'summary', 'fields': 'id,item_count'})
+    assert response.data['results'] == [{'id': purchased_order.id, 'item_count': 1}]
+
+@pytest.mark.django_db
+def test_conditional_get_answers_304_until_a_change(
+    api_client, user, book, category, django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    url = reverse('book-list')
+    response = api_client.get(url, {'page': 1})
+    etag = response['ETag']
+    assert etag.startswith('W/"') and 'Last-Modified' not in response
+    # Validators are cached with the responses; cold, they are one aggregate
+    with django_assert_num_queries(0):
+        response = api_client.get(url, {'page': 1}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304 and response['ETag'] == etag and not response.content
+    cache.clear()
+    with django_assert_num_queries(1):
+        assert api_client.get(url, {'page': 1}, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    assert api_client.get(url, {'page': 2}, HTTP_IF_NONE_MATCH=etag).status_code != 304
+
+    detail = reverse('book-detail', args=[book.id])
+    response = api_client.get(detail)
+    last_modified = response['Last-Modified']
+    assert api_client.get(detail, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+    assert api_client.get(detail, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+    assert api_client.get(reverse('book-detail', args=[999999]), HTTP_IF_NONE_MATCH='*').status_code == 404
+
+    # Ratings, stock and deletions all change the validators
+    with django_capture_on_commit_callbacks(execute=True):
+        Review.objects.create(user=user, book=book, rating=5, comment='Great')
+    response = api_client.get(detail, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 200 and len(response.data['reviews']) == 1
+    detail_etag = response['ETag']
+    api_client.force_authenticate(user=user)
+    with django_capture_on_commit_callbacks(execute=True):
+        assert api_client.post(reverse('reservation-list'), {'items': [{'book': book.id, 'quantity': 1}]}, format='json').status_code == 201
+    api_client.force_authenticate(user=None)
+    response = api_client.get(detail, HTTP_IF_NONE_MATCH=detail_etag)
+    assert response.status_code == 200 and response.data['stock'] == 4
+    with django_capture_on_commit_callbacks(execute=True):
+        other = Book.objects.create(
+            title='Book 2', author='Author 2', ISBN='1234567890124', price=12, stock=1,
+            published_date='2023-01-01', category=category,
+        )
+        book.save()
+    etag = api_client.get(url, {'page': 1})['ETag']
+    # Deleting an older row leaves the newest updated_at as it was
+    with django_capture_on_commit_callbacks(execute=True):
+        other.delete()
+    assert api_client.get(url, {'page': 1}, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    etag = api_client.get(reverse('category-list'))['ETag']
+    assert api_client.get(reverse('category-list'), HTTP_IF_NONE_MATCH=etag).status_code == 304
+    with django_capture_on_commit_callbacks(execute=True):
+        category.description = 'Stories'
+        category.save()
+    assert api_client.get(reverse('category-list'), HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+@pytest.mark.django_db
+def test_book_list_range_filters_and_facet_counts(api_client, book, category, django_assert_num_queries):
+    poetry = Category.objects.create(name='Poetry')
+    for i, (price, year, stock) in enumerate([(5, 1965, 0), (30, 1995, 2), (120, 2021, 1)]):
+        Book.objects.create(
+            title=f'Verse {i}', author='Poet', ISBN=f'97833333333{i:02d}', price=price, stock=stock,
+            published_date=f'{year}-06-01', category=poetry,
+        )
+    url = reverse('book-list')
+    response = api_client.get(url, {'price__gte': 10, 'price__lt': 100})
+    assert sorted(b['price'] for b in response.data['results']) == ['10.00', '30.00']
+    response = api_client.get(url, {'category__in': f'{category.id},{poetry.id}', 'in_stock': 'false'})
+    assert [b['title'] for b in response.data['results']] == ['Verse 0']
+    assert api_client.get(url, {'published_date__year__gte': 2000}).data['count'] == 2
+    assert api_client.get(url, {'price__gte': 'cheap'}).status_code == 400
+    assert 'facets' not in api_client.get(url).data
+
+    # Validators, count, page, then all four facets from one aggregate
+    with django_assert_num_queries(4):
+        response = api_client.get(url, {'facets': 'true'})
+    facets = response.data['facets']
+    assert response.data['count'] == 4
+    assert facets['category'] == [
+        {'id': category.id, 'name': 'Fiction', 'count': 1}, {'id': poetry.id, 'name': 'Poetry', 'count': 3},
+    ]
+    assert [bucket['count'] for bucket in facets['price']] == [1, 1, 1, 0, 1]
+    assert facets['price'][1] == {'min': 10, 'max': 25, 'count': 1}
+    assert [bucket['count'] for bucket in facets['year']] == [1, 0, 1, 0, 0, 2]
+    assert facets['stock'] == {'in_stock': 3, 'out_of_stock': 1}
+
+    # Facets describe the filtered result set, search included
+    facets = api_client.get(url, {'facets': 'true', 'q': 'verse', 'in_stock': 'true'}).data['facets']
+    assert facets['category'] == [{'id': poetry.id, 'name': 'Poetry', 'count': 2}]
+    assert facets['stock'] == {'in_stock': 2, 'out_of_stock': 0}
+
+def sequential_scans(sql):
+    """
+    Tables the database would read in full to run `sql`. On PostgreSQL
+    sequential scans are disabled first, so one is only chosen when no
+    index can serve the query at all. An index scan that only filters rows
+    (no Index Cond) walks the whole index, so it counts as a full read too,
+    unless a Limit stops it after a page of matches.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+            plan = cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            nodes, tables = [(plan[0]['Plan'], None)], []
+            while nodes:
+                node, parent = nodes.pop()
+                if node['Node Type'] == 'Seq Scan':
+                    tables.append(node['Relation Name'])
+                elif (node['Node Type'] in ('Index Scan', 'Index Only Scan') and 'Filter' in node
+                        and 'Index Cond' not in node and 'Recheck Cond' not in node
+                        and parent != 'Limit'):
+                    tables.append(node['Relation Name'])
+                nodes += [(child, node['Node Type']) for child in node.get('Plans', [])]
+            cursor.execute('RESET enable_seqscan')
+            return tables
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[-1].split()[1] for row in cursor.fetchall() if row[-1].startswith('SCAN ') and ' USING ' not in row[-1]]
+
+@pytest.mark.django_db
+def test_hot_queries_use_indexes(api_client):
+    # Every query behind the busiest reads must be servable from an index
+    call_command('seed_catalog', categories=3, books=60, users=5, orders=400, reviews=40, batch_size=32, stdout=StringIO())
+    user = User.objects.filter(orders__isnull=False).first()
+    staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+    book = Book.objects.filter(review_count__gt=0).first()
+    requests = [
+        (None, reverse('book-list'), {'ordering': 'price'}),
+        (None, reverse('book-list'), {'ordering': '-published_date', 'pagination': 'cursor'}),
+        (None, reverse('book-list'), {'category': book.category_id, 'ordering': 'price'}),
+        (None, reverse('book-list'), {'in_stock': 'true', 'ordering': 'price', 'pagination': 'cursor'}),
+        (None, reverse('book-list'), {'price__gte': 20, 'price__lt': 40}),
+        (None, reverse('book-detail', args=[book.id]), {}),
+        (None, reverse('book-review-list', args=[book.id]), {'pagination': 'cursor'}),
+        (user, reverse('order-list'), {}),
+        (user, reverse('order-list'), {'pagination': 'cursor'}),
+        (user, reverse('purchased-book-list'), {}),
+        (staff, reverse('order-list'), {'status': 'pending', 'pagination': 'cursor'}),
+        (staff, reverse('order-list'), {}),
+    ]
+    full_scans = []
+    for who, url, params in requests:
+        api_client.force_authenticate(user=who)
+        with CaptureQueriesContext(connection) as queries:
+            assert api_client.get(url, params).status_code == 200
+        for query in queries.captured_queries:
+            if query['sql'].startswith('SELECT') and (tables := sequential_scans(query['sql'])):
+                full_scans.append((url, params, tables, query['sql']))
+    assert full_scans == []
+
+@pytest.mark.django_db
+def test_bulk_order_status_transitions(api_client, user, staff_user, book, django_assert_max_num_queries, monkeypatch):
+    api_client.force_authenticate(user=user)
+    for _ in range(4):
+        assert api_client.post(reverse('order-list'), {'items': [{'book': book.id, 'quantity': 1}]}, format='json').status_code == 201
+    run_pending()
+    first, second, third, fourth = Order.objects.order_by('pk').values_list('pk', flat=True)
+    delivered = Order.objects.get(pk=third)
+    delivered.status = 'delivered'
+    delivered.save()
+    url = reverse('order-bulk-status')
+    assert api_client.post(url, {'ids': [first], 'status': 'shipped'}, format='json').status_code == 403
+
+    api_client.force_authenticate(user=staff_user)
+    # One locked read, one UPDATE and the rollup move for the whole batch
+    with django_assert_max_num_queries(8):
+        response = api_client.post(url, {'ids': [first, second, third, 999999, first], 'status': 'shipped'}, format='json')
+    assert response.status_code == 200
+    assert response.data['results'] == {first: 'updated', second: 'updated', third: 'invalid_transition', 999999: 'not_found'}
+    assert response.data['counts'] == {'updated': 2, 'unchanged': 0, 'not_found': 1, 'invalid_transition': 1}
+    assert set(Order.objects.filter(status='shipped').values_list('pk', flat=True)) == {first, second}
+    shipped = DailySales.objects.get(status='shipped')
+    assert (shipped.orders, shipped.units) == (2, 2)
+    assert DailySales.objects.get(status='pending').orders == 1
+
+    response = api_client.post(url, {'filter': {'status': 'shipped'}, 'status': 'delivered'}, format='json')
+    assert response.data['counts']['updated'] == 2
+    response = api_client.post(url, {'filter': {'status__in': 'pending,delivered'}, 'status': 'delivered'}, format='json')
+    assert response.data['results'] == {first: 'unchanged', second: 'unchanged', third: 'unchanged', fourth: 'updated'}
+    assert DailySales.objects.get(status='delivered').orders == 4
+    assert api_client.post(url, {'ids': [first], 'filter': {'status': 'pending'}, 'status': 'shipped'}, format='json').status_code == 400
+    assert api_client.post(url, {'filter': {'order_date__gte': 'soon'}, 'status': 'shipped'}, format='json').status_code == 400
+    # A filter that wouldn't narrow anything down is refused, not applied to every order
+    response = api_client.post(url, {'filter': {'stauts': 'pending'}, 'status': 'pending'}, format='json')
+    assert response.status_code == 400
+    assert response.data['filter'] == ["Unknown filter(s): stauts."]
+    response = api_client.post(url, {'filter': {'status': ''}, 'status': 'pending'}, format='json')
+    assert response.data['filter'] == ["Give at least one filter value."]
+    monkeypatch.setattr(BulkStatusSerializer, 'max_orders', 3)
+    response = api_client.post(url, {'filter': {'user': user.id}, 'status': 'pending'}, format='json')
+    assert response.data['filter'] == ["Matches more than 3 orders; narrow it down."]
+    assert api_client.post(url, {'ids': [first], 'status': 'lost'}, format='json').status_code == 400
+    assert api_client.get(reverse('order-list'), {'status': 'delivered'}).data['count'] == 4
+
+@pytest.mark.django_db
+def test_order_export_streams_items_with_filters(api_client, user, staff_user, book, category, tmp_path):
+    other = Book.objects.create(
+        title='Book 2', author='Author 2', ISBN='9780000000002', price=4, stock=50,
+        published_date='2023-01-01', category=Category.objects.create(name='History'),
+    )
+    api_client.force_authenticate(user=user)
+    for items in ([{'book': book.id, 'quantity': 2}, {'book': other.id, 'quantity': 1}], [{'book': other.id, 'quantity': 5}]):
+        assert api_client.post(reverse('order-list'), {'items': items}, format='json').status_code == 201
+    first, second = Order.objects.order_by('pk')
+    Order.objects.filter(pk=second.pk).update(status='shipped', order_date=timezone.now() - timezone.timedelta(days=40))
+    url = reverse('order-export')
+    assert api_client.get(url).status_code == 403
+
+    api_client.force_authenticate(user=staff_user)
+    response = api_client.get(url, {'file_format': 'jsonl'})
+    assert response.streaming and response['Content-Type'] == 'application/x-ndjson'
+    rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+    assert [(row['order_id'], row['ISBN'], row['quantity']) for row in rows] == [
+        (first.id, book.ISBN, 2), (first.id, other.ISBN, 1), (second.id, other.ISBN, 5),
+    ]
+    assert (rows[0]['username'], rows[0]['category'], rows[0]['price_at_purchase']) == ('testuser', 'Fiction', '10.00')
+
+    # The header goes out before the query runs
+    lines = api_client.get(url, {'status': 'shipped'}).streaming_content
+    with CaptureQueriesContext(connection) as queries:
+        assert next(lines).decode().startswith('order_id,order_date,status')
+    assert len(queries) == 0
+    assert [line.decode().split(',')[0] for line in lines] == [str(second.id)]
+    since = (timezone.now() - timezone.timedelta(days=1)).date().isoformat()
+    response = api_client.get(url, {'order_date__gte': since, 'file_format': 'jsonl'})
+    assert {json.loads(line)['order_id'] for line in b''.join(response.streaming_content).decode().splitlines()} == {first.id}
+    assert api_client.get(url, {'file_format': 'xml'}).status_code == 400
+
+    # Under ASGI the lines are pulled in batches instead of read into memory first
+    async def fetch_asgi(path):
+        token = ClaimsRefreshToken.for_user(staff_user).access_token
+        response = await AsyncClient().get(path, headers={'Authorization': f'Bearer {token}'})
+        assert response.is_async
+        return [chunk async for chunk in response.streaming_content]
+
+    chunks = async_to_sync(fetch_asgi)(url)
+    assert len(chunks) == 1 and chunks[0].decode().count('\n') == 4
+    assert async_to_sync(fetch_asgi)(reverse('book-export'))[0].decode().startswith('ISBN,title')
+    pulled = []
+
+    def lines():
+        for n in range(5):
+            pulled.append(n)
+            yield f'{n}\n'
+
+    async def first_batch():
+        batches = aiter_lines(lines(), batch_size=2)
+        return await anext(batches), list(pulled)
+
+    assert async_to_sync(first_batch)() == ('0\n1\n', [0, 1])
+
+    path = tmp_path / 'orders.csv'
+    call_command('export_orders', output=str(path), status=['pending'], chunk_size=1)
+    assert len(path.read_text().splitlines()) == 3
+    with pytest.raises(CommandError):
+        call_command('export_orders', since='yesterday', stdout=StringIO())
+
+@pytest.mark.django_db
+def test_job_queue_batches_retries_and_reports(api_client, user, book):
+    calls = []
+
+    def collect(payloads):
+        if any(payload.get('poison') for payload in payloads):
+            raise RuntimeError('poisoned')
+        calls.append([payload['n'] for payload in payloads])
+        if any(payload.get('requeue') for payload in payloads):
+            enqueue('test.collect', {'n': 8}, key='refresh')
+
+    task('test.collect', batch_size=3, max_attempts=2)(collect)
+    try:
+        with transaction.atomic():
+            enqueue('test.collect', {'n': 0})
+            transaction.set_rollback(True)
+        assert not Job.objects.exists()
+        for n in range(1, 5):
+            enqueue('test.collect', {'n': n})
+        enqueue('test.collect', {'poison': True})
+        enqueue('test.collect', {'n': 5}, key='refresh')
+        enqueue('test.collect', {'n': 6}, key='refresh')
+        assert run_pending() == 6
+        # Batches of three; the failing one reruns its jobs one at a time
+        assert calls == [[1, 2, 3], [4], [5]]
+        poisoned = Job.objects.get()
+        assert (poisoned.attempts, poisoned.failed_at) == (1, None) and 'poisoned' in poisoned.last_error
+        assert poisoned.run_at > timezone.now() and run_pending() == 0
+        Job.objects.update(run_at=timezone.now())
+        out = StringIO()
+        call_command('run_jobs', once=True, stdout=out)
+        assert 'Processed 1 job(s).' in out.getvalue()
+        assert Job.objects.get().failed_at is not None
+        metrics = render_metrics()
+        assert 'jobs_total{task="test.collect",outcome="done"} 5' in metrics
+        assert 'jobs_total{task="test.collect",outcome="failed"} 1' in metrics
+        # A running job no longer holds its key: what it queues runs next
+        enqueue('test.collect', {'n': 7, 'requeue': True}, key='refresh')
+        assert run_pending() == 2
+        assert calls[-2:] == [[7], [8]]
+    finally:
+        TASKS.pop('test.collect')
+
+    # Checkout leaves the sales rollups to a worker
+    api_client.force_authenticate(user=user)
+    assert api_client.post(reverse('order-list'), {'items': [{'book': book.id, 'quantity': 2}]}, format='json').status_code == 201
+    assert not DailySales.objects.exists()
+    assert Job.objects.filter(task='sales.record_placed').count() == 1
+    run_pending()
+    assert DailyBookSales.objects.get(book=book).units == 2
+
+    # An order deleted before its job runs leaves no sales behind
+    assert api_client.post(reverse('order-list'), {'items': [{'book': book.id, 'quantity': 1}]}, format='json').status_code == 201
+    Order.objects.latest('pk').delete()
+    run_pending()
+    assert DailyBookSales.objects.get(book=book).units == 2
+    assert DailySales.objects.aggregate(orders=Sum('orders'), units=Sum('units')) == {'orders': 1, 'units': 2}
+    # ... and an item deleted before it takes only that item out
+    assert api_client.post(reverse('order-list'), {'items': [{'book': book.id, 'quantity': 1}]}, format='json').status_code == 201
+    OrderItem.objects.latest('pk').delete()
+    run_pending()
+    assert DailyBookSales.objects.get(book=book).units == 2
+    assert DailySales.objects.aggregate(orders=Sum('orders'), units=Sum('units')) == {'orders': 2, 'units': 2}
+
+@pytest.mark.django_db
+def test_connection_benchmark_compares_new_persistent_and_pooled():
+    report = benchmark_connections(iterations=3, warmup=1)
+    results = report['results']
+    assert results['persistent']['connections_opened'] == 0
+    if connection.vendor != 'postgresql':
+        # Django never closes an in-memory SQLite test database
+        assert 'pooled' not in results and results['new']['samples'] == 3
+        return
+    assert results['new']['connections_opened'] == 3
+    # Every checkout after warmup reuses the pool's one connection
+    assert results['pooled']['connections_opened'] == 0
+    metrics = render_metrics()
+    assert 'db_connections_total{database="default:benchmark-new"} 4' in metrics
+    assert 'db_pool_checkouts_total{database="default:benchmark-pooled",outcome="ok"} 4' in metrics
+    assert 'db_pool_wait_seconds_count{database="default:benchmark-pooled"} 4' in metrics
+
+@pytest.mark.django_db
+def test_replica_routing_pins_writers_to_the_primary(
+    api_client, user, book, category, settings, tmp_path, django_capture_on_commit_callbacks
+):
+    # A second SQLite database stands in for a replica that lags behind;
+    # added as a dynamic connection, which the test database guard allows
+    replica_settings = connections.configure_settings({
+        'default': connections.settings['default'],
+        'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(tmp_path / 'replica.sqlite3')},
+    })['replica']
+    connections['replica'] = load_backend(replica_settings['ENGINE']).DatabaseWrapper(replica_settings, 'replica')
+    settings.REPLICA_DATABASES = ['replica']
+    try:
+        with connections['replica'].schema_editor() as editor:
+            for model in (Category, Book, Review):
+                editor.create_model(model)
+        Category.objects.using('replica').bulk_create([Category.objects.get(pk=category.pk)])
+        stale = Book.objects.get(pk=book.pk)
+        stale.title = 'Stale title'
+        Book.objects.using('replica').bulk_create([stale])
+
+        detail = reverse('book-detail', args=[book.pk])
+        assert api_client.get(detail).data['title'] == 'Stale title'
+        api_client.force_authenticate(user=user)
+        assert api_client.get(reverse('book-list')).data['results'][0]['title'] == 'Stale title'
+        # Writes, and the reads of unsafe requests, stay on the primary
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(reverse('order-list'), {'items': [{'book': book.id, 'quantity': 1}]}, format='json')
+        assert response.status_code == 201
+        assert Order.objects.filter(user=user).exists()
+        assert is_pinned(user.pk)
+        # A reader still on the lagging replica doesn't cache its rows under the new version
+        reader = APIClient()
+        assert reader.get(detail).data['title'] == 'Stale title'
+        response = api_client.get(detail)
+        assert response.data['title'] == 'Book 1' and response['X-Cache'] == 'MISS'
+        api_client.force_authenticate(user=None)
+        assert api_client.get(reverse('book-list') + '?ordering=title').data['results'][0]['title'] == 'Stale title'
+        # Orders are never read from a replica
+        api_client.force_authenticate(user=user)
+        assert api_client.get(reverse('order-list')).data['results']
+    finally:
+        connections['replica'].close()
+        del connections['replica']
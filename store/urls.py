@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import (
@@ -7,15 +8,24 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from .views import (
-    BookViewSet, CategoryViewSet, OrderViewSet, ReviewViewSet, BookReviewListView,
-    UserRegistrationView,
+    BookViewSet, CategoryViewSet, OrderViewSet, ReviewViewSet, BookReviewListView, StockReservationViewSet,
+    UserRegistrationView, CacheStatsView, PurchasedBookListView, MetricsView,
+    SalesRevenueView, CategorySalesView, BestsellersView,
 )
 
+# ASGI deployments serve the catalog reads from async views (bookstore/asgi.py)
+if getattr(settings, 'ASYNC_CATALOG_VIEWS', False):
+    from .async_views import (
+        AsyncBookViewSet as BookViewSet, AsyncCategoryViewSet as CategoryViewSet,
+        AsyncBookReviewListView as BookReviewListView,
+    )
+
 router = DefaultRouter()
 router.register(r'books', BookViewSet, basename='book')
 router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'reviews', ReviewViewSet, basename='review')
+router.register(r'reservations', StockReservationViewSet, basename='reservation')
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -30,9 +40,15 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('', include(router.urls)),
     path('books/<int:book_id>/reviews/', BookReviewListView.as_view(), name='book-review-list'),
+    path('purchased-books/', PurchasedBookListView.as_view(), name='purchased-book-list'),
     path('auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/register/', UserRegistrationView.as_view(), name='user-register'),
+    path('cache/stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('analytics/revenue/', SalesRevenueView.as_view(), name='analytics-revenue'),
+    path('analytics/categories/', CategorySalesView.as_view(), name='analytics-categories'),
+    path('analytics/bestsellers/', BestsellersView.as_view(), name='analytics-bestsellers'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ]
@@ -1,60 +1,189 @@
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
-from rest_framework import viewsets, generics, permissions, filters, status
+from django.utils.crypto import constant_time_compare
+from django.views import View
+from rest_framework import viewsets, generics, mixins, permissions, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.reverse import reverse
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Book, Category, Review, Order
+from django.db.models import Count, Prefetch, Sum
+from django.utils import timezone
+from .models import Book, Category, Review, Order, OrderItem, PurchasedBook, StockReservation
 from .serializers import (
     BookSerializer, CategorySerializer, ReviewSerializer,
-    OrderSerializer, ProfileSerializer
+    OrderSerializer, OrderSummarySerializer, BulkStatusSerializer, ProfileSerializer, PurchasedBookSerializer,
+    StockReservationSerializer, ReserveSerializer, SalesQuerySerializer, SalesPeriodSerializer, CategorySalesSerializer, BestsellerSerializer,
 )
 from .permissions import (
     IsAdminOrReadOnly, IsReviewerAndPurchasedBook, IsOwnerOrReadOnly
 )
+from .pagination import HybridPagination, PurchaseListPagination, ReviewListPagination, ReviewPagination
+from .filters import BookFilter, BookSearchFilter, NullsLastOrderingFilter, OrderFilter, book_facets
+from .cache import cached_response, cache_stats
+from .conditional import conditional_response
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics
+from .analytics import bestsellers, category_series, revenue_series
+from .reservations import release
+from .fulfilment import OUTCOMES, transition_orders
+from .fieldsets import SparseFieldsViewMixin
+from .feeds import (
+    CONTENT_TYPES, FEED_FORMATS, FeedError, aiter_lines, export_books, export_orders, guess_format, import_books, text_stream,
+)
+
+# Staff CSV/JSONL exports (store.feeds) share their format handling
+def get_feed_format(request):
+    file_format = request.query_params.get('file_format', 'csv')
+    if file_format not in FEED_FORMATS:
+        raise ValidationError({'file_format': [f"Use one of {', '.join(FEED_FORMATS)}."]})
+    return file_format
+
+def feed_response(request, lines, file_format, name):
+    if isinstance(request._request, ASGIRequest):
+        # ASGI would read a sync iterator into memory before sending any of it
+        lines = aiter_lines(lines)
+    response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{name}.{file_format}"'
+    return response
 
-# Public: List all books with pagination, search, filter by category/price
-class BookViewSet(viewsets.ModelViewSet):
-    queryset = Book.objects.all().prefetch_related('reviews').order_by('id')
+# Public: List all books with pagination, search, filter by category/price.
+# Book, category, review and order reads take ?fields= / ?omit= (store.fieldsets).
+class BookViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
+    queryset = Book.objects.all().order_by('id')
     serializer_class = BookSerializer
     permission_classes = [IsAdminOrReadOnly]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter, DjangoFilterBackend]
-    search_fields = ['title', 'author', 'ISBN']
-    filterset_fields = ['category', 'price']
-    ordering_fields = ['price', 'published_date']
+    pagination_class = HybridPagination
+    filter_backends = [BookSearchFilter, NullsLastOrderingFilter, DjangoFilterBackend]
+    filterset_class = BookFilter
+    ordering_fields = ['price', 'published_date', 'average_rating', 'review_count']
+    cache_namespaces = ('books',)
+    # Newest reviews embedded in the detail response; the rest are paged
+    # through BookReviewListView starting at `reviews_next`
+    embedded_review_count = 5
+    extra_fields = ('reviews', 'reviews_next')
+    facets_param = 'facets'
 
-    # Public: Retrieve single book with details and reviews
+    # Public: List books, with facet counts for the filter sidebar on ?facets=true
+    @conditional_response
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        if self.wants_facets():
+            response.data['facets'] = book_facets(queryset)
+        return response
+
+    # Public: Retrieve single book with details and its latest reviews
+    @conditional_response
+    @cached_response
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        serializer = self.get_serializer(instance)
-        reviews = Review.objects.filter(book=instance)
-        review_serializer = ReviewSerializer(reviews, many=True)
-        data = serializer.data
-        data['reviews'] = review_serializer.data
+        data = self.get_serializer(instance).data
+        if self.wants_reviews():
+            paginator = self.get_review_paginator(instance)
+            reviews = paginator.paginate_from(Review.objects.filter(book=instance))
+            self.embed_reviews(data, reviews, paginator)
         return Response(data)
 
+    def wants_facets(self):
+        return self.request.query_params.get(self.facets_param, '').lower() in ('1', 'true', 'yes')
+
+    def wants_reviews(self):
+        # ?fields= / ?omit= without them skips the review query
+        return any(self.wants(name) for name in self.extra_fields)
+
+    def get_review_paginator(self, instance):
+        paginator = ReviewPagination()
+        paginator.page_size = self.embedded_review_count
+        paginator.base_url = reverse('book-review-list', kwargs={'book_id': instance.pk}, request=self.request)
+        return paginator
+
+    def embed_reviews(self, data, reviews, paginator):
+        if self.wants('reviews'):
+            data['reviews'] = ReviewSerializer(reviews, many=True).data
+        if self.wants('reviews_next'):
+            data['reviews_next'] = paginator.get_next_link()
+        return data
+
+    # Admin: Upsert books by ISBN from an uploaded CSV/JSONL feed
+    @action(detail=False, methods=['post'], url_path='import', url_name='import', permission_classes=[permissions.IsAdminUser],
+            parser_classes=[MultiPartParser])
+    def import_feed(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ["No feed file was submitted."]})
+        file_format = request.data.get('file_format') or guess_format(upload.name)
+        try:
+            summary = import_books(text_stream(upload.file), file_format)
+        except (FeedError, UnicodeDecodeError) as exc:
+            raise ValidationError({'file': [str(exc)]})
+        return Response(summary)
+
+    # Admin: Stream the (filtered) catalog as CSV/JSONL
+    @action(detail=False, methods=['get'], url_path='export', url_name='export', permission_classes=[permissions.IsAdminUser])
+    def export_feed(self, request):
+        file_format = get_feed_format(request)
+        queryset = self.filter_queryset(self.get_queryset())
+        return feed_response(request, export_books(queryset, file_format), file_format, 'books')
+
     # Admin: CRUD for books (handled by ModelViewSet + permissions)
 
 # Public: List all categories
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
+    cache_namespaces = ('categories',)
+
+    @conditional_response
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_response
+    @cached_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     # Admin: CRUD for categories (handled by ModelViewSet + permissions)
 
 # Public: List reviews for a book
-class BookReviewListView(generics.ListAPIView):
+class BookReviewListView(SparseFieldsViewMixin, generics.ListAPIView):
     serializer_class = ReviewSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = ReviewListPagination
+    cache_namespaces = ('reviews',)
 
     def get_queryset(self):
         book_id = self.kwargs['book_id']
         return Review.objects.filter(book_id=book_id)
 
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+# Authenticated: Books the user has bought, most recent first
+class PurchasedBookListView(generics.ListAPIView):
+    serializer_class = PurchasedBookSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PurchaseListPagination
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return PurchasedBook.objects.none()
+        return PurchasedBook.objects.filter(user_id=self.request.user.pk).select_related('book').order_by('-purchased_at', '-id')
+
 # Authenticated: Create/update/delete reviews (only if purchased the book)
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
+    pagination_class = HybridPagination
 
     def get_permissions(self):
         if self.action in ['update', 'partial_update', 'destroy']:
@@ -64,11 +193,21 @@ class ReviewViewSet(viewsets.ModelViewSet):
         return [permissions.AllowAny()]
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        serializer.save(user_id=self.request.user.pk)
 
 # Authenticated: Place an order, list user’s past orders
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
+    pagination_class = HybridPagination
+    filterset_class = OrderFilter
+    # ?representation=summary returns counts and totals without nested items
+    representation_param = 'representation'
+
+    def is_summary(self):
+        return (
+            self.action in ['list', 'retrieve']
+            and self.request.query_params.get(self.representation_param) == 'summary'
+        )
 
     def get_queryset(self):
         # Short-circuit for schema generation
@@ -76,13 +215,25 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Order.objects.none()
         user = self.request.user
         if user.is_staff:
-            return Order.objects.all()
-        if user.is_authenticated:
-            return Order.objects.filter(user=user)
-        return Order.objects.none()
+            queryset = Order.objects.all()
+        elif user.is_authenticated:
+            queryset = Order.objects.filter(user_id=user.pk)
+        else:
+            return Order.objects.none()
+        if self.is_summary():
+            return queryset.annotate(item_count=Count('items'), total_quantity=Sum('items__quantity'))
+        if self.action in ['list', 'retrieve', 'update', 'partial_update'] and self.wants('items'):
+            # Items and their books in one extra query for the whole page
+            queryset = queryset.prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('book')))
+        return queryset
+
+    def get_serializer_class(self):
+        if self.is_summary():
+            return OrderSummarySerializer
+        return super().get_serializer_class()
 
     def get_permissions(self):
-        if self.action in ['update', 'partial_update', 'destroy']:
+        if self.action in ['update', 'partial_update', 'destroy', 'update_status', 'bulk_status', 'export_feed']:
             return [permissions.IsAdminUser()]
         elif self.action in ['list', 'retrieve']:
             return [permissions.IsAuthenticated()]
@@ -91,7 +242,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         return [permissions.IsAuthenticated()]
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        serializer.save(user_id=self.request.user.pk)
 
     # Admin: Update order status
     @action(detail=True, methods=['patch'], permission_classes=[permissions.IsAdminUser])
@@ -104,6 +255,120 @@ class OrderViewSet(viewsets.ModelViewSet):
         order.save(update_fields=['status'])
         return Response({'status': order.status})
 
+    # Admin: Move many orders forward at once, by id or by the list filters
+    @action(detail=False, methods=['post'], url_path='bulk-status', url_name='bulk-status',
+            permission_classes=[permissions.IsAdminUser])
+    def bulk_status(self, request):
+        serializer = BulkStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if 'ids' in data:
+            order_ids = data['ids']
+        else:
+            filterset = OrderFilter(data=data['filter'], queryset=Order.objects.all())
+            if not filterset.is_valid():
+                raise ValidationError({'filter': filterset.errors})
+            limit = serializer.max_orders
+            order_ids = list(filterset.qs.order_by('pk').values_list('pk', flat=True)[:limit + 1])
+            if len(order_ids) > limit:
+                raise ValidationError({'filter': [f"Matches more than {limit} orders; narrow it down."]})
+        outcomes = transition_orders(order_ids, data['status'])
+        counts = dict.fromkeys(OUTCOMES, 0)
+        for outcome in outcomes.values():
+            counts[outcome] += 1
+        return Response({'status': data['status'], 'counts': counts, 'results': outcomes})
+
+    # Admin: Stream order history, a row per item with its book, as CSV/JSONL.
+    # Takes the list filters (?status=, ?order_date__gte=, ?order_date__lte=, ...)
+    @action(detail=False, methods=['get'], url_path='export', url_name='export', permission_classes=[permissions.IsAdminUser])
+    def export_feed(self, request):
+        file_format = get_feed_format(request)
+        orders = self.filter_queryset(self.get_queryset())
+        return feed_response(request, export_orders(orders, file_format), file_format, 'orders')
+
+# Admin: Hit/miss counters of the catalog response cache
+class CacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(cache_stats(['books', 'categories', 'reviews']))
+
+# Authenticated: Hold stock during checkout. POST {"items": [...], "ttl": s}
+# reserves all or nothing, placing an order converts the holds on its books,
+# DELETE releases one early.
+class StockReservationViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                              mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    serializer_class = StockReservationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = None
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return StockReservation.objects.none()
+        return StockReservation.objects.filter(
+            user_id=self.request.user.pk, expires_at__gt=timezone.now(),
+        ).select_related('book')
+
+    def create(self, request, *args, **kwargs):
+        serializer = ReserveSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        reserved = [reservation.pk for reservation in serializer.save()]
+        reservations = StockReservation.objects.filter(pk__in=reserved).select_related('book')
+        return Response(self.get_serializer(reservations, many=True).data, status=status.HTTP_201_CREATED)
+
+    def perform_destroy(self, instance):
+        release(StockReservation.objects.filter(pk=instance.pk))
+
+# Admin: Sales analytics from the daily rollup tables (store.analytics).
+# All take ?start=&end= (ISO dates, default the last 30 days).
+class SalesAnalyticsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    result_serializer_class = None
+
+    def get(self, request):
+        query = SalesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        rows = self.get_rows(params)
+        return Response({
+            'start': params['start'],
+            'end': params['end'],
+            'results': self.result_serializer_class(rows, many=True).data,
+        })
+
+    def get_rows(self, params):
+        raise NotImplementedError
+
+# Admin: Orders, units and revenue per ?interval=day|week|month, optionally ?status=
+class SalesRevenueView(SalesAnalyticsView):
+    result_serializer_class = SalesPeriodSerializer
+
+    def get_rows(self, params):
+        return revenue_series(params['start'], params['end'], params['interval'], params.get('status'))
+
+# Admin: Sales per category and ?interval=, optionally for one ?category=
+class CategorySalesView(SalesAnalyticsView):
+    result_serializer_class = CategorySalesSerializer
+
+    def get_rows(self, params):
+        return category_series(params['start'], params['end'], params['interval'], params.get('category'))
+
+# Admin: Top ?limit= books by ?rank_by=units|revenue|orders, optionally in one ?category=
+class BestsellersView(SalesAnalyticsView):
+    result_serializer_class = BestsellerSerializer
+
+    def get_rows(self, params):
+        return bestsellers(params['start'], params['end'], params['limit'], params.get('category'), params['rank_by'])
+
+# Monitoring: Request metrics of every worker in Prometheus text format.
+# Plain Django view so scrapes skip DRF's negotiation and authentication.
+class MetricsView(View):
+    def get(self, request):
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+        return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
 # Public: User registration using ProfileSerializer
 class UserRegistrationView(generics.CreateAPIView):
     serializer_class = ProfileSerializer